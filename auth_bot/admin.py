@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BaleUser, ChatSession
+from .models import BaleUser, ChatSession, ChatTurn, PollingOffset
 
 
 # Custom Admin for BaleUser
@@ -17,18 +17,18 @@ class BaleUserAdmin(admin.ModelAdmin):
         'token_limit'
     )
     # Fields to filter the list view
-    list_filter = ('is_authenticated', 'assistant_role', 'system_role')
+    list_filter = ('is_authenticated', 'dialog_state', 'assistant_role', 'system_role')
     # Fields for searching
     search_fields = ('phone_number', 'chat_id')
     # Fields that are read-only
-    readonly_fields = ('current_message_count',)
+    readonly_fields = ('current_message_count', 'quota_day')
     # Sections and fields to display in the edit form
     fieldsets = (
         ('Basic Information', {
-            'fields': ('phone_number', 'chat_id', 'is_authenticated')
+            'fields': ('phone_number', 'chat_id', 'is_authenticated', 'dialog_state')
         }),
         ('Settings', {
-            'fields': ('daily_message_limit', 'current_message_count', 'token_limit', 'assistant_role', 'system_role')
+            'fields': ('daily_message_limit', 'current_message_count', 'quota_day', 'token_limit', 'assistant_role', 'system_role')
         }),
     )
     # Pagination for large datasets
@@ -50,7 +50,7 @@ class ChatSessionAdmin(admin.ModelAdmin):
     # Fields for searching
     search_fields = ('user__phone_number', 'assistant_role', 'system_role')
     # Fields that are read-only
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'summary_until', 'summarized_turns', 'summary_source_tokens')
     # Sections and fields to display in the edit form
     fieldsets = (
         ('User Information', {
@@ -59,6 +59,41 @@ class ChatSessionAdmin(admin.ModelAdmin):
         ('Chat Details', {
             'fields': ('user_message', 'bot_response', 'assistant_role', 'system_role', 'created_at')
         }),
+        ('Summary', {
+            'fields': ('summary', 'summary_until', 'summarized_turns', 'summary_source_tokens')
+        }),
     )
     # Pagination for large datasets
     list_per_page = 25
+
+
+# Custom Admin for ChatTurn
+@admin.register(ChatTurn)
+class ChatTurnAdmin(admin.ModelAdmin):
+    # Fields to display in the list view
+    list_display = (
+        'user',
+        'session',
+        'assistant_role',
+        'token_count',
+        'created_at'
+    )
+    # The table grows by one row per message: avoid dropdowns and full counts
+    raw_id_fields = ('user', 'session')
+    list_select_related = ('user',)
+    show_full_result_count = False
+    # Fields for searching
+    search_fields = ('user__phone_number',)
+    # Fields that are read-only
+    readonly_fields = ('token_count', 'created_at')
+    # Pagination for large datasets
+    list_per_page = 25
+
+
+# Custom Admin for PollingOffset
+@admin.register(PollingOffset)
+class PollingOffsetAdmin(admin.ModelAdmin):
+    # Fields to display in the list view
+    list_display = ('name', 'offset', 'updated_at')
+    # Fields that are read-only
+    readonly_fields = ('updated_at',)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AuthBotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auth_bot'
+
+    def ready(self):
+        # Connect the BaleUser cache invalidation signals
+        from . import user_cache  # noqa: F401
+        # Connect the SQLite connection setup (WAL, busy timeout)
+        from . import db  # noqa: F401
+        # Register the system checks for multi-worker deployments
+        from . import checks  # noqa: F401
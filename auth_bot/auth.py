@@ -1,80 +1,220 @@
-import random
+import json
+import re
+import httpx
+import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from kavenegar import KavenegarAPI, APIException, HTTPException
 
+from .http_client import http_request, ahttp_request
 from .models import BaleUser
-from .utils import send_message_to_bale
+from . import sms
+from .otp_store import LOCKED, MISSING, THROTTLED, VERIFIED, otp_store
+from .user_cache import get_cached_user
+from .utils import send_message_to_bale, asend_message_to_bale
 
-def handle_login_command(chat_id):
+OTP_SENT_MESSAGE = "کد تأیید برای شماره موبایل شما ارسال شد. لطفاً کد را وارد کنید."
+OTP_QUEUED_MESSAGE = "کد تأیید در حال ارسال به شماره موبایل شما است. لطفاً کد را وارد کنید."
+OTP_THROTTLED_MESSAGE = "تعداد درخواست‌ها بیش از حد مجاز است. لطفاً چند دقیقه دیگر دوباره تلاش کنید."
+
+_KAVENEGAR_KEY_PATH = re.compile(r"/v1/[^/\s]+/")
+
+def handle_login_command(chat_id, user=None):
     """
     When the user sends the /login command, prompt them for their phone number.
     """
-    user, _ = BaleUser.objects.get_or_create(chat_id=chat_id)
-    # Ensure the user is saved in the DB, even if newly created
-    user.save()
+    if user is None:
+        # Ensure the user is saved in the DB, even if newly created
+        user, _ = BaleUser.objects.get_or_create(chat_id=chat_id)
+    user.set_dialog_state(BaleUser.DIALOG_AWAITING_PHONE)
     send_message_to_bale(chat_id, "لطفاً شماره موبایل خود را وارد کنید.")
 
-def handle_phone_number(chat_id, phone_number):
+def issue_otp(chat_id, phone_number, user=None):
     """
-    Upon receiving a phone number (e.g., '09xxxxxxxxx'),
-    generate an OTP and send it to the user via Kavenegar.
+    Store the phone number on the user, generate a fresh OTP and return it.
+    Returns None (and changes nothing) when this chat or phone number has
+    asked for too many codes recently.
     """
-    user, _ = BaleUser.objects.get_or_create(chat_id=chat_id)
+    if not otp_store.allow_send(chat_id, phone_number):
+        return None
+    if user is None:
+        user, _ = BaleUser.objects.get_or_create(chat_id=chat_id)
     user.phone_number = phone_number
-
-    # Generate OTP
-    otp = str(random.randint(100000, 999999))
-    user.otp = otp
     user.is_authenticated = False
-    user.save()
+    user.dialog_state = BaleUser.DIALOG_AWAITING_OTP
+    user.save(update_fields=['phone_number', 'is_authenticated', 'dialog_state'])
+    return otp_store.issue(chat_id)
 
-    # Send OTP via Kavenegar
+def _kavenegar_url(apikey, action, method):
+    base_url = getattr(settings, 'KAVENEGAR_API_BASE_URL', 'https://api.kavenegar.com')
+    return f"{base_url}/v1/{apikey}/{action}/{method}.json"
+
+def _transport_error(error):
+    """
+    HTTPException for a failed Kavenegar call. The requests/httpx message
+    quotes the URL, whose path carries the API key; that segment is masked
+    so the key never reaches the SMS logs or stats.
+    """
+    return HTTPException(f"{type(error).__name__}: {_KAVENEGAR_KEY_PATH.sub('/v1/***/', str(error))}")
+
+def _parse_kavenegar_response(content):
+    """
+    Mirror the Kavenegar SDK: return 'entries' or raise APIException/HTTPException.
+    """
     try:
-        api = KavenegarAPI(settings.KAVEH_NEGAR_API_KEY)
-        params = {
-            'receptor': phone_number,
-            'token': otp,
-            'template': 'users'
-        }
-        api.verify_lookup(params)
-        send_message_to_bale(
-            chat_id,
-            "کد تأیید برای شماره موبایل شما ارسال شد. لطفاً کد را وارد کنید."
+        response = json.loads(content.decode("utf-8"))
+    except ValueError as e:
+        raise HTTPException(e)
+    if response['return']['status'] != 200:
+        raise APIException(
+            f"APIException[{response['return']['status']}] {response['return']['message']}"
         )
-    except (APIException, HTTPException) as e:
-        send_message_to_bale(
-            chat_id,
-            "خطایی در ارسال کد OTP رخ داد. لطفاً دوباره تلاش کنید."
-        )
-        print(f"Error sending OTP: {e}")
+    return response['entries']
+
+class PooledKavenegarAPI(KavenegarAPI):
+    """
+    KavenegarAPI that goes through the shared keep-alive session (with timeouts)
+    instead of opening a fresh connection for every SMS.
+    """
+
+    def _request(self, action, method, params={}):
+        url = _kavenegar_url(self.apikey, action, method)
+        try:
+            response = http_request(
+                "POST", url, headers=self.headers, data=params,
+                read_timeout=getattr(settings, 'KAVENEGAR_READ_TIMEOUT', 5.0)
+            )
+        except requests.exceptions.RequestException as e:
+            raise _transport_error(e) from None
+        return _parse_kavenegar_response(response.content)
+
+_kavenegar_api = None
+
+def get_kavenegar_api():
+    """
+    Return the process-wide Kavenegar client for the configured API key.
+    """
+    global _kavenegar_api
+    if _kavenegar_api is None or _kavenegar_api.apikey != settings.KAVEH_NEGAR_API_KEY:
+        _kavenegar_api = PooledKavenegarAPI(settings.KAVEH_NEGAR_API_KEY)
+    return _kavenegar_api
 
-def handle_otp(chat_id, otp):
+def send_otp_sms(phone_number, otp):
     """
-    Verify the given OTP matches the user's stored code.
+    Send the OTP to the phone number via Kavenegar's verify/lookup API.
+    Raises Kavenegar's APIException / HTTPException on failure.
     """
+    params = {
+        'receptor': phone_number,
+        'token': otp,
+        'template': 'users'
+    }
+    get_kavenegar_api().verify_lookup(params)
+
+async def asend_otp_sms(phone_number, otp):
+    """
+    Async counterpart of send_otp_sms. Calls the same Kavenegar endpoint through
+    the shared async HTTP client and raises the same exception types.
+    """
+    url = _kavenegar_url(settings.KAVEH_NEGAR_API_KEY, 'verify', 'lookup')
+    params = {
+        'receptor': phone_number,
+        'token': otp,
+        'template': 'users'
+    }
     try:
-        user = BaleUser.objects.get(chat_id=chat_id, otp=otp)
+        response = await ahttp_request(
+            "POST", url, data=params,
+            read_timeout=getattr(settings, 'KAVENEGAR_READ_TIMEOUT', 5.0)
+        )
+    except httpx.HTTPError as e:
+        raise _transport_error(e) from None
+    return _parse_kavenegar_response(response.content)
+
+def handle_phone_number(chat_id, phone_number, user=None):
+    """
+    Upon receiving a phone number (e.g., '09xxxxxxxxx'), generate an OTP and
+    send it via Kavenegar. In the default "queue" OTP_SMS_MODE the SMS goes
+    to background senders and the user is told at once that it is on the way.
+    """
+    otp = issue_otp(chat_id, phone_number, user)
+    if otp is None:
+        send_message_to_bale(chat_id, OTP_THROTTLED_MESSAGE)
+        return
+
+    if sms.sms_queue_mode():
+        if sms.queue_otp_sms(chat_id, phone_number, otp):
+            send_message_to_bale(chat_id, OTP_QUEUED_MESSAGE)
+        else:
+            send_message_to_bale(chat_id, sms.OTP_SMS_FAILED_MESSAGE)
+    elif sms.deliver_otp(chat_id, phone_number, otp):
+        send_message_to_bale(chat_id, OTP_SENT_MESSAGE)
+    else:
+        send_message_to_bale(chat_id, sms.OTP_SMS_FAILED_MESSAGE)
+
+async def ahandle_phone_number(chat_id, phone_number, user=None):
+    """
+    Async counterpart of handle_phone_number for the ASGI webhook.
+    """
+    otp = await sync_to_async(issue_otp)(chat_id, phone_number, user)
+    if otp is None:
+        await asend_message_to_bale(chat_id, OTP_THROTTLED_MESSAGE)
+        return
+
+    if sms.sms_queue_mode():
+        # Never blocks: the queue put has no timeout
+        if sms.queue_otp_sms(chat_id, phone_number, otp):
+            await asend_message_to_bale(chat_id, OTP_QUEUED_MESSAGE)
+        else:
+            await asend_message_to_bale(chat_id, sms.OTP_SMS_FAILED_MESSAGE)
+    elif await sms.adeliver_otp(chat_id, phone_number, otp):
+        await asend_message_to_bale(chat_id, OTP_SENT_MESSAGE)
+    else:
+        await asend_message_to_bale(chat_id, sms.OTP_SMS_FAILED_MESSAGE)
+
+def handle_otp(chat_id, otp, user=None):
+    """
+    Verify the given OTP against the code issued to this chat. Wrong guesses
+    only touch the OTP store; the user row is written once the code matches.
+    """
+    status = otp_store.verify(chat_id, otp)
+    if status == VERIFIED:
+        if user is None:
+            user, _ = BaleUser.objects.get_or_create(chat_id=chat_id)
         user.is_authenticated = True
-        user.otp = ''
-        user.save()
+        user.dialog_state = BaleUser.DIALOG_IDLE
+        user.save(update_fields=['is_authenticated', 'dialog_state'])
         send_message_to_bale(
             chat_id,
             "احراز هویت موفق بود! اکنون می‌توانید از خدمات استفاده کنید. 🌟"
         )
-    except BaleUser.DoesNotExist:
+    elif status == THROTTLED:
+        send_message_to_bale(chat_id, OTP_THROTTLED_MESSAGE)
+    elif status == LOCKED or (status == MISSING and user is not None
+                              and user.dialog_state == BaleUser.DIALOG_AWAITING_OTP):
+        # The code is used up or expired: ask for the phone number again
+        if user is not None:
+            user.set_dialog_state(BaleUser.DIALOG_AWAITING_PHONE)
+        send_message_to_bale(
+            chat_id,
+            "کد تأیید منقضی شده است. لطفاً شماره موبایل خود را دوباره وارد کنید تا کد جدید ارسال شود."
+        )
+    else:
         send_message_to_bale(
             chat_id,
             "کد واردشده نامعتبر است. لطفاً دوباره تلاش کنید."
         )
 
-def handle_logout_command(chat_id):
+def handle_logout_command(chat_id, user=None):
     """
     When the user sends /logout, mark them as logged out.
     """
-    user = BaleUser.objects.filter(chat_id=chat_id).first()
+    if user is None:
+        user = get_cached_user(chat_id)
     if user:
         user.is_authenticated = False
-        user.save()
+        user.dialog_state = BaleUser.DIALOG_IDLE
+        user.save(update_fields=['is_authenticated', 'dialog_state'])
         send_message_to_bale(
             chat_id,
             "شما با موفقیت از سیستم خارج شدید. 🌟"
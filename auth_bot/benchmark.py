@@ -0,0 +1,227 @@
+import json
+import math
+import os
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connection, connections
+
+from .models import BaleUser
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers (0 for an empty list).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, elapsed):
+    """
+    Throughput and latency percentiles (in milliseconds) for one benchmark run.
+    """
+    return {
+        "count": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+@contextmanager
+def isolated_database(alias="default"):
+    """
+    Run a benchmark against a throwaway test database instead of the real one.
+    SQLite gets an on-disk file so that worker threads share the same data.
+    """
+    connection = connections[alias]
+    tmp_path = None
+    if connection.vendor == "sqlite" and not connection.settings_dict["TEST"].get("NAME"):
+        fd, tmp_path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        connection.settings_dict["TEST"]["NAME"] = tmp_path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if tmp_path:
+            connection.settings_dict["TEST"]["NAME"] = None
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def seed_chat_users(count, prefix="bench"):
+    """
+    Create `count` authenticated users with an effectively unlimited quota.
+    Returns their chat ids.
+    """
+    users = [
+        BaleUser(
+            chat_id=f"{prefix}-{i}",
+            phone_number=f"0990{i:07d}",
+            is_authenticated=True,
+            daily_message_limit=10 ** 6,
+        )
+        for i in range(count)
+    ]
+    BaleUser.objects.bulk_create(users)
+    return [user.chat_id for user in users]
+
+
+def chat_updates(chat_ids, count, text="سلام دکتر، از دیروز سردرد دارم. چه کنم؟"):
+    """
+    Build `count` chat-message updates spread round-robin over chat_ids.
+    """
+    return [
+        {
+            "update_id": i,
+            "message": {"chat": {"id": chat_ids[i % len(chat_ids)]}, "text": text},
+        }
+        for i in range(count)
+    ]
+
+
+SAMPLE_QUESTIONS = (
+    "سلام دکتر، از دیروز سردرد دارم. چه کنم؟",
+    "شب‌ها خوابم نمی‌برد، راهکاری دارید؟",
+    "آیا ورزش صبحگاهی برای فشار خون مفید است؟",
+    "بعد از غذا احساس سنگینی می‌کنم.",
+    "چطور استرس امتحان را کم کنم؟",
+)
+
+
+def conversation_script(chat_id, phone_number, turns, login=True, role=1, questions=SAMPLE_QUESTIONS):
+    """
+    The texts one user sends, in order, as (kind, text) pairs: optionally the
+    /login flow, then role selection and confirmation, `turns` chat messages
+    and '#'. The OTP step's text is None; the caller fills in the code the
+    Kavenegar stub received.
+    """
+    steps = [("start", "/start")]
+    if login:
+        steps += [("login", "/login"), ("phone", phone_number), ("otp", None)]
+    steps += [("startchat", "/startchat"), ("role", str(role)), ("confirm", "1")]
+    offset = sum(map(ord, chat_id))
+    steps += [("chat", questions[(offset + turn) % len(questions)]) for turn in range(turns)]
+    steps.append(("end_chat", "#"))
+    return steps
+
+
+def git_revision():
+    """
+    Short hash of the checked-out commit ('' outside a git checkout).
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def load_results(path):
+    """
+    Earlier benchmark records stored by store_result (oldest first).
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def store_result(path, record):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, sort_keys=True) + "\n")
+
+
+def previous_result(results, scenario):
+    """
+    The most recent stored record that ran the same scenario, or None.
+    """
+    for record in reversed(results):
+        if record.get("scenario") == scenario:
+            return record
+    return None
+
+
+def compare_results(previous, current, keys=("per_sec", "p50_ms", "p95_ms", "p99_ms", "queries")):
+    """
+    Relative change (in percent) of each key between two summaries.
+    """
+    changes = {}
+    for key in keys:
+        before, after = previous.get(key), current.get(key)
+        if before and after is not None:
+            changes[key] = round((after - before) / before * 100, 1)
+    return changes
+
+
+def timed_post(client, url, update):
+    """
+    POST one update through a django.test.Client and return
+    (seconds, DB queries run by this thread, HTTP status).
+    """
+    queries = [0]
+
+    def count_query(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    with connection.execute_wrapper(count_query):
+        status = client.post(url, json.dumps(update), content_type="application/json").status_code
+    return time.perf_counter() - started, queries[0], status
+
+
+def summarize_samples(samples, elapsed):
+    """
+    Overall and per-type summaries of (kind, seconds, queries, status)
+    samples, with average queries per update and the non-200 count.
+    """
+    def summary(rows):
+        data = summarize([row[1] for row in rows], elapsed)
+        data["queries"] = round(sum(row[2] for row in rows) / len(rows), 1) if rows else 0.0
+        data["errors"] = sum(1 for row in rows if row[3] != 200)
+        return data
+
+    grouped = defaultdict(list)
+    for row in samples:
+        grouped[row[0]].append(row)
+    return summary(samples), {kind: summary(rows) for kind, rows in sorted(grouped.items())}
+
+
+def format_report(record, previous):
+    """
+    Lines of a per-type result table, followed by the change since `previous`.
+    """
+    lines = [
+        f"{'type':<12}{'count':>7}{'upd/s':>9}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'queries':>9}{'errors':>8}"
+    ]
+    rows = list(record["by_type"].items()) + [("all", record["overall"])]
+    for kind, result in rows:
+        lines.append(
+            f"{kind:<12}{result['count']:>7}{result['per_sec']:>9}{result['p50_ms']:>10}"
+            f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['queries']:>9}{result['errors']:>8}"
+        )
+    if previous is None:
+        lines.append("No earlier run of this scenario to compare with.")
+        return lines
+    lines.append(f"Change since {previous.get('commit') or 'unknown'} ({previous.get('timestamp')}):")
+    for kind, result in rows:
+        before = previous["overall"] if kind == "all" else previous["by_type"].get(kind)
+        if not before:
+            continue
+        changes = compare_results(before, result)
+        lines.append(f"  {kind:<10}" + "  ".join(f"{key} {change:+.1f}%" for key, change in changes.items()))
+    return lines
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _process_local(alias):
+    return settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_CACHES
+
+
+@register()
+def check_shared_state(app_configs, **kwargs):
+    """
+    With several web workers (WEB_CONCURRENCY, as read by gunicorn), state
+    kept per process is not seen by the other workers.
+    """
+    if getattr(settings, 'WEB_CONCURRENCY', 1) <= 1:
+        return []
+    warnings = []
+    if getattr(settings, 'USER_CACHE_ENABLED', True):
+        backend = getattr(settings, 'USER_CACHE_BACKEND', 'local')
+        alias = getattr(settings, 'USER_CACHE_ALIAS', 'default')
+        if backend != 'shared' or _process_local(alias):
+            warnings.append(Warning(
+                "The user cache is per process, so workers can serve a stale "
+                "dialog state or login after another worker changed it.",
+                hint="Set USER_CACHE_BACKEND=shared with USER_CACHE_ALIAS pointing "
+                     "at a cache all workers share (e.g. Redis).",
+                id='auth_bot.W001',
+            ))
+    if _process_local(getattr(settings, 'OTP_CACHE_ALIAS', 'default')):
+        warnings.append(Warning(
+            "OTP codes and send limits are kept per process, so a code sent by "
+            "one worker is unknown to the others and every worker allows its "
+            "own burst of SMS.",
+            hint="Point OTP_CACHE_ALIAS at a cache all workers share (e.g. Redis).",
+            id='auth_bot.W002',
+        ))
+    return warnings
@@ -0,0 +1,149 @@
+import math
+import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+# One pass of a single compiled regex splits the text into runs of digits
+# (Latin or Persian), Persian/Arabic letters, Latin letters and single symbols, so the
+# estimate costs a C-level scan instead of a Python loop per character.
+_TOKEN_RUNS = re.compile(
+    r"(?P<digits>[0-9\u06F0-\u06F9\u0660-\u0669]+)"
+    r"|(?P<persian>[\u0600-\u06FF\u0750-\u077F\uFB50-\uFDFF\uFE70-\uFEFF\u200C]+)"
+    r"|(?P<latin>[A-Za-z]+)"
+    r"|(?P<symbol>\S)"
+)
+
+# Average characters per BPE token for each kind of run (GPT-4o family).
+_CHARS_PER_TOKEN = {"persian": 2.5, "latin": 4.0, "digits": 3.0, "symbol": 1.0}
+
+# Chat formatting overhead the API adds around every message.
+MESSAGE_OVERHEAD = 4
+
+# Smallest slice worth keeping when an old turn has to be cut down.
+MIN_TRUNCATED_TOKENS = 24
+
+ELLIPSIS = " …"
+
+
+def _count_tokens(text):
+    total = 0.0
+    for match in _TOKEN_RUNS.finditer(text):
+        total += math.ceil(len(match.group()) / _CHARS_PER_TOKEN[match.lastgroup])
+    return int(total)
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text):
+    """
+    Estimate the number of model tokens in text without a remote tokenizer.
+    Results are cached, so repeated history turns and system prompts are free.
+    """
+    if not text:
+        return 0
+    return _count_tokens(text)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Deterministically cut text down to roughly max_tokens, keeping its start.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _count_tokens(text[:middle]) + 1 <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + ELLIPSIS
+
+
+ChatContext = namedtuple(
+    'ChatContext',
+    ['user_messages', 'assistant_messages', 'prompt_tokens', 'tokens_saved', 'turns_used', 'turns_truncated'],
+)
+
+
+class _ContextStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.tokens_saved = 0
+
+    def record(self, context):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += context.prompt_tokens
+            self.tokens_saved += context.tokens_saved
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+context_stats = _ContextStats()
+
+
+def build_context(system_prompt, turns, new_message, token_budget):
+    """
+    Pack the system prompt, previous turns and the new message into token_budget.
+
+    `turns` are objects with user_message / bot_response, oldest first. The
+    system prompt and the new message always go in; turns are then added
+    newest-first while they fit. The first turn that does not fit is cut down
+    (its answer first) if enough budget is left, and everything older is
+    dropped. Returns a ChatContext with the talk_to_bot message lists and how
+    many prompt tokens were saved compared with sending every turn in full.
+    """
+    fixed = estimate_tokens(system_prompt) + estimate_tokens(new_message) + 2 * MESSAGE_OVERHEAD
+    available = token_budget - fixed
+
+    picked = []
+    full_cost = 0
+    used = 0
+    truncated = 0
+    for turn in reversed(turns):
+        question_tokens = estimate_tokens(turn.user_message) + MESSAGE_OVERHEAD
+        answer_tokens = estimate_tokens(turn.bot_response) + MESSAGE_OVERHEAD
+        cost = question_tokens + answer_tokens
+        full_cost += cost
+        if available is None:
+            continue
+        if used + cost <= available:
+            picked.append((turn.user_message, turn.bot_response))
+            used += cost
+            continue
+
+        # Try to keep a shortened version of this turn, then stop.
+        room = available - used - 2 * MESSAGE_OVERHEAD
+        if room >= MIN_TRUNCATED_TOKENS:
+            question = truncate_to_tokens(turn.user_message, max(room // 3, MIN_TRUNCATED_TOKENS // 2))
+            answer = truncate_to_tokens(turn.bot_response, room - estimate_tokens(question))
+            picked.append((question, answer))
+            used += estimate_tokens(question) + estimate_tokens(answer) + 2 * MESSAGE_OVERHEAD
+            truncated += 1
+        available = None
+    picked.reverse()
+
+    user_messages = [{"role": "user", "content": question} for question, _ in picked]
+    assistant_messages = [{"role": "assistant", "content": answer} for _, answer in picked]
+    user_messages.append({"role": "user", "content": new_message})
+
+    context = ChatContext(
+        user_messages=user_messages,
+        assistant_messages=assistant_messages,
+        prompt_tokens=fixed + used,
+        tokens_saved=full_cost - used,
+        turns_used=len(picked),
+        turns_truncated=truncated,
+    )
+    context_stats.record(context)
+    return context
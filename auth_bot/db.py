@@ -0,0 +1,82 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+REPLICA_ALIAS = 'replica'
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Put every new SQLite connection in WAL mode with a busy timeout, so
+    readers never block the writer and concurrent writers wait for the lock
+    instead of failing with "database is locked".
+    """
+    journal_mode = getattr(settings, 'SQLITE_JOURNAL_MODE', 'wal')
+    if connection.vendor != 'sqlite' or not journal_mode:
+        # An empty SQLITE_JOURNAL_MODE keeps SQLite's own defaults
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA busy_timeout={int(getattr(settings, 'SQLITE_BUSY_TIMEOUT', 20000))}")
+        if journal_mode.lower() == 'wal':
+            # Safe with WAL: a crash can lose the last commits, never corrupt the file
+            cursor.execute("PRAGMA synchronous=NORMAL")
+
+
+@contextmanager
+def use_replica():
+    """
+    Send every read made inside the block to the replica (when one is configured).
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Reads inside use_replica() (admin pages, reports) go to the 'replica'
+    database; everything else, including all writes, uses 'default'. The
+    bot's own reads stay on 'default' because it reads back what it just
+    wrote (the turn stored for the previous message), which a lagging
+    replica may not have yet.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and REPLICA_ALIAS in connections.databases:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
+
+
+class ReplicaReadsMiddleware:
+    """
+    Serve the admin's GET pages (change lists, history) from the replica.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method == 'GET' and request.path.startswith(getattr(settings, 'DB_REPLICA_PATH_PREFIX', '/admin/')):
+            with use_replica():
+                return self.get_response(request)
+        return self.get_response(request)
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+
+
+class UpdateDeduplicator:
+    """
+    Remembers the update_ids of Bale updates so redeliveries are dropped
+    before any handler runs.
+
+    Ids live in a bounded in-process LRU with a TTL. With a cache alias
+    configured (shared backend, e.g. Redis or the database cache) the id is
+    also claimed there with cache.add(), which is atomic across processes.
+    A duplicate that arrives while the first copy is still being handled in
+    this process can wait for it (single flight): if the first copy fails
+    and is released, the waiter takes over instead of being dropped.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600, alias=None, prefix="bale-update:", wait_timeout=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.alias = alias
+        self.prefix = prefix
+        self.wait_timeout = wait_timeout
+        self._seen = OrderedDict()
+        self._events = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "claimed": 0,
+            "suppressed": 0,
+            "coalesced": 0,
+            "released": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _claim_local(self, key):
+        """
+        Return None when the id was claimed here, else the state of the earlier claim.
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._seen.get(key)
+            if item is not None and item[0] >= now:
+                return item[1]
+            self._seen[key] = (now + self.ttl, PENDING)
+            self._seen.move_to_end(key)
+            self._events[key] = threading.Event()
+            while len(self._seen) > self.maxsize:
+                old_key, _ = self._seen.popitem(last=False)
+                self._events.pop(old_key, None)
+            return None
+
+    def begin(self, update_id, wait=True):
+        """
+        Claim an update. Returns True if the caller should process it, False
+        if it is a duplicate. With wait=True a duplicate of an update still in
+        progress in this process blocks until that one finishes or is released.
+        """
+        key = str(update_id)
+        state = self._claim_local(key)
+        if state == PENDING and wait:
+            with self._lock:
+                event = self._events.get(key)
+            if event is not None:
+                self._count("coalesced")
+                event.wait(self.wait_timeout)
+                state = self._claim_local(key)
+        if state is not None:
+            self._count("suppressed")
+            logger.debug("Suppressed redelivered update %s", key)
+            return False
+
+        if self.alias and not caches[self.alias].add(self.prefix + key, 1, self.ttl):
+            # Another process has it. Don't remember it here: if that process
+            # releases the id, a redelivery must reach the shared claim again.
+            self._finish_local(key, None)
+            self._count("suppressed")
+            return False
+
+        self._count("claimed")
+        return True
+
+    def _finish_local(self, key, state):
+        with self._lock:
+            if state is None:
+                self._seen.pop(key, None)
+            elif key in self._seen:
+                self._seen[key] = (self._seen[key][0], state)
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def finish(self, update_id):
+        """
+        Mark a claimed update as handled; redeliveries stay suppressed until the TTL ends.
+        """
+        self._finish_local(str(update_id), DONE)
+
+    def release(self, update_id):
+        """
+        Forget a claimed update that failed, so a redelivery is processed again.
+        """
+        key = str(update_id)
+        if self.alias:
+            caches[self.alias].delete(self.prefix + key)
+        self._finish_local(key, None)
+        self._count("released")
+
+    def clear(self):
+        with self._lock:
+            events = list(self._events.values())
+            self._seen.clear()
+            self._events.clear()
+        for event in events:
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["tracked"] = len(self._seen)
+            data["in_flight"] = len(self._events)
+        return data
+
+
+def _build_deduplicator():
+    alias = None
+    if getattr(settings, 'UPDATE_DEDUP_BACKEND', 'local') == 'shared':
+        alias = getattr(settings, 'UPDATE_DEDUP_ALIAS', 'default')
+    return UpdateDeduplicator(
+        maxsize=getattr(settings, 'UPDATE_DEDUP_SIZE', 10000),
+        ttl=getattr(settings, 'UPDATE_DEDUP_TTL', 3600),
+        alias=alias,
+        wait_timeout=getattr(settings, 'UPDATE_DEDUP_WAIT', 30.0),
+    )
+
+
+update_dedup = _build_deduplicator()
@@ -0,0 +1,437 @@
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDispatcher:
+    """
+    In-process work queue for Bale updates.
+
+    The webhook only enqueues the raw update; a fixed pool of worker threads
+    pulls updates off a bounded queue and runs the regular handlers. The queue
+    bound is the backpressure: when it is full, submit() gives up after
+    put_timeout seconds and the caller can ask Bale to retry later.
+    """
+
+    def __init__(self, handler, workers=8, queue_size=1000, put_timeout=0.05):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counters = {
+            "submitted": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+        }
+
+    def start(self):
+        """
+        Start the worker threads (idempotent).
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"bale-dispatch-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, update):
+        """
+        Enqueue an update for background processing.
+        Returns True if accepted, False if the queue stayed full.
+        """
+        self.start()
+        try:
+            self._queue.put(update, timeout=self.put_timeout)
+        except queue.Full:
+            self._count("rejected")
+            return False
+        self._count("submitted")
+        return True
+
+    def join(self):
+        """
+        Block until every queued update has been processed.
+        """
+        self._queue.join()
+
+    def stop(self, timeout=5.0):
+        """
+        Ask the workers to exit once the queued updates are done.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def stats(self):
+        """
+        Snapshot of queue depth and processing counters.
+        """
+        with self._lock:
+            data = dict(self._counters)
+            data["workers"] = len(self._threads)
+        data["queue_depth"] = self._queue.qsize()
+        data["queue_size"] = self._queue.maxsize
+        return data
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _worker(self):
+        while True:
+            update = self._queue.get()
+            try:
+                if update is None:
+                    return
+                close_old_connections()
+                try:
+                    self.handler(update)
+                    self._count("processed")
+                except Exception:
+                    self._count("failed")
+                    logger.exception("Error while processing Bale update")
+                finally:
+                    close_old_connections()
+            finally:
+                self._queue.task_done()
+
+
+def update_chat_key(update):
+    """
+    The chat an update belongs to, as a string; updates without a chat
+    (e.g. edited channel posts) get a key of their own.
+    """
+    message = update.get("message") or {}
+    chat_id = (message.get("chat") or {}).get("id")
+    return str(chat_id) if chat_id is not None else f"update:{update.get('update_id')}"
+
+
+class ChatLease:
+    """
+    Cross-process lock on one chat, kept in a shared Django cache.
+
+    cache.add() is atomic, so only one node holds a chat at a time. While
+    a lease is held, a background thread extends it every ttl / 3 seconds,
+    so a handler that outlives the ttl (a slow TalkBot reply can take
+    several read timeouts) keeps the chat; only a holder that died lets it
+    expire. A node that cannot get it within wait seconds goes ahead anyway
+    (and logs it), trading strict ordering for liveness.
+    """
+
+    def __init__(self, alias="default", ttl=60, wait=30.0, prefix="chat-lease:"):
+        self.alias = alias
+        self.ttl = ttl
+        self.wait = wait
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._held = {}
+        self._renewer = None
+        self._counters = {"acquired": 0, "contended": 0, "expired_waits": 0, "renewed": 0, "lost": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def acquire(self, key):
+        """
+        Take the lease on key; returns a token for release(), or None if it
+        stayed taken for the whole wait.
+        """
+        cache = caches[self.alias]
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait
+        delay = 0.01
+        contended = False
+        while not cache.add(self.prefix + key, token, self.ttl):
+            if not contended:
+                contended = True
+                self._count("contended")
+            if time.monotonic() >= deadline:
+                return self._give_up(key)
+            time.sleep(delay)
+            delay = min(0.2, delay * 2)
+        return self._hold(key, token)
+
+    async def aacquire(self, key):
+        """
+        acquire() for the asyncio path: cache calls run off the event loop
+        and waits use asyncio.sleep.
+        """
+        cache = caches[self.alias]
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait
+        delay = 0.01
+        contended = False
+        while not await sync_to_async(cache.add)(self.prefix + key, token, self.ttl):
+            if not contended:
+                contended = True
+                self._count("contended")
+            if time.monotonic() >= deadline:
+                return self._give_up(key)
+            await asyncio.sleep(delay)
+            delay = min(0.2, delay * 2)
+        return self._hold(key, token)
+
+    def _give_up(self, key):
+        self._count("expired_waits")
+        logger.warning("Chat %s is still leased elsewhere; handling it without the lease", key)
+        return None
+
+    def _hold(self, key, token):
+        with self._lock:
+            self._counters["acquired"] += 1
+            self._held[key] = token
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew, name="chat-lease-renewer", daemon=True)
+                self._renewer.start()
+        return token
+
+    def release(self, key, token):
+        if token is None:
+            return
+        with self._lock:
+            if self._held.get(key) == token:
+                del self._held[key]
+        cache = caches[self.alias]
+        # Only drop our own lease; one that expired may belong to another node now
+        if cache.get(self.prefix + key) == token:
+            cache.delete(self.prefix + key)
+
+    async def arelease(self, key, token):
+        if token is not None:
+            await sync_to_async(self.release)(key, token)
+
+    def renew(self):
+        """
+        Extend every lease this process holds by another ttl. A lease that
+        is gone or taken over (its holder stalled past the ttl) is dropped.
+        """
+        cache = caches[self.alias]
+        with self._lock:
+            held = list(self._held.items())
+        for key, token in held:
+            if cache.get(self.prefix + key) == token and cache.touch(self.prefix + key, self.ttl):
+                self._count("renewed")
+                continue
+            with self._lock:
+                if self._held.get(key) != token:
+                    continue  # released meanwhile
+                del self._held[key]
+                self._counters["lost"] += 1
+            logger.warning("Lost the lease on chat %s while handling it", key)
+
+    def _renew(self):
+        while True:
+            time.sleep(max(0.1, self.ttl / 3))
+            try:
+                self.renew()
+            except Exception:
+                logger.exception("Could not renew chat leases")
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["held"] = len(self._held)
+        return data
+
+
+class ChatLaneDispatcher:
+    """
+    Work queue that keeps each chat's updates in order.
+
+    Updates are hashed by chat onto a fixed number of lanes, each with its
+    own bounded queue and a single worker thread: one chat's updates run one
+    after another in arrival order, different chats run in parallel. With a
+    ChatLease, a worker also holds the chat's lease while handling it, so
+    processes on other nodes do not handle the same chat at the same time.
+    Same submit/join/stop/stats interface as UpdateDispatcher.
+    """
+
+    def __init__(self, handler, lanes=8, queue_size=1000, put_timeout=0.05, key=update_chat_key, lease=None):
+        self.handler = handler
+        self.lanes = max(1, int(lanes))
+        self.put_timeout = put_timeout
+        self.key = key
+        self.lease = lease
+        self._queues = [queue.Queue(maxsize=max(1, int(queue_size) // self.lanes)) for _ in range(self.lanes)]
+        self._processed = [0] * self.lanes
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counters = {
+            "submitted": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+        }
+
+    def lane_for(self, key):
+        # crc32 rather than hash(): stable across processes and restarts
+        return zlib.crc32(key.encode()) % self.lanes
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for lane in range(self.lanes):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(lane,),
+                    name=f"bale-lane-{lane}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, update):
+        """
+        Enqueue an update on its chat's lane.
+        Returns True if accepted, False if that lane stayed full.
+        """
+        self.start()
+        try:
+            self._queues[self.lane_for(self.key(update))].put(update, timeout=self.put_timeout)
+        except queue.Full:
+            self._count("rejected")
+            return False
+        self._count("submitted")
+        return True
+
+    def join(self):
+        for lane_queue in self._queues:
+            lane_queue.join()
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if threads:
+            for lane_queue in self._queues:
+                lane_queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["workers"] = len(self._threads)
+            processed = list(self._processed)
+        depths = [lane_queue.qsize() for lane_queue in self._queues]
+        data["queue_depth"] = sum(depths)
+        data["queue_size"] = sum(lane_queue.maxsize for lane_queue in self._queues)
+        data["lanes"] = [
+            {"queue_depth": depth, "processed": count} for depth, count in zip(depths, processed)
+        ]
+        data["max_lane_depth"] = max(depths)
+        if self.lease is not None:
+            data["lease"] = self.lease.stats()
+        return data
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _handle(self, update):
+        if self.lease is None:
+            self.handler(update)
+            return
+        key = self.key(update)
+        token = self.lease.acquire(key)
+        try:
+            self.handler(update)
+        finally:
+            self.lease.release(key, token)
+
+    def _worker(self, lane):
+        lane_queue = self._queues[lane]
+        while True:
+            update = lane_queue.get()
+            try:
+                if update is None:
+                    return
+                close_old_connections()
+                try:
+                    self._handle(update)
+                    self._count("processed")
+                except Exception:
+                    self._count("failed")
+                    logger.exception("Error while processing Bale update")
+                finally:
+                    close_old_connections()
+                    with self._lock:
+                        self._processed[lane] += 1
+            finally:
+                lane_queue.task_done()
+
+
+_chat_lease = None
+_chat_lease_lock = threading.Lock()
+
+
+def get_chat_lease():
+    """
+    The process-wide ChatLease, or None when CHAT_LEASE_ENABLED is off.
+    """
+    global _chat_lease
+    if not getattr(settings, 'CHAT_LEASE_ENABLED', False):
+        return None
+    if _chat_lease is None:
+        with _chat_lease_lock:
+            if _chat_lease is None:
+                _chat_lease = ChatLease(
+                    alias=getattr(settings, 'CHAT_LEASE_ALIAS', 'default'),
+                    ttl=getattr(settings, 'CHAT_LEASE_TTL', 60),
+                    wait=getattr(settings, 'CHAT_LEASE_WAIT', 30.0),
+                )
+    return _chat_lease
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Return the process-wide dispatcher, creating it from settings on first use:
+    a ChatLaneDispatcher (per-chat order) unless BALE_DISPATCH_ORDERING is "none".
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                from .views import process_update
+
+                options = dict(
+                    handler=process_update,
+                    queue_size=getattr(settings, 'BALE_DISPATCH_QUEUE_SIZE', 1000),
+                    put_timeout=getattr(settings, 'BALE_DISPATCH_PUT_TIMEOUT', 0.05),
+                )
+                workers = getattr(settings, 'BALE_DISPATCH_WORKERS', 8)
+                if getattr(settings, 'BALE_DISPATCH_ORDERING', 'chat') == 'chat':
+                    _dispatcher = ChatLaneDispatcher(lanes=workers, lease=get_chat_lease(), **options)
+                else:
+                    _dispatcher = UpdateDispatcher(workers=workers, **options)
+                atexit.register(_dispatcher.stop)
+    return _dispatcher
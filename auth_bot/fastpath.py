@@ -0,0 +1,44 @@
+import json
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # listed in requirements.txt; the stdlib parser is the fallback
+    orjson = None
+
+
+def loads(body):
+    """
+    Parse a JSON request body with orjson when it is installed. Both raise
+    ValueError subclasses on malformed input.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class WebhookFastPathMiddleware:
+    """
+    Answer POSTs to BALE_FAST_WEBHOOK_PATH (and BALE_FAST_WEBHOOK_PATH<secret>/)
+    with views.fast_webhook_view before anything else runs: no session,
+    CSRF, auth, messages or CORS middleware, no URL resolving and no DRF
+    request wrapping, content negotiation or JWT authentication. Must be
+    first in MIDDLEWARE; every other path goes down the normal stack.
+    """
+
+    def __init__(self, get_response):
+        from .views import fast_webhook_view
+
+        self.get_response = get_response
+        self.view = fast_webhook_view
+
+    def __call__(self, request):
+        prefix = getattr(settings, 'BALE_FAST_WEBHOOK_PATH', '/auth/bale-webhook-fast/')
+        path = request.path_info
+        if not prefix or not path.startswith(prefix):
+            return self.get_response(request)
+        token = path[len(prefix):].strip("/")
+        if "/" in token:
+            return self.get_response(request)
+        return self.view(request, token=token)
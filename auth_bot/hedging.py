@@ -0,0 +1,269 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+from .benchmark import percentile
+
+logger = logging.getLogger(__name__)
+
+
+def hedging_enabled():
+    return getattr(settings, 'TALKBOT_HEDGE_ENABLED', False)
+
+
+def _failed(result):
+    return isinstance(result, dict) and "error" in result
+
+
+class HedgeStats:
+    """
+    Hedge delay, budget and outcome of hedged calls.
+
+    The delay is the TALKBOT_HEDGE_PERCENTILE of recent primary latencies
+    (TALKBOT_HEDGE_DELAY until TALKBOT_HEDGE_MIN_SAMPLES are known). Every
+    call earns TALKBOT_HEDGE_BUDGET hedge credits and a hedge spends one, so
+    at most that fraction of calls send a second request.
+
+    "primary" latencies are what callers would have waited without hedging
+    (calls whose primary was cancelled are left out, so the improvement is
+    understated), "observed" what they actually waited.
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._primary = deque(maxlen=window)
+        self._observed = deque(maxlen=window)
+        self._credit = 0.0
+        self._counters = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "over_budget": 0,
+            "pool_full": 0,
+        }
+
+    def delay(self):
+        with self._lock:
+            samples = list(self._primary)
+        if len(samples) < getattr(settings, 'TALKBOT_HEDGE_MIN_SAMPLES', 20):
+            return getattr(settings, 'TALKBOT_HEDGE_DELAY', 10.0)
+        return max(
+            getattr(settings, 'TALKBOT_HEDGE_MIN_DELAY', 0.5),
+            percentile(samples, getattr(settings, 'TALKBOT_HEDGE_PERCENTILE', 95)),
+        )
+
+    def start(self):
+        budget = getattr(settings, 'TALKBOT_HEDGE_BUDGET', 0.05)
+        with self._lock:
+            self._counters["calls"] += 1
+            # Cap the savings so a quiet hour cannot fund a burst of hedges
+            self._credit = min(max(1.0, budget * 100), self._credit + budget)
+
+    def can_hedge(self):
+        """
+        Whether the budget would allow a hedge now (nothing is spent).
+        """
+        with self._lock:
+            return self._credit >= 1.0
+
+    def count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def try_hedge(self):
+        with self._lock:
+            if self._credit >= 1.0:
+                self._credit -= 1.0
+                self._counters["hedged"] += 1
+                return True
+            self._counters["over_budget"] += 1
+            return False
+
+    def record_primary(self, latency):
+        with self._lock:
+            self._primary.append(latency)
+
+    def record_observed(self, latency, hedge_won=False):
+        with self._lock:
+            self._observed.append(latency)
+            if hedge_won:
+                self._counters["hedge_wins"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._primary.clear()
+            self._observed.clear()
+            self._credit = 0.0
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def as_dict(self):
+        with self._lock:
+            data = dict(self._counters)
+            primary = list(self._primary)
+            observed = list(self._observed)
+        data["hedge_rate"] = round(data["hedged"] / data["calls"], 4) if data["calls"] else 0.0
+        for pct in (50, 95, 99):
+            before = percentile(primary, pct) * 1000
+            after = percentile(observed, pct) * 1000
+            data[f"primary_p{pct}_ms"] = round(before, 1)
+            data[f"observed_p{pct}_ms"] = round(after, 1)
+            data[f"p{pct}_improvement_ms"] = round(before - after, 1)
+        return data
+
+
+hedge_stats = HedgeStats()
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def _hedge_pool():
+    """
+    The pool that runs hedges, and a semaphore with one slot per pool
+    thread: a hedge is only sent when a thread is free to start it now.
+    """
+    global _pool, _slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = getattr(settings, 'TALKBOT_HEDGE_WORKERS', 16)
+                _slots = threading.BoundedSemaphore(workers)
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="talkbot-hedge")
+    return _pool, _slots
+
+
+def _start_thread(future, call, name):
+    """
+    Run call() on a new thread, in a copy of the caller's context (so its
+    spans and outbound calls land in the update's trace), into future.
+    """
+    def run():
+        try:
+            future.set_result(call())
+        except Exception as e:
+            future.set_exception(e)
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name=name, daemon=True).start()
+
+
+def hedged_call(primary, hedge, stats):
+    """
+    Run primary(); if it has not returned after stats.delay() seconds and the
+    budget allows, also run hedge() and return whichever succeeds first.
+    Both return a result dict ({"error": ...} on failure).
+
+    When the budget rules out a hedge, primary() simply runs on the caller's
+    thread. Otherwise it gets a thread of its own, started at once, so the
+    caller can return the hedge's answer while the primary is still busy;
+    nothing caps how many primaries run. Only hedges go to the
+    TALKBOT_HEDGE_WORKERS pool, and only when a pool thread is free, so no
+    call ever waits in a queue. The losing call cannot be interrupted
+    mid-request; it finishes in the background and its answer is dropped.
+    """
+    stats.start()
+    started = time.monotonic()
+
+    def primary_done(future):
+        if future.exception() is None and not _failed(future.result()):
+            stats.record_primary(time.monotonic() - started)
+
+    if not stats.can_hedge():
+        delay = stats.delay()
+        result = primary()
+        elapsed = time.monotonic() - started
+        if not _failed(result):
+            stats.record_primary(elapsed)
+        if elapsed >= delay:
+            # It would have been hedged
+            stats.count("over_budget")
+        stats.record_observed(elapsed)
+        return result
+
+    first = Future()
+    first.add_done_callback(primary_done)
+    _start_thread(first, primary, "talkbot-primary")
+    try:
+        result = first.result(timeout=stats.delay())
+        stats.record_observed(time.monotonic() - started)
+        return result
+    except FutureTimeout:
+        pass
+    pool, slots = _hedge_pool()
+    if not slots.acquire(blocking=False):
+        stats.count("pool_full")
+        hedged = False
+    else:
+        hedged = stats.try_hedge()
+        if not hedged:
+            slots.release()
+    if not hedged:
+        result = first.result()
+        stats.record_observed(time.monotonic() - started)
+        return result
+
+    def run_hedge():
+        try:
+            return hedge()
+        finally:
+            slots.release()
+
+    logger.debug("Hedging a TalkBot call after %.2fs", time.monotonic() - started)
+    second = pool.submit(contextvars.copy_context().run, run_hedge)
+    pending = {first, second}
+    result = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if not _failed(result):
+                stats.record_observed(time.monotonic() - started, hedge_won=future is second)
+                return result
+    stats.record_observed(time.monotonic() - started)
+    return result
+
+
+async def ahedged_call(primary, hedge, stats):
+    """
+    hedged_call() for coroutine functions. The loser is cancelled.
+    """
+    stats.start()
+    started = time.monotonic()
+
+    def primary_done(task):
+        if not task.cancelled() and task.exception() is None and not _failed(task.result()):
+            stats.record_primary(time.monotonic() - started)
+
+    first = asyncio.ensure_future(primary())
+    first.add_done_callback(primary_done)
+    done, _ = await asyncio.wait({first}, timeout=stats.delay())
+    if done or not stats.try_hedge():
+        result = await first
+        stats.record_observed(time.monotonic() - started)
+        return result
+
+    second = asyncio.ensure_future(hedge())
+    pending = {first, second}
+    result = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if not _failed(result):
+                    stats.record_observed(time.monotonic() - started, hedge_won=task is second)
+                    return result
+    finally:
+        for task in pending:
+            task.cancel()
+    stats.record_observed(time.monotonic() - started)
+    return result
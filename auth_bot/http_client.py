@@ -0,0 +1,275 @@
+import asyncio
+import random
+import re
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from .metrics import record_call
+
+# Methods that may be replayed after the server has seen the request.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+_BOT_TOKEN_PATH = re.compile(r"/bot[^/\s]+/")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class HostStats:
+    """
+    Latency and pool-utilisation counters for one upstream host.
+    """
+
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "pool_size": self.pool_size,
+            "pool_utilisation": round(self.in_flight / self.pool_size, 3) if self.pool_size else 0.0,
+            "avg_latency_ms": round(self.total_latency / self.requests * 1000, 1) if self.requests else 0.0,
+            "max_latency_ms": round(self.max_latency * 1000, 1),
+        }
+
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _host_stats(host, pool_size):
+    stats = _stats.get(host)
+    if stats is None:
+        with _lock:
+            stats = _stats.setdefault(host, HostStats(pool_size))
+    return stats
+
+
+def _start(stats):
+    with _lock:
+        stats.in_flight += 1
+        stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+
+
+def _finish(stats, started, failed, endpoint="", status=0):
+    elapsed = time.perf_counter() - started
+    with _lock:
+        stats.in_flight -= 1
+        stats.requests += 1
+        stats.errors += int(failed)
+        stats.total_latency += elapsed
+        stats.max_latency = max(stats.max_latency, elapsed)
+    record_call(endpoint, elapsed, status)
+
+
+def _endpoint(url):
+    # Only the last path segment: Bale URLs carry the bot token
+    return urlsplit(url).path.rsplit("/", 1)[-1]
+
+
+def redact(error):
+    """
+    Text of an error or URL with the bot token of Bale paths ("/bot<token>/")
+    masked: requests and httpx errors quote the URL they failed on.
+    """
+    return _BOT_TOKEN_PATH.sub("/bot***/", str(error))
+
+
+def _count_retry(stats):
+    with _lock:
+        stats.retries += 1
+
+
+def get_http_stats():
+    """
+    Per-host counters for every upstream the bot has talked to, sync and async.
+    """
+    with _lock:
+        return {host: stats.as_dict() for host, stats in _stats.items()}
+
+
+def get_session(host):
+    """
+    Return the keep-alive requests.Session dedicated to `host`.
+    Each host gets its own connection pool of HTTP_POOL_SIZE connections.
+    """
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                pool_size = _setting('HTTP_POOL_SIZE', 20)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[host] = session
+    return session
+
+
+def _default_timeout(read_timeout):
+    return (
+        _setting('HTTP_CONNECT_TIMEOUT', 3.05),
+        read_timeout if read_timeout is not None else _setting('HTTP_READ_TIMEOUT', 10.0),
+    )
+
+
+def _backoff(attempt):
+    # "Full jitter": sleep a random time up to the exponential cap.
+    base = _setting('HTTP_RETRY_BACKOFF', 0.2)
+    return random.uniform(0, base * (2 ** attempt))
+
+
+def _never_sent(exc):
+    """
+    True when the request failed before reaching the server (connect
+    refused/timed out), so retrying cannot duplicate a side effect.
+    """
+    if isinstance(exc, (requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def http_request(method, url, read_timeout=None, idempotent=None, **kwargs):
+    """
+    Send a request through the pooled session of the target host.
+
+    Connect/read timeouts default to HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT.
+    Failures are retried up to HTTP_MAX_RETRIES times with jittered exponential
+    backoff, but only when that is safe: connect failures (nothing was sent) for
+    any method, and timeouts or 502/503/504 answers for idempotent requests.
+    Non-idempotent calls such as sendMessage or a TalkBot completion are never
+    replayed once the server may have seen them.
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    host = urlsplit(url).netloc
+    endpoint = _endpoint(url)
+    session = get_session(host)
+    stats = _host_stats(host, _setting('HTTP_POOL_SIZE', 20))
+    kwargs.setdefault("timeout", _default_timeout(read_timeout))
+    max_retries = _setting('HTTP_MAX_RETRIES', 2)
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        _start(stats)
+        response = None
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            retryable = _never_sent(e) or (
+                idempotent and isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+            )
+            if not retryable or attempt >= max_retries:
+                raise
+        finally:
+            # Whatever was raised (not only RequestException), the call is no longer in flight
+            status = response.status_code if response is not None else 0
+            _finish(stats, started, failed=response is None or status >= 500, endpoint=endpoint, status=status)
+        if response is not None:
+            if not (idempotent and response.status_code in RETRY_STATUSES) or attempt >= max_retries:
+                return response
+            response.close()
+        _count_retry(stats)
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+# One AsyncClient per running event loop: httpx clients are bound to the
+# loop that first used them, and tests/benchmarks may run several loops.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the shared httpx.AsyncClient for the running event loop.
+    Connections are pooled and kept alive across TalkBot, Bale and Kavenegar calls.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        max_connections = _setting('HTTP_ASYNC_MAX_CONNECTIONS', 500)
+        connect_timeout, read_timeout = _default_timeout(None)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=_setting('HTTP_KEEPALIVE_EXPIRY', 30.0),
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def ahttp_request(method, url, read_timeout=None, idempotent=None, **kwargs):
+    """
+    Async counterpart of http_request with the same timeout and retry rules,
+    sent through the shared httpx.AsyncClient.
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    stats = _host_stats(urlsplit(url).netloc, _setting('HTTP_ASYNC_MAX_CONNECTIONS', 500))
+    endpoint = _endpoint(url)
+    connect_timeout, default_read = _default_timeout(read_timeout)
+    kwargs.setdefault("timeout", httpx.Timeout(default_read, connect=connect_timeout))
+    max_retries = _setting('HTTP_MAX_RETRIES', 2)
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        _start(stats)
+        response = None
+        try:
+            response = await get_async_client().request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            retryable = _never_sent(e) or (
+                idempotent and isinstance(e, (httpx.TimeoutException, httpx.NetworkError))
+            )
+            if not retryable or attempt >= max_retries:
+                raise
+        finally:
+            # Also when the task is cancelled (CancelledError is not an HTTPError)
+            status = response.status_code if response is not None else 0
+            _finish(stats, started, failed=response is None or status >= 500, endpoint=endpoint, status=status)
+        if response is not None:
+            if not (idempotent and response.status_code in RETRY_STATUSES) or attempt >= max_retries:
+                return response
+        _count_retry(stats)
+        await asyncio.sleep(_backoff(attempt))
+        attempt += 1
+
+
+async def aclose_async_client():
+    """
+    Close the shared client of the running event loop (e.g. before the loop ends).
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
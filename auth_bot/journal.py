@@ -0,0 +1,315 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .models import ChatSession, ChatTurn
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks (Windows): one process per journal path
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _entry(turn):
+    return json.dumps({
+        "u": turn.user_id,
+        "s": turn.session_id,
+        "m": turn.user_message,
+        "b": turn.bot_response,
+        "r": turn.assistant_role,
+        "k": turn.token_count,
+        "t": turn.created_at.isoformat(),
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+def _turn(entry):
+    return ChatTurn(
+        user_id=entry["u"],
+        session_id=entry["s"],
+        user_message=entry["m"],
+        bot_response=entry["b"],
+        assistant_role=entry["r"],
+        token_count=entry["k"],
+        created_at=parse_datetime(entry["t"]),
+    )
+
+
+class TurnJournal:
+    """
+    Write-behind buffer for chat turns.
+
+    append() writes the turn as one JSON line to a local journal file and
+    keeps it in memory; nothing touches the database on the request. A
+    background thread stores the buffered turns with one bulk_create every
+    flush_interval seconds, or sooner once flush_size are waiting, and then
+    rewrites the journal with whatever is still pending.
+
+    The journal is the durable copy until the insert commits: turns left in
+    it by a crash are loaded back when the journal is opened again and
+    stored by the next flush. Turns that were inserted just before the crash
+    (before the journal was rewritten) are recognised by (session, created_at)
+    and not stored twice. With fsync, every append also survives a power loss.
+    """
+
+    def __init__(self, path, flush_size=100, flush_interval=1.0, fsync=False):
+        self.path = path
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._counters = {
+            "appended": 0, "stored": 0, "batches": 0, "recovered": 0,
+            "dropped": 0, "flush_errors": 0, "journal_errors": 0,
+        }
+        self._pending = self._load()
+        # Recovered turns may already be in the database; checked on their first flush
+        self._unverified = len(self._pending)
+        self._counters["recovered"] = self._unverified
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._worker = None
+        if flush_interval > 0:
+            self._worker = threading.Thread(target=self._run, name="chat-journal", daemon=True)
+            self._worker.start()
+
+    def _load(self):
+        pending = []
+        if not os.path.exists(self.path):
+            return pending
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    pending.append((_turn(json.loads(line)), line))
+                except (ValueError, KeyError, TypeError):
+                    # A line cut short by the crash itself; its reply was never sent
+                    logger.warning("Skipping unreadable line in chat journal %s", self.path)
+        if pending:
+            logger.info("Recovered %d unsaved chat turns from %s", len(pending), self.path)
+        return pending
+
+    def append(self, turn):
+        """
+        Journal an unsaved ChatTurn for a later bulk insert. Returns False if
+        the journal could not be written; the caller should save it directly.
+        """
+        if not turn.token_count:
+            turn.token_count = ChatTurn.estimate_tokens(turn.user_message, turn.bot_response)
+        line = _entry(turn)
+        with self._lock:
+            try:
+                self._file.write(line + "\n")
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except (OSError, ValueError):
+                logger.exception("Could not write chat journal %s", self.path)
+                self._counters["journal_errors"] += 1
+                return False
+            self._pending.append((turn, line))
+            self._counters["appended"] += 1
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self._wake.set()
+        return True
+
+    def pending_turns(self, session_id, since=None):
+        """
+        The session's turns that are not stored yet, oldest first.
+        """
+        with self._lock:
+            turns = [turn for turn, _ in self._pending if turn.session_id == session_id]
+        if since is not None:
+            turns = [turn for turn in turns if turn.created_at > since]
+        return turns
+
+    def with_pending(self, turns, session_id, limit, since=None):
+        """
+        Add the session's pending turns to turns read with ChatTurn.tail and
+        keep the newest limit, so history never misses an unflushed exchange.
+        """
+        pending = self.pending_turns(session_id, since)
+        if not pending:
+            return turns
+        stored = {turn.created_at for turn in turns}
+        merged = list(turns) + [turn for turn in pending if turn.created_at not in stored]
+        merged.sort(key=lambda turn: turn.created_at)
+        return merged[-limit:]
+
+    def flush(self):
+        """
+        Store everything buffered so far. Returns the number of turns stored;
+        on a database error the turns stay buffered for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                unverified = self._unverified
+            if not batch:
+                return 0
+            try:
+                stored, dropped = self._store([turn for turn, _ in batch], unverified)
+            except DatabaseError:
+                logger.exception("Could not store %d journaled chat turns", len(batch))
+                with self._lock:
+                    self._counters["flush_errors"] += 1
+                return 0
+            with self._lock:
+                # append() only adds at the end, so the batch is still the head
+                del self._pending[:len(batch)]
+                self._unverified = 0
+                self._counters["stored"] += stored
+                self._counters["dropped"] += dropped
+                self._counters["batches"] += 1
+                self._rewrite()
+            return stored
+
+    def _store(self, turns, unverified):
+        if unverified:
+            recovered = turns[:unverified]
+            existing = set(ChatTurn.objects.filter(
+                session_id__in={turn.session_id for turn in recovered},
+                created_at__in=[turn.created_at for turn in recovered],
+            ).values_list("session_id", "created_at"))
+            turns = [
+                turn for turn in recovered if (turn.session_id, turn.created_at) not in existing
+            ] + turns[unverified:]
+        # A session (or its user) deleted meanwhile takes its turns with it
+        sessions = set(ChatSession.objects.filter(
+            pk__in={turn.session_id for turn in turns}
+        ).order_by().values_list("pk", flat=True))
+        kept = [turn for turn in turns if turn.session_id in sessions]
+        # One transaction, however many INSERTs the backend splits the batch into
+        ChatTurn.objects.bulk_create(kept)
+        return len(kept), len(turns) - len(kept)
+
+    def _rewrite(self):
+        """
+        Replace the journal with the still-pending lines. Called with _lock held.
+        """
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for _, line in self._pending:
+                    f.write(line + "\n")
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The old journal stays; its stored turns are skipped on recovery
+            logger.exception("Could not rewrite chat journal %s", self.path)
+            self._counters["journal_errors"] += 1
+        finally:
+            if self._file.closed:
+                self._file = open(self.path, "a", encoding="utf-8")
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Chat journal flush failed")
+            finally:
+                close_old_connections()
+
+    def close(self):
+        """
+        Stop the flusher and store what is buffered (best effort: the journal keeps the rest).
+        """
+        self._closed = True
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout=5)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final chat journal flush failed")
+        with self._lock:
+            self._file.close()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["pending"] = len(self._pending)
+        return data
+
+
+def _claim(pattern):
+    """
+    Lock the first free journal path of pattern ("{slot}" counts up), so
+    every worker process owns one journal and a restarted one picks up the
+    leftovers of the process that held the slot before it.
+    """
+    for slot in itertools.count():
+        path = pattern.format(slot=slot)
+        lock = open(path + ".lock", "a")
+        if fcntl is None:
+            return path, lock
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            if "{slot}" not in pattern:
+                raise ImproperlyConfigured(f"Chat journal {path} is in use by another process")
+            continue
+        return path, lock
+
+
+_journal = None
+_journal_lock_file = None
+_journal_pattern = None
+_journal_lock = threading.Lock()
+
+
+def get_turn_journal():
+    """
+    Return the process-wide turn journal, or None unless CHAT_WRITE_BEHIND is set.
+    """
+    global _journal, _journal_lock_file, _journal_pattern
+    if not getattr(settings, 'CHAT_WRITE_BEHIND', False):
+        return None
+    pattern = getattr(settings, 'CHAT_JOURNAL_PATH', 'chat-journal-{slot}.jsonl')
+    if _journal is None or _journal_pattern != pattern:
+        with _journal_lock:
+            if _journal is None or _journal_pattern != pattern:
+                _close_journal()
+                path, _journal_lock_file = _claim(pattern)
+                _journal = TurnJournal(
+                    path,
+                    flush_size=getattr(settings, 'CHAT_JOURNAL_FLUSH_SIZE', 100),
+                    flush_interval=getattr(settings, 'CHAT_JOURNAL_FLUSH_INTERVAL', 1.0),
+                    fsync=getattr(settings, 'CHAT_JOURNAL_FSYNC', False),
+                )
+                _journal_pattern = pattern
+    return _journal
+
+
+def _close_journal():
+    global _journal, _journal_lock_file
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+    if _journal_lock_file is not None:
+        _journal_lock_file.close()
+        _journal_lock_file = None
+
+
+atexit.register(_close_journal)
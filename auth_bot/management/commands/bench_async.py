@@ -0,0 +1,76 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test.utils import override_settings
+
+from auth_bot.benchmark import chat_updates, isolated_database, seed_chat_users, summarize
+from auth_bot.http_client import aclose_async_client
+from auth_bot.stubs import StubServer
+from auth_bot.views import aprocess_update, process_update
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare chat-update throughput of the threaded (WSGI-style) path with "
+        "the asyncio (ASGI) path against local TalkBot/Bale stub servers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--updates", type=int, default=400, help="Chat updates per run.")
+        parser.add_argument("--users", type=int, default=100, help="Distinct chats.")
+        parser.add_argument("--threads", type=int, default=16, help="Worker threads for the sync run.")
+        parser.add_argument("--concurrency", type=int, default=200, help="In-flight updates for the async run.")
+        parser.add_argument("--latency", type=float, default=0.2, help="Stub TalkBot latency in seconds.")
+
+    def handle(self, *args, **options):
+        with StubServer(talkbot_latency=options["latency"]) as stub, \
+                override_settings(**stub.settings_overrides()), \
+                isolated_database():
+            chat_ids = seed_chat_users(options["users"])
+            updates = chat_updates(chat_ids, options["updates"])
+
+            sync_result = self._run_threaded(updates, options["threads"])
+            async_result = asyncio.run(self._run_async(updates, options["concurrency"]))
+
+        self.stdout.write(f"{'mode':<22}{'upd/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for label, result in (
+            (f"wsgi ({options['threads']} threads)", sync_result),
+            (f"asgi ({options['concurrency']} tasks)", async_result),
+        ):
+            self.stdout.write(
+                f"{label:<22}{result['per_sec']:>9}{result['p50_ms']:>10}"
+                f"{result['p95_ms']:>10}{result['p99_ms']:>10}"
+            )
+
+    def _run_threaded(self, updates, threads):
+        def run(update):
+            close_old_connections()
+            started = time.perf_counter()
+            try:
+                process_update(update)
+            finally:
+                close_old_connections()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(run, updates))
+        return summarize(latencies, time.perf_counter() - started)
+
+    async def _run_async(self, updates, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(update):
+            async with semaphore:
+                started = time.perf_counter()
+                await aprocess_update(update)
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(run(update) for update in updates))
+        elapsed = time.perf_counter() - started
+        await aclose_async_client()
+        return summarize(latencies, elapsed)
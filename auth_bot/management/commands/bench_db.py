@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection
+from django.test.utils import override_settings
+
+from auth_bot import quota
+from auth_bot.benchmark import isolated_database, seed_chat_users, summarize
+from auth_bot.models import BaleUser, ChatSession, ChatTurn
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent chat write throughput (quota update + turn insert + "
+        "history read per message) against a throwaway copy of the database. "
+        "On SQLite, compares SQLite's default rollback journal with WAL + busy_timeout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000, help="Messages per run.")
+        parser.add_argument("--threads", type=int, default=16, help="Concurrent writer threads.")
+        parser.add_argument("--users", type=int, default=200, help="Distinct chats.")
+
+    def handle(self, *args, **options):
+        if connection.vendor == "sqlite":
+            # "" leaves SQLite's defaults alone (the configuration before WAL)
+            modes = [("sqlite default journal", ""), ("sqlite wal + busy_timeout", "wal")]
+        else:
+            modes = [(f"{connection.vendor}", None)]
+
+        self.stdout.write(f"{'database':<28}{'msg/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for label, journal_mode in modes:
+            overrides = {} if journal_mode is None else {"SQLITE_JOURNAL_MODE": journal_mode}
+            with override_settings(**overrides), isolated_database():
+                result, errors = self._run(options)
+            self.stdout.write(
+                f"{label:<28}{result['per_sec']:>9}{result['p50_ms']:>10}"
+                f"{result['p95_ms']:>10}{result['p99_ms']:>10}{errors:>8}"
+            )
+
+    def _run(self, options):
+        chat_ids = seed_chat_users(options["users"], prefix="dbbench")
+        users = list(BaleUser.objects.filter(chat_id__in=chat_ids).order_by("id"))
+        sessions = ChatSession.objects.bulk_create(
+            ChatSession(user=user, is_active=True, assistant_role="general_physician", system_role="therapeutic")
+            for user in users
+        )
+        errors = []
+
+        def run(i):
+            user, session = users[i % len(users)], sessions[i % len(sessions)]
+            close_old_connections()
+            started = time.perf_counter()
+            try:
+                ChatTurn.objects.tail(user, session, limit=5)
+                quota.consume(user)
+                ChatTurn.objects.create(
+                    user=user,
+                    session=session,
+                    user_message="سلام دکتر، از دیروز سردرد دارم. چه کنم؟",
+                    bot_response="استراحت کنید و آب کافی بنوشید.",
+                    assistant_role="general_physician",
+                )
+            except OperationalError as e:
+                errors.append(e)
+            finally:
+                connection.close()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            latencies = list(pool.map(run, range(options["messages"])))
+        return summarize(latencies, time.perf_counter() - started), len(errors)
@@ -0,0 +1,122 @@
+import io
+import itertools
+import json
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from auth_bot import fastpath
+from auth_bot.benchmark import isolated_database, percentile
+
+SECRET = "bench-secret"
+
+
+def sample_update(update_id):
+    """
+    A full-size update the bot acknowledges without running a handler, so a
+    request measures only the web stack around it.
+    """
+    return {
+        "update_id": update_id,
+        "edited_message": {
+            "message_id": 4711,
+            "from": {"id": 123456789, "is_bot": False, "first_name": "علی", "username": "ali"},
+            "chat": {"id": 123456789, "type": "private", "first_name": "علی", "username": "ali"},
+            "date": 1700000000,
+            "edit_date": 1700000030,
+            "text": "سلام دکتر، از دیروز سردرد دارم. چه کنم؟",
+        },
+    }
+
+
+def wsgi_environ(path, body):
+    return {
+        "REQUEST_METHOD": "POST",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(body)),
+        "HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN": SECRET,
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.url_scheme": "http",
+        "wsgi.errors": io.StringIO(),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request overhead of the webhook endpoints through "
+        "Django's WSGI handler with the project's middleware: the DRF view, the "
+        "lean view behind the full middleware stack, and the lean view answered "
+        "by WebhookFastPathMiddleware. The updates need no handler, so only the "
+        "web stack is timed. Also times json vs orjson on the request body."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000, help="Requests per endpoint.")
+        parser.add_argument("--warmup", type=int, default=200, help="Untimed requests per endpoint first.")
+
+    def handle(self, *args, **options):
+        update_ids = itertools.count(10 ** 9)
+        variants = [
+            ("drf view", reverse("bale_webhook"), {}),
+            ("lean view, full stack", reverse("bale_webhook_fast"), {"BALE_FAST_WEBHOOK_PATH": ""}),
+            ("lean view, fast path", reverse("bale_webhook_fast"), {}),
+        ]
+        with override_settings(
+            ALLOWED_HOSTS=["testserver"],
+            BALE_WEBHOOK_MODE="sync",
+            BALE_WEBHOOK_SECRET=SECRET,
+            TRAFFIC_RECORD_PATH="",
+        ), isolated_database():
+            handler = WSGIHandler()
+            self.stdout.write(f"{'endpoint':<24}{'req/s':>9}{'mean µs':>10}{'p50 µs':>9}{'p95 µs':>9}{'p99 µs':>9}")
+            baseline = None
+            for label, path, overrides in variants:
+                with override_settings(**overrides):
+                    latencies = self._run(handler, path, update_ids, options)
+                mean = sum(latencies) / len(latencies)
+                baseline = baseline or mean
+                self.stdout.write(
+                    f"{label:<24}{1 / mean:>9.0f}{mean * 1e6:>10.1f}"
+                    f"{percentile(latencies, 50) * 1e6:>9.1f}{percentile(latencies, 95) * 1e6:>9.1f}"
+                    f"{percentile(latencies, 99) * 1e6:>9.1f}   x{baseline / mean:.2f}"
+                )
+        self._parsers(options["requests"])
+
+    def _run(self, handler, path, update_ids, options):
+        def post():
+            body = json.dumps(sample_update(next(update_ids)), ensure_ascii=False).encode()
+            environ = wsgi_environ(path, body)
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers: None)
+            b"".join(response)
+            response.close()
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} answered {response.status_code}")
+            return elapsed
+
+        for _ in range(options["warmup"]):
+            post()
+        return [post() for _ in range(options["requests"])]
+
+    def _parsers(self, count):
+        body = json.dumps(sample_update(1), ensure_ascii=False).encode()
+        parsers = [("json", json.loads)]
+        if fastpath.orjson is not None:
+            parsers.append(("orjson", fastpath.orjson.loads))
+        else:
+            self.stdout.write("orjson is not installed; fastpath.loads uses json")
+        for label, parse in parsers:
+            started = time.perf_counter()
+            for _ in range(count):
+                parse(body)
+            self.stdout.write(f"parse {len(body)} B with {label:<7}{(time.perf_counter() - started) / count * 1e6:>7.2f} µs")
@@ -0,0 +1,125 @@
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from auth_bot.benchmark import (
+    conversation_script, format_report, git_revision, isolated_database, load_results,
+    previous_result, seed_chat_users, store_result, summarize_samples, timed_post,
+)
+from auth_bot.stubs import StubServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a synthetic update mix (/start, login, OTP, role selection, chat "
+        "turns) from concurrent users against the webhook view, with local "
+        "Bale/TalkBot/Kavenegar stub servers. Reports updates/sec, latency "
+        "percentiles and DB queries per update type and appends the results "
+        "to a JSON-lines file so runs on different commits can be compared."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=40, help="Concurrent users.")
+        parser.add_argument("--login-share", type=float, default=0.25,
+                            help="Fraction of users that go through /login and OTP first.")
+        parser.add_argument("--turns", type=int, default=4, help="Chat messages per user.")
+        parser.add_argument("--latency", type=float, default=0.2, help="Median stub TalkBot latency (s).")
+        parser.add_argument("--jitter", type=float, default=0.5,
+                            help="Sigma of the log-normal latency factor (0 = fixed latencies).")
+        parser.add_argument("--talkbot-errors", type=float, default=0.0, help="Fraction of TalkBot calls failing with 503.")
+        parser.add_argument("--kavenegar-latency", type=float, default=0.05, help="Median stub Kavenegar latency (s).")
+        parser.add_argument("--kavenegar-errors", type=float, default=0.0, help="Fraction of failing OTP SMS.")
+        parser.add_argument("--bale-latency", type=float, default=0.01, help="Median stub Bale latency (s).")
+        parser.add_argument("--streaming", action="store_true", help="Stream TalkBot answers (TALKBOT_STREAMING).")
+        parser.add_argument("--seed", type=int, default=1, help="Seed of the stub's latency and error draws.")
+        parser.add_argument("--output", default="loadtest_results.jsonl", help="Where results are appended.")
+        parser.add_argument("--no-store", action="store_true", help="Only print, do not append the results.")
+
+    def handle(self, *args, **options):
+        scenario = {
+            key: options[key] for key in (
+                "users", "login_share", "turns", "latency", "jitter", "talkbot_errors",
+                "kavenegar_latency", "kavenegar_errors", "bale_latency", "streaming",
+            )
+        }
+        stub = StubServer(
+            talkbot_latency=options["latency"],
+            bale_latency=options["bale_latency"],
+            kavenegar_latency=options["kavenegar_latency"],
+            jitter=options["jitter"],
+            talkbot_error_rate=options["talkbot_errors"],
+            kavenegar_error_rate=options["kavenegar_errors"],
+            seed=options["seed"],
+        )
+        with stub, override_settings(
+            **stub.settings_overrides(),
+            ALLOWED_HOSTS=["testserver"],
+            BALE_WEBHOOK_MODE="sync",
+            OTP_SMS_MODE="sync",  # the OTP step needs the code before it is sent
+            TALKBOT_STREAMING=options["streaming"],
+            # The stub is not rate limited like Bale; do not measure the outbox pacing
+            BALE_SEND_RATE=10 ** 6, BALE_SEND_BURST=10 ** 6,
+            BALE_CHAT_SEND_RATE=10 ** 6, BALE_CHAT_SEND_BURST=10 ** 6,
+        ), isolated_database():
+            scripts = self._scripts(options)
+            samples, elapsed = self._run(stub, scripts)
+
+        overall, by_type = summarize_samples(samples, elapsed)
+        record = {
+            "commit": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "scenario": scenario,
+            "overall": overall,
+            "by_type": by_type,
+        }
+        previous = previous_result(load_results(options["output"]), scenario)
+        for line in format_report(record, previous):
+            self.stdout.write(line)
+        if not options["no_store"]:
+            store_result(options["output"], record)
+            self.stdout.write(f"Results appended to {options['output']}")
+
+    def _scripts(self, options):
+        users = options["users"]
+        login_users = round(users * options["login_share"])
+        known = seed_chat_users(users - login_users, prefix="load")
+        scripts = [
+            (chat_id, None, conversation_script(chat_id, None, options["turns"], login=False))
+            for chat_id in known
+        ]
+        for i in range(login_users):
+            chat_id, phone_number = f"load-login-{i}", f"0991{i:07d}"
+            scripts.append((chat_id, phone_number, conversation_script(chat_id, phone_number, options["turns"])))
+        random.Random(options["seed"]).shuffle(scripts)
+        return scripts
+
+    def _run(self, stub, scripts):
+        url = reverse("bale_webhook")
+        update_ids = itertools.count(1)
+        samples = []
+        lock = threading.Lock()
+
+        def run_user(script):
+            chat_id, phone_number, steps = script
+            # got_request_exception is global: a raising client would also re-raise other threads' errors
+            client = Client(raise_request_exception=False)
+            for kind, text in steps:
+                if text is None:
+                    text = stub.last_code(phone_number) or "000000"
+                update = {"update_id": next(update_ids), "message": {"chat": {"id": chat_id}, "text": text}}
+                seconds, queries, status = timed_post(client, url, update)
+                with lock:
+                    samples.append((kind, seconds, queries, status))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(scripts) or 1) as pool:
+            list(pool.map(run_user, scripts))
+        return samples, time.perf_counter() - started
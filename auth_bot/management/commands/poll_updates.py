@@ -0,0 +1,44 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from auth_bot.polling import build_poller
+
+
+class Command(BaseCommand):
+    help = (
+        "Receive Bale updates by long-polling getUpdates instead of the webhook. "
+        "Updates are processed by per-chat worker lanes, in order per chat; the "
+        "offset and the updates still pending are stored in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", default="default", help="Offset record to use (one per bot).")
+        parser.add_argument("--workers", type=int, help="Worker threads (default: POLL_WORKERS).")
+        parser.add_argument("--limit", type=int, help="Updates per getUpdates call (default: POLL_LIMIT).")
+        parser.add_argument("--timeout", type=int, help="Long-poll timeout in seconds (default: POLL_TIMEOUT).")
+        parser.add_argument("--once", action="store_true", help="Handle a single batch and exit.")
+
+    def handle(self, *args, **options):
+        poller = build_poller(
+            name=options["name"],
+            workers=options["workers"],
+            limit=options["limit"],
+            timeout=options["timeout"],
+        )
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after the queued updates...")
+            poller.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.stdout.write(f"Polling Bale getUpdates (offset record '{options['name']}')")
+        poller.run(once=options["once"])
+
+        stats = poller.stats()
+        self.stdout.write(
+            f"Done: {stats['updates']} updates in {stats['batches']} batches, "
+            f"{stats['failed']} failed, {stats['fetch_errors']} fetch errors"
+        )
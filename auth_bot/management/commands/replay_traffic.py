@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from auth_bot.benchmark import (
+    format_report, git_revision, isolated_database, load_results, percentile,
+    previous_result, store_result, summarize_samples, timed_post,
+)
+from auth_bot.models import BaleUser
+from auth_bot.recorder import OTP_PLACEHOLDER, read_log, update_kind
+from auth_bot.stubs import StubServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay recorded webhook traffic (TRAFFIC_RECORD_PATH logs) against the "
+        "webhook view with stubbed Bale/TalkBot/Kavenegar, at the recorded pace "
+        "(--speed 1), N times faster, or as fast as possible (--speed 0). Stub "
+        "latencies are drawn from the outbound call timings in the log. Each "
+        "chat's updates are sent in their recorded order."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("logs", nargs="+", help="Recorded traffic logs (.jsonl.gz).")
+        parser.add_argument("--speed", type=float, default=1.0,
+                            help="Replay speed-up; 0 sends every update as soon as its chat is free.")
+        parser.add_argument("--workers", type=int, default=64, help="Updates in flight at most.")
+        parser.add_argument("--seed", type=int, default=1, help="Seed of the stub's latency draws.")
+        parser.add_argument("--output", default="loadtest_results.jsonl", help="Where results are appended.")
+        parser.add_argument("--no-store", action="store_true", help="Only print, do not append the results.")
+
+    def handle(self, *args, **options):
+        records = []
+        for path in options["logs"]:
+            if not os.path.exists(path):
+                raise CommandError(f"No such traffic log: {path}")
+            records.extend(read_log(path))
+        if not records:
+            raise CommandError("The traffic logs are empty.")
+        records.sort(key=lambda record: record["t"])
+
+        recorded = defaultdict(list)
+        for record in records:
+            for endpoint, ms, _status in record.get("calls", ()):
+                recorded[endpoint].append(ms / 1000.0)
+
+        stub = StubServer(recorded_latencies=dict(recorded), seed=options["seed"])
+        with stub, override_settings(
+            **stub.settings_overrides(),
+            ALLOWED_HOSTS=["testserver"],
+            TRAFFIC_RECORD_PATH="",
+            BALE_WEBHOOK_MODE="sync",
+            OTP_SMS_MODE="sync",  # OTP placeholders need the code before they are sent
+            BALE_SEND_RATE=10 ** 6, BALE_SEND_BURST=10 ** 6,
+            BALE_CHAT_SEND_RATE=10 ** 6, BALE_CHAT_SEND_BURST=10 ** 6,
+        ), isolated_database():
+            self._seed_users(records)
+            samples, lags, elapsed = self._replay(stub, records, options["speed"], options["workers"])
+
+        overall, by_type = summarize_samples(samples, elapsed)
+        overall["lag_p95_ms"] = round(percentile(lags, 95) * 1000, 1)
+        overall["lag_max_ms"] = round(max(lags, default=0.0) * 1000, 1)
+        record = {
+            "commit": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "scenario": {
+                "replay": sorted(os.path.basename(path) for path in options["logs"]),
+                "updates": len(records),
+                "speed": options["speed"],
+            },
+            "overall": overall,
+            "by_type": by_type,
+        }
+        production = [record["ms"] / 1000.0 for record in records if "ms" in record]
+        self.stdout.write(
+            f"Recorded: {len(records)} updates over {records[-1]['t'] - records[0]['t']:.1f}s, "
+            f"p50 {percentile(production, 50) * 1000:.1f} ms, p95 {percentile(production, 95) * 1000:.1f} ms"
+        )
+        previous = previous_result(load_results(options["output"]), record["scenario"])
+        for line in format_report(record, previous):
+            self.stdout.write(line)
+        self.stdout.write(
+            f"Schedule lag: p95 {overall['lag_p95_ms']} ms, max {overall['lag_max_ms']} ms"
+        )
+        if not options["no_store"]:
+            store_result(options["output"], record)
+            self.stdout.write(f"Results appended to {options['output']}")
+
+    def _seed_users(self, records):
+        """
+        Chats that never log in during the recording were logged in before it
+        began: create them authenticated, in the state their first update expects.
+        """
+        first, logs_in = {}, set()
+        for record in records:
+            message = record["u"].get("message")
+            if not message:
+                continue
+            chat_id, kind = message["chat"]["id"], update_kind(record["u"])
+            first.setdefault(chat_id, kind)
+            if kind in ("login", "phone", "otp"):
+                logs_in.add(chat_id)
+        states = {"role": BaleUser.DIALOG_CHOOSING_ROLE, "chat": BaleUser.DIALOG_CHATTING}
+        role = BaleUser.ASSISTANT_ROLES[0][0]
+        BaleUser.objects.bulk_create([
+            BaleUser(
+                chat_id=chat_id,
+                phone_number=f"0990{i:07d}",
+                is_authenticated=True,
+                assistant_role=role,
+                dialog_state=states.get(kind, BaleUser.DIALOG_IDLE),
+                daily_message_limit=10 ** 6,
+            )
+            for i, (chat_id, kind) in enumerate(first.items()) if chat_id not in logs_in
+        ])
+
+    def _replay(self, stub, records, speed, workers):
+        url = reverse("bale_webhook")
+        local = threading.local()
+        phones = {}
+        samples, lags = [], []
+        lock = threading.Lock()
+
+        def send(update, due, previous):
+            if previous is not None:
+                previous.result()  # keep the chat's recorded order
+            lag = max(0.0, time.perf_counter() - due)
+            client = getattr(local, "client", None)
+            if client is None:
+                # got_request_exception is global: a raising client would also re-raise other threads' errors
+                client = local.client = Client(raise_request_exception=False)
+            message = update.get("message")
+            if message and message["text"] == OTP_PLACEHOLDER:
+                code = stub.last_code(phones.get(message["chat"]["id"])) or "000000"
+                update = dict(update, message=dict(message, text=code))
+            seconds, queries, status = timed_post(client, url, update)
+            with lock:
+                samples.append((update_kind(update), seconds, queries, status))
+                lags.append(lag)
+
+        last = {}
+        origin = records[0]["t"]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for record in records:
+                update = record["u"]
+                due = started + ((record["t"] - origin) / speed if speed > 0 else 0.0)
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                message = update.get("message")
+                chat_id = message["chat"]["id"] if message else None
+                if message and update_kind(update) == "phone":
+                    phones[chat_id] = message["text"].strip()
+                last[chat_id] = pool.submit(send, update, due, last.get(chat_id))
+        return samples, lags, time.perf_counter() - started
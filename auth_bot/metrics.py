@@ -0,0 +1,339 @@
+import bisect
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("auth_bot.trace")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_IDENTIFIER = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with labels; observe() is a bisect and three
+    additions under a lock.
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self._series.items())
+        for key, (counts, total, count) in series:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+STAGE_SECONDS = Histogram(
+    "bale_stage_seconds",
+    "Time spent in each stage of handling a Bale update.",
+    labelnames=("stage", "command", "assistant_role"),
+)
+UPDATE_SECONDS = Histogram(
+    "bale_update_seconds",
+    "Total time to handle a Bale update.",
+    labelnames=("command", "assistant_role"),
+)
+UPDATES_TOTAL = Counter(
+    "bale_updates_total",
+    "Bale updates handled.",
+    labelnames=("command", "assistant_role"),
+)
+SLOW_TRACES_TOTAL = Counter("bale_traces_logged_total", "Update traces written to the trace log.")
+
+METRICS = [STAGE_SECONDS, UPDATE_SECONDS, UPDATES_TOTAL, SLOW_TRACES_TOTAL]
+
+
+class UpdateTrace:
+    """
+    The stage timings of one update, labelled once its command is known, and
+    the outbound HTTP calls it made (endpoint, seconds, status) for the
+    traffic recorder.
+    """
+    __slots__ = ("update_id", "command", "assistant_role", "spans", "calls", "started")
+
+    def __init__(self, update_id=None):
+        self.update_id = update_id
+        self.command = "none"
+        self.assistant_role = ""
+        self.spans = []
+        self.calls = []
+        self.started = time.perf_counter()
+
+
+_current_trace = contextvars.ContextVar("bale_update_trace", default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_update(update_id=None):
+    """
+    Collect the spans of one update and record them when it is done. Nested
+    calls (e.g. the webhook view, then process_update) share the outer trace.
+    """
+    trace = _current_trace.get()
+    if trace is not None or not metrics_enabled():
+        if trace is not None and trace.update_id is None:
+            trace.update_id = update_id
+        yield trace
+        return
+    trace = UpdateTrace(update_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        _finish(trace, time.perf_counter() - trace.started)
+
+
+def label_update(command=None, user=None):
+    """
+    Set the command / assistant_role labels of the current update's trace.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    if command is not None:
+        trace.command = command
+    if user is not None:
+        trace.assistant_role = user.assistant_role or ""
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a stage of the current update. Outside an update (e.g. a background
+    SMS sender) the stage is recorded right away without command labels.
+    """
+    if not metrics_enabled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((stage, elapsed))
+        else:
+            STAGE_SECONDS.observe(elapsed, stage=stage, command="none", assistant_role="")
+
+
+def record_call(endpoint, elapsed, status):
+    """
+    Note an outbound HTTP call of the current update (status 0: no answer).
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.calls.append((endpoint, elapsed, status))
+
+
+def _finish(trace, total):
+    labels = {"command": trace.command, "assistant_role": trace.assistant_role}
+    for stage, elapsed in trace.spans:
+        STAGE_SECONDS.observe(elapsed, stage=stage, **labels)
+    UPDATE_SECONDS.observe(total, **labels)
+    UPDATES_TOTAL.inc(**labels)
+
+    slow = getattr(settings, 'TRACE_SLOW_SECONDS', 0)
+    sample_rate = getattr(settings, 'TRACE_SAMPLE_RATE', 0.0)
+    if (slow and total >= slow) or (sample_rate and random.random() < sample_rate):
+        SLOW_TRACES_TOTAL.inc()
+        trace_logger.info(json.dumps({
+            "update_id": trace.update_id,
+            "command": trace.command,
+            "assistant_role": trace.assistant_role,
+            "total_ms": round(total * 1000, 1),
+            "stages": [{"stage": stage, "ms": round(elapsed * 1000, 1)} for stage, elapsed in trace.spans],
+        }, ensure_ascii=False))
+
+
+def _builtin_stats():
+    """
+    stats() / as_dict() of the long-lived components, as exported gauges.
+    Components that were never used in this process are left out.
+    """
+    from . import dispatcher, hedging, journal, outbox, sms
+    from .context import context_stats
+    from .dedup import update_dedup
+    from .http_client import get_http_stats
+    from .otp_store import otp_store
+    from .response_cache import response_cache
+    from .summary import summary_stats
+    from .talkbot import talkbot_resilience_stats
+    from .user_cache import user_cache
+
+    stats = {
+        "context": context_stats.as_dict(),
+        "summary": summary_stats.as_dict(),
+        "response_cache": response_cache.stats(),
+        "update_dedup": update_dedup.stats(),
+        "user_cache": user_cache.stats(),
+        "otp": otp_store.stats(),
+        "sms": sms.sms_stats.as_dict(),
+        "hedge": hedging.hedge_stats.as_dict(),
+        "talkbot": talkbot_resilience_stats(),
+        "http": get_http_stats(),
+    }
+    if dispatcher._dispatcher is not None:
+        stats["dispatcher"] = dispatcher._dispatcher.stats()
+    if outbox._scheduler is not None:
+        stats["outbox"] = outbox._scheduler.stats()
+    if journal._journal is not None:
+        stats["chat_journal"] = journal._journal.stats()
+    return stats
+
+
+def _flatten(name, value, labels, samples):
+    """
+    Turn nested stats into (metric, labels, number) samples. Keys that are
+    not valid metric name parts (URLs, chat ids) and list positions become
+    labels instead.
+    """
+    if isinstance(value, bool):
+        samples.append((name, labels, int(value)))
+    elif isinstance(value, (int, float)):
+        samples.append((name, labels, value))
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            key = str(key)
+            if _IDENTIFIER.fullmatch(key):
+                _flatten(f"{name}_{key}", item, labels, samples)
+            else:
+                _flatten(name, item, labels + [("key", key)], samples)
+    elif isinstance(value, (list, tuple)):
+        for index, item in enumerate(value):
+            _flatten(name, item, labels + [("index", index)], samples)
+    # Strings (e.g. a breaker's state) are not numbers; they are skipped
+
+
+def render_metrics():
+    """
+    Everything in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    samples = []
+    try:
+        for component, value in _builtin_stats().items():
+            _flatten(f"bale_{component}", value, [], samples)
+    except Exception:
+        logger.exception("Could not collect component stats")
+    # A family's samples must be contiguous; lists of dicts interleave them
+    families = {}
+    for name, labels, value in samples:
+        families.setdefault(name, []).append((labels, value))
+    for name, family in families.items():
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in family:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    for metric in METRICS:
+        metric.reset()
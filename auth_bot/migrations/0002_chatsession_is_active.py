@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='is_active',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0002_chatsession_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='baleuser',
+            name='quota_day',
+            field=models.DateField(blank=True, help_text='Day that current_message_count belongs to; older counts no longer apply.', null=True, verbose_name='Quota Day'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_session_exchanges(apps, schema_editor):
+    """
+    Sessions used to hold only their latest exchange; keep it as a turn.
+    """
+    ChatSession = apps.get_model('auth_bot', 'ChatSession')
+    ChatTurn = apps.get_model('auth_bot', 'ChatTurn')
+    batch = []
+    for session in ChatSession.objects.exclude(user_message='').iterator(chunk_size=2000):
+        batch.append(ChatTurn(
+            user_id=session.user_id,
+            session_id=session.id,
+            user_message=session.user_message,
+            bot_response=session.bot_response,
+            assistant_role=session.assistant_role,
+            token_count=(len(session.user_message) + len(session.bot_response)) // 4 + 1,
+            created_at=session.created_at,
+        ))
+        if len(batch) >= 2000:
+            ChatTurn.objects.bulk_create(batch)
+            batch = []
+    ChatTurn.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0003_baleuser_quota_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_message', models.TextField(verbose_name='User Message')),
+                ('bot_response', models.TextField(verbose_name='Bot Response')),
+                ('assistant_role', models.CharField(max_length=50, verbose_name='Assistant Role')),
+                ('token_count', models.PositiveIntegerField(default=0, help_text='Estimated prompt tokens of this exchange (message + answer).', verbose_name='Token Count')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Chat Turn',
+                'verbose_name_plural': 'Chat Turns',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', 'is_active'], name='chatsession_user_active'),
+        ),
+        migrations.AddField(
+            model_name='chatturn',
+            name='session',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='auth_bot.chatsession', verbose_name='Session'),
+        ),
+        migrations.AddField(
+            model_name='chatturn',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_turns', to='auth_bot.baleuser', verbose_name='User'),
+        ),
+        migrations.AddIndex(
+            model_name='chatturn',
+            index=models.Index(fields=['user', 'session', '-created_at'], name='chatturn_user_session_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='chatturn',
+            index=models.Index(fields=['user', '-created_at'], name='chatturn_user_recent'),
+        ),
+        migrations.RunPython(copy_session_exchanges, migrations.RunPython.noop),
+    ]
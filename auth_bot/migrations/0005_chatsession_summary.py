@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0004_chatturn'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='summarized_turns',
+            field=models.PositiveIntegerField(default=0, verbose_name='Summarized Turns'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary',
+            field=models.TextField(blank=True, default='', help_text='Compressed summary of the turns up to summary_until.', verbose_name='Summary'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary_source_tokens',
+            field=models.PositiveIntegerField(default=0, help_text='Estimated tokens of the history the current summary replaces.', verbose_name='Summary Source Tokens'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary_until',
+            field=models.DateTimeField(blank=True, help_text='created_at of the newest turn folded into the summary.', null=True, verbose_name='Summarized Until'),
+        ),
+    ]
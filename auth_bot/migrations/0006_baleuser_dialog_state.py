@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:17
+
+from django.db import migrations, models
+
+
+def mark_chatting_users(apps, schema_editor):
+    """
+    Users in the middle of a chat keep chatting after the upgrade.
+    """
+    BaleUser = apps.get_model('auth_bot', 'BaleUser')
+    BaleUser.objects.filter(
+        is_authenticated=True, chat_sessions__is_active=True
+    ).update(dialog_state='chatting')
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0005_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='baleuser',
+            name='dialog_state',
+            field=models.CharField(choices=[('idle', 'Idle'), ('awaiting_phone', 'Awaiting phone number'), ('awaiting_otp', 'Awaiting OTP'), ('choosing_role', 'Choosing role'), ('confirming_role', 'Confirming role'), ('chatting', 'Chatting')], default='idle', help_text='Where the user is in the login / role / chat conversation.', max_length=16, verbose_name='Dialog State'),
+        ),
+        migrations.RunPython(mark_chatting_users, migrations.RunPython.noop),
+    ]
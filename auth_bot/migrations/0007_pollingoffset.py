@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0006_baleuser_dialog_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollingOffset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='default', max_length=50, unique=True, verbose_name='Name')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='Offset')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Polling Offset',
+                'verbose_name_plural': 'Polling Offsets',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0007_pollingoffset'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='baleuser',
+            name='otp',
+        ),
+    ]
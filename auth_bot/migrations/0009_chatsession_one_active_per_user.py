@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:36
+
+from django.db import migrations, models
+
+
+def close_duplicate_sessions(apps, schema_editor):
+    """
+    Keep only the newest active session of each user; earlier races left some
+    users with several.
+    """
+    ChatSession = apps.get_model('auth_bot', 'ChatSession')
+    active = ChatSession.objects.filter(is_active=True).order_by('user_id', '-created_at', '-id')
+    seen = set()
+    stale = []
+    for session_id, user_id in active.values_list('id', 'user_id'):
+        if user_id in seen:
+            stale.append(session_id)
+        seen.add(user_id)
+    ChatSession.objects.filter(id__in=stale).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0008_remove_baleuser_otp'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('user',), name='chatsession_one_active_per_user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_bot', '0009_chatsession_one_active_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollingoffset',
+            name='pending',
+            field=models.JSONField(blank=True, default=list, verbose_name='Pending Updates'),
+        ),
+    ]
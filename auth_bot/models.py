@@ -1,14 +1,15 @@
 from django.db import models
 from django.utils.timezone import now
 
+from .context import estimate_tokens
+
 class BaleUser(models.Model):
     """
     Represents a user in the Bale bot system. Each user is identified
-    by a unique chat_id and phone_number, and can have an OTP for authentication.
+    by a unique chat_id and phone_number; pending OTPs live in otp_store, not here.
     """
     chat_id = models.CharField(max_length=50, unique=True)
     phone_number = models.CharField(max_length=15, unique=True)
-    otp = models.CharField(max_length=6, blank=True, null=True)
     is_authenticated = models.BooleanField(default=False)
 
     # Custom fields
@@ -20,6 +21,12 @@ class BaleUser(models.Model):
         default=0,
         verbose_name="Current Message Count"
     )
+    quota_day = models.DateField(
+        null=True,
+        blank=True,
+        verbose_name="Quota Day",
+        help_text="Day that current_message_count belongs to; older counts no longer apply."
+    )
     token_limit = models.PositiveIntegerField(
         default=300,
         verbose_name="Token Output Limit",
@@ -63,6 +70,29 @@ class BaleUser(models.Model):
         verbose_name="System Role"
     )
 
+    # Conversation state machine (see router.py)
+    DIALOG_IDLE = 'idle'
+    DIALOG_AWAITING_PHONE = 'awaiting_phone'
+    DIALOG_AWAITING_OTP = 'awaiting_otp'
+    DIALOG_CHOOSING_ROLE = 'choosing_role'
+    DIALOG_CONFIRMING_ROLE = 'confirming_role'
+    DIALOG_CHATTING = 'chatting'
+    DIALOG_STATES = [
+        (DIALOG_IDLE, 'Idle'),
+        (DIALOG_AWAITING_PHONE, 'Awaiting phone number'),
+        (DIALOG_AWAITING_OTP, 'Awaiting OTP'),
+        (DIALOG_CHOOSING_ROLE, 'Choosing role'),
+        (DIALOG_CONFIRMING_ROLE, 'Confirming role'),
+        (DIALOG_CHATTING, 'Chatting'),
+    ]
+    dialog_state = models.CharField(
+        max_length=16,
+        choices=DIALOG_STATES,
+        default=DIALOG_IDLE,
+        verbose_name="Dialog State",
+        help_text="Where the user is in the login / role / chat conversation."
+    )
+
     ROLE_DESCRIPTIONS = {
         'general_physician': "شما یک پزشک عمومی بسیار با تجربه، متعهد به درمان بیماران، و بسیار با حوصله و با اخلاق هستید.",
         'surgeon': "شما یک جراح متخصص با مهارت بسیار بالا در انجام جراحی‌های پیچیده و حساس هستید.",
@@ -86,23 +116,30 @@ class BaleUser(models.Model):
             "توضیحی موجود نیست."
         )
 
+    def set_dialog_state(self, state):
+        """
+        Move the user to another dialog state, writing only that column.
+        """
+        if self.dialog_state != state:
+            self.dialog_state = state
+            self.save(update_fields=['dialog_state'])
+
     def reset_daily_count(self):
         """
         Reset daily message count for the user.
+        Counts are bucketed per day (see quota.py), so this is only needed
+        to clear today's usage by hand.
         """
-        self.current_message_count = 0
-        self.save()
+        from .quota import reset
+        reset(self)
 
     def increment_message_count(self):
         """
         Increment the user's current message count.
         Returns True if incremented (under limit), False if not.
         """
-        if self.current_message_count < self.daily_message_limit:
-            self.current_message_count += 1
-            self.save()
-            return True
-        return False
+        from .quota import consume
+        return consume(self)
 
     def __str__(self):
         return f"{self.phone_number} - Auth: {self.is_authenticated}"
@@ -142,6 +179,38 @@ class ChatSession(models.Model):
         verbose_name="Created At"
     )
 
+    # Running summary of the older turns (see summary.py)
+    summary = models.TextField(
+        blank=True,
+        default="",
+        verbose_name="Summary",
+        help_text="Compressed summary of the turns up to summary_until."
+    )
+    summary_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Summarized Until",
+        help_text="created_at of the newest turn folded into the summary."
+    )
+    summarized_turns = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Summarized Turns"
+    )
+    summary_source_tokens = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Summary Source Tokens",
+        help_text="Estimated tokens of the history the current summary replaces."
+    )
+
+    def summary_compression_ratio(self):
+        """
+        How many history tokens each summary token stands for (0 without a summary).
+        """
+        summary_tokens = estimate_tokens(self.summary)
+        if not summary_tokens:
+            return 0.0
+        return round(self.summary_source_tokens / summary_tokens, 2)
+
     def __str__(self):
         return (
             f"Session {self.id} - User: {self.user.phone_number} - "
@@ -152,3 +221,116 @@ class ChatSession(models.Model):
         verbose_name = "Chat Session"
         verbose_name_plural = "Chat Sessions"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_active'], name='chatsession_user_active'),
+        ]
+        constraints = [
+            # A second concurrent get_or_create(is_active=True) fails and re-reads
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(is_active=True),
+                name='chatsession_one_active_per_user',
+            ),
+        ]
+
+class ChatTurnQuerySet(models.QuerySet):
+
+    def tail(self, user, session=None, limit=5, token_budget=None, since=None):
+        """
+        Return the user's latest turns, oldest first, in a single indexed query.
+
+        At most `limit` turns are read, newest first, straight off the
+        (user, session, created_at) index, so the cost does not grow with the
+        size of the table. With a token_budget, older turns are dropped once
+        their token_count no longer fits. With `since`, only turns created
+        after it are considered (e.g. the ones not yet in the session summary).
+        """
+        turns = self.filter(user=user)
+        if session is not None:
+            turns = turns.filter(session=session)
+        if since is not None:
+            turns = turns.filter(created_at__gt=since)
+        turns = turns.order_by('-created_at', '-id').only(
+            'id', 'user_message', 'bot_response', 'token_count', 'created_at'
+        )[:limit]
+
+        picked = []
+        used = 0
+        for turn in turns:
+            if token_budget is not None and used + turn.token_count > token_budget:
+                break
+            used += turn.token_count
+            picked.append(turn)
+        picked.reverse()
+        return picked
+
+class ChatTurn(models.Model):
+    """
+    One exchange (user message + bot answer) inside a ChatSession.
+    """
+    user = models.ForeignKey(
+        BaleUser,
+        on_delete=models.CASCADE,
+        related_name='chat_turns',
+        verbose_name="User"
+    )
+    session = models.ForeignKey(
+        ChatSession,
+        on_delete=models.CASCADE,
+        related_name='turns',
+        verbose_name="Session"
+    )
+    user_message = models.TextField(verbose_name="User Message")
+    bot_response = models.TextField(verbose_name="Bot Response")
+    assistant_role = models.CharField(max_length=50, verbose_name="Assistant Role")
+    token_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Token Count",
+        help_text="Estimated prompt tokens of this exchange (message + answer)."
+    )
+    created_at = models.DateTimeField(default=now, verbose_name="Created At")
+
+    objects = ChatTurnQuerySet.as_manager()
+
+    @staticmethod
+    def estimate_tokens(*texts):
+        """
+        Local token estimate of the given texts (see context.estimate_tokens).
+        """
+        return sum(estimate_tokens(text or "") for text in texts)
+
+    def save(self, *args, **kwargs):
+        if not self.token_count:
+            self.token_count = self.estimate_tokens(self.user_message, self.bot_response)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Turn {self.id} - Session {self.session_id} - {self.created_at:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        verbose_name = "Chat Turn"
+        verbose_name_plural = "Chat Turns"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'session', '-created_at'], name='chatturn_user_session_recent'),
+            models.Index(fields=['user', '-created_at'], name='chatturn_user_recent'),
+        ]
+
+class PollingOffset(models.Model):
+    """
+    Next getUpdates offset of the long-polling ingestion loop (poll_updates),
+    stored so a restarted poller neither skips nor replays a whole backlog.
+    pending holds the updates already confirmed to Bale but not yet handled;
+    a restarted poller handles them first.
+    """
+    name = models.CharField(max_length=50, unique=True, default='default', verbose_name="Name")
+    offset = models.BigIntegerField(default=0, verbose_name="Offset")
+    pending = models.JSONField(default=list, blank=True, verbose_name="Pending Updates")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    def __str__(self):
+        return f"{self.name}: {self.offset}"
+
+    class Meta:
+        verbose_name = "Polling Offset"
+        verbose_name_plural = "Polling Offsets"
@@ -0,0 +1,176 @@
+import hashlib
+import hmac
+import logging
+import math
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of OTPStore.verify()
+VERIFIED = "verified"
+INVALID = "invalid"
+MISSING = "missing"
+LOCKED = "locked"
+THROTTLED = "throttled"
+
+
+def generate_code():
+    return f"{secrets.randbelow(900000) + 100000}"
+
+
+class OTPStore:
+    """
+    One-time codes in a Django cache, keyed by chat_id.
+
+    Only an HMAC of the code is stored, with the cache TTL as its expiry.
+    Verifying is one keyed lookup plus an atomic attempt counter; after
+    max_attempts wrong guesses the code is dropped and a new one must be
+    requested. Sends are throttled per phone number and per chat, and
+    verifications per chat, by token buckets kept in the same cache.
+
+    Codes and buckets are only shared by every worker process when alias is
+    a shared cache such as Redis. The project's default cache is LocMem,
+    one per process: with several workers a code issued by one is missing
+    in the others and each worker grants its own burst of sends
+    (manage.py check warns about it, see checks.py).
+    """
+
+    def __init__(self, alias="default", ttl=300, max_attempts=5, prefix="otp:",
+                 phone_rate=(3, 5), chat_rate=(5, 10), verify_rate=(10, 30)):
+        # *_rate: (burst, refills per hour)
+        self.alias = alias
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self.phone_rate = phone_rate
+        self.chat_rate = chat_rate
+        self.verify_rate = verify_rate
+        self._lock = threading.Lock()
+        self._counters = {
+            "issued": 0,
+            "verified": 0,
+            "invalid": 0,
+            "missing": 0,
+            "locked": 0,
+            "throttled": 0,
+        }
+
+    def _cache(self):
+        return caches[self.alias]
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _digest(self, chat_id, code):
+        message = f"{chat_id}:{code}".encode()
+        return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+    def _take_tokens(self, *buckets):
+        """
+        Take one token from each (key, rate) bucket, or from none of them
+        when any is empty; returns whether they were taken. Check-then-set,
+        so concurrent callers can overdraw a token or two.
+        """
+        cache = self._cache()
+        now = time.time()
+        updates = []
+        for key, (burst, per_hour) in buckets:
+            if burst <= 0 or per_hour <= 0:
+                continue
+            refill = per_hour / 3600.0
+            tokens, updated = cache.get(self.prefix + key, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated) * refill)
+            if tokens < 1:
+                return False
+            updates.append((key, tokens - 1, math.ceil(burst / refill)))
+        for key, tokens, timeout in updates:
+            cache.set(self.prefix + key, (tokens, now), timeout)
+        return True
+
+    def allow_send(self, chat_id, phone_number):
+        """
+        Whether another code may be sent to this chat and phone number. A
+        refused send uses up neither limit.
+        """
+        allowed = self._take_tokens(
+            (f"send-chat:{chat_id}", self.chat_rate),
+            (f"send-phone:{phone_number}", self.phone_rate),
+        )
+        if not allowed:
+            self._count("throttled")
+            logger.info("Throttled OTP send for chat %s", chat_id)
+        return allowed
+
+    def issue(self, chat_id, code=None):
+        """
+        Store a fresh code for chat_id (replacing any earlier one) and return it.
+        """
+        code = code or generate_code()
+        cache = self._cache()
+        cache.set(self.prefix + f"code:{chat_id}", self._digest(chat_id, code), self.ttl)
+        cache.set(self.prefix + f"attempts:{chat_id}", 0, self.ttl)
+        self._count("issued")
+        return code
+
+    def verify(self, chat_id, code):
+        """
+        Check a code. Returns VERIFIED (and consumes it), INVALID, MISSING
+        (none issued or expired), LOCKED (too many wrong guesses; the code is
+        gone) or THROTTLED (too many attempts from this chat).
+        """
+        if not self._take_tokens((f"verify-chat:{chat_id}", self.verify_rate)):
+            self._count("throttled")
+            return THROTTLED
+        cache = self._cache()
+        code_key = self.prefix + f"code:{chat_id}"
+        attempts_key = self.prefix + f"attempts:{chat_id}"
+        digest = cache.get(code_key)
+        if digest is None:
+            self._count("missing")
+            return MISSING
+        try:
+            attempts = cache.incr(attempts_key)
+        except ValueError:
+            # The counter expired just before the code did
+            attempts = self.max_attempts + 1
+        if attempts > self.max_attempts:
+            cache.delete_many([code_key, attempts_key])
+            self._count("locked")
+            return LOCKED
+        if not hmac.compare_digest(digest, self._digest(chat_id, code)):
+            if attempts == self.max_attempts:
+                cache.delete_many([code_key, attempts_key])
+                self._count("locked")
+                return LOCKED
+            self._count("invalid")
+            return INVALID
+        cache.delete_many([code_key, attempts_key])
+        self._count("verified")
+        return VERIFIED
+
+    def discard(self, chat_id):
+        self._cache().delete_many([self.prefix + f"code:{chat_id}", self.prefix + f"attempts:{chat_id}"])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+def _build_store():
+    return OTPStore(
+        alias=getattr(settings, 'OTP_CACHE_ALIAS', 'default'),
+        ttl=getattr(settings, 'OTP_TTL', 300),
+        max_attempts=getattr(settings, 'OTP_MAX_ATTEMPTS', 5),
+        phone_rate=(getattr(settings, 'OTP_PHONE_BURST', 3), getattr(settings, 'OTP_PHONE_PER_HOUR', 5)),
+        chat_rate=(getattr(settings, 'OTP_CHAT_BURST', 5), getattr(settings, 'OTP_CHAT_PER_HOUR', 10)),
+        verify_rate=(getattr(settings, 'OTP_VERIFY_BURST', 10), getattr(settings, 'OTP_VERIFY_PER_HOUR', 30)),
+    )
+
+
+otp_store = _build_store()
@@ -0,0 +1,398 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Bale (like Telegram) rejects texts longer than this many characters
+MAX_MESSAGE_LENGTH = 4096
+
+PENDING = "pending"
+SENT = "sent"
+QUEUED = "queued"
+FAILED = "failed"
+DROPPED = "dropped"
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """
+    Split text into parts of at most limit characters, preferring paragraph,
+    line and word boundaries so no part ends in the middle of a word.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, limit // 2, limit)
+            if cut != -1:
+                break
+        if cut == -1:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return [part for part in parts if part] or [""]
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket; rate tokens per second, bursts up to capacity.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """
+        Take a token and return how long the caller must wait before using it,
+        or None (taking nothing) if that would be longer than max_wait.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            wait = (1 - self._tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def refund(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class Delivery:
+    """
+    One outbound Bale API call and what happened to it.
+    """
+    __slots__ = ("method", "chat_id", "payload", "status", "attempts", "response", "not_before")
+
+    def __init__(self, method, chat_id, payload):
+        self.method = method
+        self.chat_id = chat_id
+        self.payload = payload
+        self.status = PENDING
+        self.attempts = 0
+        self.response = None
+        self.not_before = 0.0
+
+    def __repr__(self):
+        return f"<Delivery {self.method} chat={self.chat_id} {self.status} attempts={self.attempts}>"
+
+
+def retry_after(response):
+    """
+    Seconds Bale asked us to wait in a 429 reply (0 if it did not say).
+    """
+    try:
+        data = response.json()
+        value = (data.get("parameters") or {}).get("retry_after")
+        if value is not None:
+            return float(value)
+    except (ValueError, AttributeError):
+        pass
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _is_success(response):
+    # requests.Response has .ok, httpx.Response has .is_success
+    ok = getattr(response, "ok", None)
+    return response.is_success if ok is None else ok
+
+
+class OutboundScheduler:
+    """
+    Paces every sendMessage / editMessageText call made to Bale.
+
+    A global token bucket caps the overall send rate and a small bucket per
+    chat spaces out messages to one user. A caller waits at most max_wait
+    seconds for its turn; longer waits, and 429 replies whose retry_after is
+    longer than max_wait, move the delivery to a bounded retry queue that a
+    background thread drains once the wait is over. A 429 without a
+    retry_after backs off from min_retry_delay, doubling per attempt. Later messages to a chat
+    with queued deliveries queue up behind them, so a chat never sees its
+    messages out of order.
+    """
+
+    def __init__(self, transport, rate=25.0, burst=30, chat_rate=1.0, chat_burst=3,
+                 max_wait=5.0, max_queue=1000, max_attempts=5, max_chats=10000, min_retry_delay=0.5):
+        self.transport = transport
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.max_chats = max_chats
+        self.min_retry_delay = min_retry_delay
+        self._chat_buckets = OrderedDict()
+        self._backlog = {}
+        self._due = []
+        self._sequence = itertools.count()
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._worker = None
+        self._counters = {
+            "sent": 0,
+            "failed": 0,
+            "queued": 0,
+            "dropped": 0,
+            "rate_limited": 0,
+            "retried": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _chat_bucket(self, chat_id):
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self._chat_buckets[chat_id] = bucket
+                while len(self._chat_buckets) > self.max_chats:
+                    self._chat_buckets.popitem(last=False)
+            else:
+                self._chat_buckets.move_to_end(chat_id)
+            return bucket
+
+    def _reserve(self, chat_id):
+        """
+        Wait time for the next send to chat_id, or None if over max_wait.
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        chat_wait = chat_bucket.reserve(self.max_wait)
+        if chat_wait is None:
+            return None
+        wait = self.bucket.reserve(self.max_wait - chat_wait)
+        if wait is None:
+            chat_bucket.refund()
+            return None
+        return max(chat_wait, wait)
+
+    def deliver(self, method, chat_id, payload, queue=True):
+        """
+        Send one call now (waiting for the rate limits) and return its Delivery.
+        With queue=False a call that cannot go out within max_wait is not
+        queued for later: it stays PENDING without a response.
+        """
+        delivery = Delivery(method, chat_id, payload)
+        with self._lock:
+            behind = bool(self._backlog.get(chat_id))
+        wait = None if behind else self._reserve(chat_id)
+        if wait is None:
+            if queue:
+                self._enqueue(delivery, 0.0)
+            return delivery
+        if wait:
+            time.sleep(wait)
+        self._attempt(delivery, queue)
+        return delivery
+
+    async def adeliver(self, method, chat_id, payload, send):
+        """
+        deliver() for the asyncio path: send is a coroutine function taking
+        (method, payload); waits use asyncio.sleep. Deliveries that need to be
+        retried later are left to the (threaded) retry queue.
+        """
+        delivery = Delivery(method, chat_id, payload)
+        with self._lock:
+            behind = bool(self._backlog.get(chat_id))
+        wait = None if behind else self._reserve(chat_id)
+        if wait is None:
+            self._enqueue(delivery, 0.0)
+            return delivery
+        if wait:
+            await asyncio.sleep(wait)
+        delivery.attempts += 1
+        delivery.response = await send(method, payload)
+        delay = self._settle(delivery)
+        if delay is not None:
+            self._enqueue(delivery, delay)
+        return delivery
+
+    def _attempt(self, delivery, queue=True):
+        """
+        Call Bale until the delivery is sent, fails, or has to wait in the retry queue.
+        """
+        while True:
+            delivery.attempts += 1
+            delivery.response = self.transport(delivery.method, delivery.payload)
+            delay = self._settle(delivery)
+            if delay is None:
+                return
+            if delay > self.max_wait:
+                if queue:
+                    self._enqueue(delivery, delay)
+                else:
+                    delivery.status = PENDING
+                return
+            self._count("retried")
+            time.sleep(delay)
+
+    def _settle(self, delivery):
+        """
+        Record the outcome of an attempt. Returns the delay before the next
+        attempt for a rate-limited delivery, or None when it is finished.
+        """
+        response = delivery.response
+        if response is not None and response.status_code == 429:
+            self._count("rate_limited")
+            # No (or a zero) retry_after: back off anyway instead of hammering Bale
+            delay = retry_after(response) or self.min_retry_delay * 2 ** (delivery.attempts - 1)
+            if delivery.attempts < self.max_attempts:
+                return delay
+            delivery.status = FAILED
+            self._count("failed")
+            logger.warning("Gave up on %s to Bale chat %s after %d attempts",
+                           delivery.method, delivery.chat_id, delivery.attempts)
+            return None
+        if response is not None and _is_success(response):
+            delivery.status = SENT
+            self._count("sent")
+        else:
+            delivery.status = FAILED
+            self._count("failed")
+        return None
+
+    def _enqueue(self, delivery, delay):
+        with self._lock:
+            if self._queued >= self.max_queue:
+                delivery.status = DROPPED
+                self._counters["dropped"] += 1
+                logger.warning("Outbound queue full; dropped %s to Bale chat %s",
+                               delivery.method, delivery.chat_id)
+                return
+            delivery.status = QUEUED
+            delivery.not_before = time.monotonic() + delay
+            backlog = self._backlog.setdefault(delivery.chat_id, deque())
+            backlog.append(delivery)
+            self._queued += 1
+            self._counters["queued"] += 1
+            if len(backlog) == 1:
+                heapq.heappush(self._due, (delivery.not_before, next(self._sequence), delivery.chat_id))
+            self._start_worker()
+            self._wakeup.notify()
+
+    def _start_worker(self):
+        # Called with the lock held
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._drain, name="bale-outbox", daemon=True)
+            self._worker.start()
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                while True:
+                    if not self._due:
+                        self._wakeup.wait(1.0)
+                        if not self._due:
+                            continue
+                    due, _, chat_id = self._due[0]
+                    now = time.monotonic()
+                    if due <= now:
+                        heapq.heappop(self._due)
+                        break
+                    self._wakeup.wait(due - now)
+                delivery = self._backlog[chat_id][0]
+
+            wait = self._reserve(chat_id)
+            if wait is None:
+                # No token within max_wait: never send without one, look again
+                # later and let other chats' deliveries go first meanwhile
+                with self._lock:
+                    delivery.not_before = time.monotonic() + max(self.max_wait, 0.05)
+                    heapq.heappush(self._due, (delivery.not_before, next(self._sequence), chat_id))
+                continue
+            if wait:
+                time.sleep(wait)
+
+            try:
+                delivery.attempts += 1
+                delivery.response = self.transport(delivery.method, delivery.payload)
+                delay = self._settle(delivery)
+            except Exception:
+                logger.exception("Error while retrying %s to Bale chat %s", delivery.method, chat_id)
+                delivery.status = FAILED
+                delay = None
+
+            with self._lock:
+                backlog = self._backlog[chat_id]
+                if delay is not None:
+                    # Still rate limited: keep it first in line for this chat
+                    self._counters["retried"] += 1
+                    delivery.not_before = time.monotonic() + delay
+                else:
+                    backlog.popleft()
+                    self._queued -= 1
+                if backlog:
+                    heapq.heappush(self._due, (backlog[0].not_before, next(self._sequence), chat_id))
+                else:
+                    del self._backlog[chat_id]
+
+    def wait_idle(self, timeout=10.0):
+        """
+        Block until the retry queue is empty (for tests and shutdown).
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._queued:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["queue_depth"] = self._queued
+            data["chats_waiting"] = len(self._backlog)
+        return data
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(transport):
+    """
+    Return the process-wide scheduler, creating it from settings on first use.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = OutboundScheduler(
+                    transport,
+                    rate=getattr(settings, 'BALE_SEND_RATE', 25.0),
+                    burst=getattr(settings, 'BALE_SEND_BURST', 30),
+                    chat_rate=getattr(settings, 'BALE_CHAT_SEND_RATE', 1.0),
+                    chat_burst=getattr(settings, 'BALE_CHAT_SEND_BURST', 3),
+                    max_wait=getattr(settings, 'BALE_SEND_MAX_WAIT', 5.0),
+                    max_queue=getattr(settings, 'BALE_SEND_QUEUE_SIZE', 1000),
+                    max_attempts=getattr(settings, 'BALE_SEND_MAX_ATTEMPTS', 5),
+                    min_retry_delay=getattr(settings, 'BALE_SEND_MIN_RETRY_DELAY', 0.5),
+                )
+    return _scheduler
@@ -0,0 +1,173 @@
+import logging
+import random
+import threading
+
+import requests
+from django.conf import settings
+
+from .dispatcher import ChatLaneDispatcher
+from .models import PollingOffset
+from .utils import get_updates_from_bale
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatePoller:
+    """
+    getUpdates long-poll loop, the webhook-free way to receive Bale updates.
+
+    Fetched updates go to a ChatLaneDispatcher: different chats run in
+    parallel, while one chat's updates run one after another in arrival
+    order, across batches too. The poller does not wait for them. Each batch
+    is first written to PollingOffset.pending together with the next offset,
+    and only then queued, so the next getUpdates (which confirms the batch to
+    Bale) is sent while slow chats are still being answered. The lanes'
+    bounded queues are the backpressure. After a crash, the restarted poller
+    handles the pending updates first. Updates that finished after the last
+    save are only recognised by update_id (see dedup.py) with
+    UPDATE_DEDUP_BACKEND=shared on a cache that outlives the process, such as
+    Redis; with the default per-process dedup they are handled again.
+    """
+
+    def __init__(self, handler, name="default", workers=8, limit=100, timeout=30,
+                 fetch=get_updates_from_bale):
+        self.handler = handler
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.fetch = fetch
+        self.dispatcher = ChatLaneDispatcher(
+            handler=self._handle_update,
+            lanes=workers,
+            queue_size=workers * 4,
+            put_timeout=None,
+        )
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._dirty = False
+        self._counters = {
+            "batches": 0,
+            "updates": 0,
+            "recovered": 0,
+            "failed": 0,
+            "fetch_errors": 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def load_offset(self):
+        """
+        Stored offset; pending updates of an earlier run are queued again.
+        """
+        state, _ = PollingOffset.objects.get_or_create(name=self.name)
+        if state.pending:
+            logger.info("Handling %d updates left pending by the last run", len(state.pending))
+            self._count("recovered", len(state.pending))
+            self._track(state.pending)
+            self._submit(state.pending)
+        return state.offset
+
+    def save_offset(self, offset):
+        """
+        Store the next offset along with the updates still being handled.
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._dirty = False
+        PollingOffset.objects.update_or_create(
+            name=self.name, defaults={"offset": offset, "pending": pending},
+        )
+
+    def _track(self, updates):
+        with self._lock:
+            for update in updates:
+                self._pending[update["update_id"]] = update
+
+    def _submit(self, updates):
+        # put_timeout=None: blocks while the chat's lane is full
+        for update in updates:
+            self.dispatcher.submit(update)
+
+    def _handle_update(self, update):
+        try:
+            self.handler(update)
+        except Exception:
+            self._count("failed")
+            logger.exception("Error while processing polled update %s", update.get("update_id"))
+        finally:
+            with self._lock:
+                self._pending.pop(update["update_id"], None)
+                self._dirty = True
+
+    def poll_once(self, offset):
+        """
+        Fetch one batch, store it and queue it; returns the next offset.
+        Does not wait for the updates to be handled.
+        """
+        updates = self.fetch(offset=offset, limit=self.limit, timeout=self.timeout)
+        if not updates:
+            if self._dirty:
+                self.save_offset(offset)
+            return offset
+
+        next_offset = max(update["update_id"] for update in updates) + 1
+        self._track(updates)
+        self.save_offset(next_offset)
+        self._submit(updates)
+        self._count("batches")
+        self._count("updates", len(updates))
+        logger.debug("Queued %d polled updates, next offset %d", len(updates), next_offset)
+        return next_offset
+
+    def run(self, once=False):
+        """
+        Poll until stop() is called (or after one batch with once=True).
+        Fetch errors back off exponentially with jitter, up to 30 seconds.
+        On the way out the queued updates are finished and the offset saved.
+        """
+        offset = self.load_offset()
+        failures = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    offset = self.poll_once(offset)
+                    failures = 0
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    self._count("fetch_errors")
+                    failures += 1
+                    delay = random.uniform(0, min(30.0, 0.5 * 2 ** failures))
+                    logger.warning("getUpdates failed (%s); retrying in %.1fs", e, delay)
+                    self._stop.wait(delay)
+                if once:
+                    break
+        finally:
+            self.dispatcher.stop()
+            self.save_offset(offset)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["pending"] = len(self._pending)
+        data["dispatcher"] = self.dispatcher.stats()
+        return data
+
+
+def build_poller(**overrides):
+    """
+    UpdatePoller wired to process_update_once with the POLL_* settings.
+    """
+    from .views import process_update_once
+
+    options = {
+        "workers": getattr(settings, 'POLL_WORKERS', 8),
+        "limit": getattr(settings, 'POLL_LIMIT', 100),
+        "timeout": getattr(settings, 'POLL_TIMEOUT', 30),
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return UpdatePoller(handler=process_update_once, **options)
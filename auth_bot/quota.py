@@ -0,0 +1,83 @@
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import BaleUser
+from .user_cache import write_through
+
+
+def quota_today():
+    """
+    The quota bucket for "now" (the local date in settings.TIME_ZONE).
+    """
+    return timezone.localdate()
+
+
+def remaining(user):
+    """
+    Messages the user may still send today, computed from the loaded row.
+    A count stamped with an earlier day no longer applies: the reset is lazy.
+    """
+    if user.quota_day != quota_today():
+        return user.daily_message_limit
+    return max(0, user.daily_message_limit - user.current_message_count)
+
+
+def consume(user):
+    """
+    Atomically take one message from today's quota.
+
+    A single conditional UPDATE both checks and increments the counter, so
+    concurrent messages from the same user can never exceed the limit. The
+    first message of a new day restarts the count at 1; no nightly job has to
+    touch the users table. Returns True if the message was allowed.
+    """
+    today = quota_today()
+    allowed = BaleUser.objects.filter(
+        Q(pk=user.pk),
+        Q(daily_message_limit__gt=0),
+        Q(quota_day__isnull=True)
+        | Q(quota_day__lt=today)
+        | Q(current_message_count__lt=F('daily_message_limit')),
+    ).update(
+        current_message_count=Case(
+            When(quota_day=today, then=F('current_message_count') + 1),
+            default=Value(1),
+        ),
+        quota_day=today,
+    )
+    if not allowed:
+        return False
+
+    # Mirror the UPDATE on the instance (and the user cache) without reading it back.
+    if user.quota_day == today:
+        user.current_message_count += 1
+    else:
+        user.current_message_count = 1
+    user.quota_day = today
+    write_through(user)
+    return True
+
+
+def release(user):
+    """
+    Give back a message taken with consume() (e.g. when TalkBot failed).
+    """
+    today = quota_today()
+    released = BaleUser.objects.filter(
+        pk=user.pk, quota_day=today, current_message_count__gt=0
+    ).update(current_message_count=F('current_message_count') - 1)
+    if released and user.quota_day == today and user.current_message_count > 0:
+        user.current_message_count -= 1
+        write_through(user)
+    return bool(released)
+
+
+def reset(user):
+    """
+    Clear today's count for one user (admin/support use).
+    """
+    today = quota_today()
+    BaleUser.objects.filter(pk=user.pk).update(current_message_count=0, quota_day=today)
+    user.current_message_count = 0
+    user.quota_day = today
+    write_through(user)
@@ -0,0 +1,213 @@
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import current_trace
+from .router import GLOBAL_COMMANDS, route_text
+
+logger = logging.getLogger(__name__)
+
+# Stands in for a recorded OTP; the replay sends the code the Kavenegar stub received
+OTP_PLACEHOLDER = "<otp>"
+
+_PHONE = re.compile(r"09\d{9}")
+_OTP = re.compile(r"\d{6}")
+_DIGITS = re.compile(r"\d{1,3}")
+_NON_SPACE = re.compile(r"\S")
+
+
+def _pseudonym(value, size):
+    digest = hmac.new(settings.SECRET_KEY.encode(), f"traffic:{value}".encode(), hashlib.sha256)
+    return digest.hexdigest()[:size]
+
+
+def scrub_text(text):
+    """
+    Keep the shape of a message without its content: commands and short
+    numbers (role choices) stay, phone numbers get a stable fake number,
+    OTPs become OTP_PLACEHOLDER and anything else is masked character by
+    character, so its length and word breaks survive.
+    """
+    text = text or ""
+    stripped = text.strip()
+    if stripped.lower() in GLOBAL_COMMANDS or _DIGITS.fullmatch(stripped):
+        return text
+    if _PHONE.fullmatch(stripped):
+        return "09" + str(int(_pseudonym(stripped, 12), 16))[-9:].zfill(9)
+    if _OTP.fullmatch(stripped):
+        return OTP_PLACEHOLDER
+    return _NON_SPACE.sub("x", text)
+
+
+def scrub_update(update):
+    """
+    The parts of an update the bot reads, with the chat id pseudonymised and
+    the text scrubbed. Names, usernames and the rest of the payload are dropped.
+    """
+    scrubbed = {"update_id": update.get("update_id")}
+    message = update.get("message")
+    if isinstance(message, dict):
+        chat_id = (message.get("chat") or {}).get("id")
+        scrubbed["message"] = {
+            "chat": {"id": "r" + _pseudonym(chat_id, 12)},
+            "text": scrub_text(message.get("text", "")),
+        }
+    return scrubbed
+
+
+def update_kind(update):
+    """
+    The command a (scrubbed) update's text looks like, for per-type reports.
+    """
+    message = update.get("message")
+    if not message:
+        return "other"
+    if message.get("text") == OTP_PLACEHOLDER:
+        return "otp"
+    return route_text(message.get("text", "").strip())
+
+
+def chat_sampled(update, rate):
+    """
+    Whether the chat of update is in the recorded sample. Chats are sampled
+    as a whole, so recorded sessions stay complete.
+    """
+    if rate >= 1:
+        return True
+    chat_id = ((update.get("message") or {}).get("chat") or {}).get("id")
+    bucket = int(hashlib.sha256(str(chat_id).encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < rate
+
+
+class TrafficRecorder:
+    """
+    Appends scrubbed webhook updates to a gzip-compressed JSON-lines log.
+
+    One record per update: "t" (arrival, unix seconds), "ms" (handling
+    time), "u" (the scrubbed update) and "calls" (the outbound HTTP calls
+    it made: [endpoint, ms, status]). Records are buffered and written as
+    one gzip member every flush_every records (and at exit), so the webhook
+    thread never compresses or touches the disk per update.
+    """
+
+    def __init__(self, path, flush_every=50, sample_rate=1.0):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.sample_rate = sample_rate
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counters = {"recorded": 0, "skipped": 0, "flushes": 0, "write_errors": 0}
+
+    def record(self, update, arrived, elapsed, calls=()):
+        if not chat_sampled(update, self.sample_rate):
+            with self._lock:
+                self._counters["skipped"] += 1
+            return
+        line = json.dumps({
+            "t": round(arrived, 3),
+            "ms": round(elapsed * 1000, 1),
+            "u": scrub_update(update),
+            "calls": [[endpoint, round(seconds * 1000, 1), status] for endpoint, seconds, status in calls],
+        }, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._buffer.append(line)
+            self._counters["recorded"] += 1
+            full = len(self._buffer) >= self.flush_every
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        # Each flush appends a gzip member; gzip.open reads them back as one stream
+        with self._write_lock:
+            try:
+                with gzip.open(self.path, "at", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError:
+                logger.exception("Could not write %d recorded updates to %s", len(lines), self.path)
+                with self._lock:
+                    self._counters["write_errors"] += 1
+                return
+        with self._lock:
+            self._counters["flushes"] += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["buffered"] = len(self._buffer)
+        return data
+
+
+def read_log(path):
+    """
+    Yield the records of a traffic log in the order they were written.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """
+    Return the process-wide recorder, or None unless TRAFFIC_RECORD_PATH is set.
+    "{pid}" in the path gives every worker process a file of its own.
+    """
+    global _recorder
+    path = getattr(settings, 'TRAFFIC_RECORD_PATH', '')
+    if not path:
+        return None
+    path = path.format(pid=os.getpid())
+    if _recorder is None or _recorder.path != path:
+        with _recorder_lock:
+            if _recorder is None or _recorder.path != path:
+                if _recorder is not None:
+                    _recorder.flush()
+                _recorder = TrafficRecorder(
+                    path,
+                    flush_every=getattr(settings, 'TRAFFIC_RECORD_FLUSH_EVERY', 50),
+                    sample_rate=getattr(settings, 'TRAFFIC_RECORD_SAMPLE_RATE', 1.0),
+                )
+    return _recorder
+
+
+@atexit.register
+def _flush_at_exit():
+    if _recorder is not None:
+        _recorder.flush()
+
+
+@contextmanager
+def record_update(update):
+    """
+    Record update, with the outbound calls of the current trace, once the
+    block that handles it is done. Does nothing unless recording is enabled.
+    """
+    recorder = get_recorder()
+    if recorder is None or not isinstance(update, dict):
+        yield
+        return
+    arrived, started = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = current_trace()
+        recorder.record(update, arrived, time.perf_counter() - started, trace.calls if trace else ())
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fail fast while a dependency is down.
+
+    After failure_threshold consecutive failures the breaker opens and
+    allow() returns False for reset_timeout seconds. Then one trial call is
+    let through (half open): its success closes the breaker, its failure
+    opens it for another reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._counters = {
+            "successes": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0,
+        }
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def available(self):
+        """
+        Whether a call would currently be allowed, without claiming the trial call.
+        """
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and not self._probing)
+
+    def allow(self):
+        """
+        Claim permission for one call; False means fail fast.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._probing:
+                self._state = HALF_OPEN
+                self._probing = True
+                return True
+            self._counters["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._counters["successes"] += 1
+            self._failures = 0
+            self._probing = False
+            if self._state != CLOSED:
+                logger.info("Circuit %s closed", self.name)
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._counters["failures"] += 1
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._counters["opened"] += 1
+                    logger.warning("Circuit %s opened after %d failures", self.name, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def abandon(self):
+        """
+        Give back a permission from allow() whose call was cancelled before it
+        finished, so a half-open breaker can send another trial call.
+        """
+        with self._lock:
+            self._probing = False
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run func through the breaker; raises CircuitOpenError when open.
+        Any exception from func counts as a failure.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            data = dict(self._counters)
+            data["consecutive_failures"] = self._failures
+        data["state"] = state
+        return data
+
+
+class AdaptiveLimiter:
+    """
+    AIMD cap on the calls in flight to one dependency.
+
+    Every call that comes back in time raises the limit by 1/limit (about
+    +1 per round of calls, up to max_limit). A call slower than
+    latency_target or answered with an overload signal (429, 5xx, timeout)
+    multiplies it by backoff, at most once per cooldown seconds so one bad
+    burst does not collapse it to min_limit. Callers over the limit wait up
+    to their timeout for a slot and are then turned away.
+    """
+
+    def __init__(self, name, initial=4, min_limit=1, max_limit=16, latency_target=10.0,
+                 backoff=0.5, cooldown=1.0):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._counters = {
+            "acquired": 0,
+            "rejected": 0,
+            "increases": 0,
+            "decreases": 0,
+        }
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def _try_acquire(self):
+        # Called with the condition held
+        if self._in_flight < int(self._limit):
+            self._in_flight += 1
+            self._counters["acquired"] += 1
+            return True
+        return False
+
+    def acquire(self, timeout=0.0):
+        """
+        Take a slot, waiting up to timeout seconds. Returns False if none freed up.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._try_acquire():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["rejected"] += 1
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    async def aacquire(self, timeout=0.0):
+        """
+        acquire() for the event loop: polls instead of blocking the thread.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if self._try_acquire():
+                    return True
+                if time.monotonic() >= deadline:
+                    self._counters["rejected"] += 1
+                    return False
+            await asyncio.sleep(0.02)
+
+    def release(self, latency=None, overloaded=False):
+        """
+        Give the slot back and adapt the limit to how the call went.
+        latency=None (e.g. a call that was never sent) leaves the limit alone.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if overloaded or (latency is not None and latency > self.latency_target):
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                    self._last_decrease = now
+                    self._counters["decreases"] += 1
+            elif latency is not None and self._limit < self.max_limit:
+                self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+                self._counters["increases"] += 1
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            data = dict(self._counters)
+            data["limit"] = round(self._limit, 2)
+            data["in_flight"] = self._in_flight
+        return data
@@ -0,0 +1,252 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .user_cache import LocalLRUBackend, SharedCacheBackend
+
+# Arabic code points that users type on Arabic keyboards, mapped to the Persian ones
+_PERSIAN_CHARS = str.maketrans({
+    "\u064A": "\u06CC",  # ARABIC YEH -> FARSI YEH
+    "\u0649": "\u06CC",  # ALEF MAKSURA -> FARSI YEH
+    "\u0643": "\u06A9",  # ARABIC KAF -> KEHEH
+    "\u0629": "\u0647",  # TEH MARBUTA -> HEH
+    "\u0623": "\u0627",  # ALEF WITH HAMZA ABOVE -> ALEF
+    "\u0625": "\u0627",  # ALEF WITH HAMZA BELOW -> ALEF
+    "\u0622": "\u0627",  # ALEF WITH MADDA ABOVE -> ALEF
+    "\u200C": " ",       # ZERO WIDTH NON-JOINER
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+})
+# Harakat, superscript alef and tatweel carry no meaning for the cache key
+_DIACRITICS = re.compile(r"[\u064B-\u065F\u0670\u0640]")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_NUMBERS = re.compile(r"\d+")
+# Words that flip a question's meaning; "don't" etc. lose the apostrophe in normalize_prompt
+_NEGATIONS = frozenset({
+    "نه", "نمی", "نیست", "نیستم", "نیستی", "نیستیم", "نیستید", "نیستند", "هیچ", "بدون",
+    "no", "not", "never", "without", "cannot", "don", "doesn", "didn", "isn", "aren", "wasn", "won",
+})
+
+
+def normalize_prompt(text):
+    """
+    Canonical form of a user message for cache keys: Persian letters and
+    digits, no diacritics or punctuation, lower case, single spaces.
+    """
+    text = (text or "").translate(_PERSIAN_CHARS)
+    text = _DIACRITICS.sub("", text)
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+def _trigrams(text):
+    padded = f" {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _conflicting(a, b):
+    """
+    Whether two normalized prompts must not share an answer however similar
+    they look: different numbers (ages, doses, days) or a negation only one
+    of them has, as a word ("نه", "not") or a verb prefix ("خوردم" / "نخوردم").
+    """
+    if _NUMBERS.findall(a) != _NUMBERS.findall(b):
+        return True
+    words_a, words_b = set(a.split()), set(b.split())
+    only_a, only_b = words_a - words_b, words_b - words_a
+    if (only_a | only_b) & _NEGATIONS:
+        return True
+    return any("ن" + word in only_b for word in only_a) or any("ن" + word in only_a for word in only_b)
+
+
+CacheKey = namedtuple('CacheKey', ['bucket', 'normalized', 'digest'])
+
+
+class _SimilarityIndex:
+    """
+    Bounded, per-bucket list of cached prompts as character trigram sets,
+    searched by Jaccard similarity for near-duplicate questions.
+    """
+
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        grams = _trigrams(key.normalized)
+        with self._lock:
+            bucket = self._buckets.setdefault(key.bucket, OrderedDict())
+            bucket[key.digest] = (key.normalized, grams)
+            bucket.move_to_end(key.digest)
+            while len(bucket) > self.maxsize:
+                bucket.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._buckets.get(key.bucket, {}).pop(key.digest, None)
+
+    def nearest(self, key, threshold):
+        """
+        Return (digest, score) of the most similar prompt at or above
+        threshold, skipping prompts that conflict with key (see _conflicting).
+        """
+        grams = _trigrams(key.normalized)
+        best, best_score = None, threshold
+        with self._lock:
+            candidates = list(self._buckets.get(key.bucket, {}).items())
+        for digest, (normalized, other) in candidates:
+            # Jaccard can't reach the threshold when the sizes differ too much
+            if min(len(grams), len(other)) < threshold * max(len(grams), len(other)):
+                continue
+            score = len(grams & other) / len(grams | other)
+            if score >= best_score and not _conflicting(key.normalized, normalized):
+                best, best_score = digest, score
+        return (best, best_score) if best is not None else (None, 0.0)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class ResponseCache:
+    """
+    Cache of TalkBot answers to first messages, keyed on the normalized
+    question, the assistant/system roles, the model and max_tokens.
+
+    Only stateless requests (no history, no summary) are cacheable, since
+    the answer then depends on nothing but the key. Entries expire after
+    the backend TTL and are evicted LRU. With a similarity threshold, a
+    miss falls back to the closest cached question of the same roles that
+    has the same numbers and negations.
+    """
+
+    def __init__(self, backend, similarity=0.0, index_size=500, bypass_roles=()):
+        self.backend = backend
+        self.similarity = similarity
+        self.index = _SimilarityIndex(index_size)
+        self.bypass_roles = set(bypass_roles)
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "similar_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+        }
+        self._latency_saved = 0.0
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def set_bypass(self, role, bypass=True):
+        """
+        Turn the cache off (or back on) for one assistant role.
+        """
+        with self._lock:
+            if bypass:
+                self.bypass_roles.add(role)
+            else:
+                self.bypass_roles.discard(role)
+
+    def key_for(self, assistant_role, system_role, model, text, max_tokens=None):
+        """
+        Build the CacheKey of a first message, or None when the role bypasses the cache.
+        """
+        if assistant_role in self.bypass_roles:
+            self._count("bypassed")
+            return None
+        normalized = normalize_prompt(text)
+        if not normalized:
+            return None
+        bucket = f"{assistant_role}|{system_role}|{model}|{max_tokens}"
+        digest = hashlib.sha1(f"{bucket}|{normalized}".encode("utf-8")).hexdigest()
+        return CacheKey(bucket, normalized, digest)
+
+    def get(self, key):
+        """
+        Return the cached TalkBot response for key, or None on a miss.
+        """
+        started = time.monotonic()
+        entry = self.backend.get(key.digest)
+        if entry is not None:
+            self._record_hit("hits", entry, started)
+            return entry["response"]
+
+        if self.similarity > 0:
+            digest, _ = self.index.nearest(key, self.similarity)
+            if digest is not None:
+                entry = self.backend.get(digest)
+                if entry is not None:
+                    self._record_hit("similar_hits", entry, started)
+                    return entry["response"]
+                # Expired or evicted from the backend meanwhile
+                self.index.discard(CacheKey(key.bucket, "", digest))
+
+        self._count("misses")
+        return None
+
+    def put(self, key, response, elapsed):
+        """
+        Store a successful TalkBot response; elapsed is how long it took to get it.
+        """
+        if "error" in response:
+            return
+        self.backend.set(key.digest, {"response": response, "elapsed": elapsed})
+        if self.similarity > 0:
+            self.index.add(key)
+        self._count("stores")
+
+    def _record_hit(self, counter, entry, started):
+        saved = max(0.0, entry["elapsed"] - (time.monotonic() - started))
+        with self._lock:
+            self._counters[counter] += 1
+            self._latency_saved += saved
+
+    def clear(self):
+        self.backend.clear()
+        self.index.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data["latency_saved"] = round(self._latency_saved, 3)
+            data["bypass_roles"] = sorted(self.bypass_roles)
+        hits = data["hits"] + data["similar_hits"]
+        lookups = hits + data["misses"]
+        data["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+        return data
+
+
+def _build_cache():
+    ttl = getattr(settings, 'RESPONSE_CACHE_TTL', 3600)
+    if getattr(settings, 'RESPONSE_CACHE_BACKEND', 'local') == 'shared':
+        backend = SharedCacheBackend(
+            alias=getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default'), ttl=ttl, prefix="talkbot:"
+        )
+    else:
+        backend = LocalLRUBackend(maxsize=getattr(settings, 'RESPONSE_CACHE_SIZE', 2000), ttl=ttl)
+    return ResponseCache(
+        backend,
+        similarity=getattr(settings, 'RESPONSE_CACHE_SIMILARITY', 0.0),
+        index_size=getattr(settings, 'RESPONSE_CACHE_INDEX_SIZE', 500),
+        bypass_roles=getattr(settings, 'RESPONSE_CACHE_BYPASS_ROLES', ()),
+    )
+
+
+response_cache = _build_cache()
+
+
+def cache_key_for(user, text, model, has_history):
+    """
+    CacheKey for a chat message, or None when the answer must not come from the cache.
+    """
+    if has_history or not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+        return None
+    return response_cache.key_for(user.assistant_role, user.system_role, model, text, max_tokens=user.token_limit)
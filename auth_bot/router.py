@@ -0,0 +1,82 @@
+import re
+
+from .models import BaleUser
+
+# Commands that mean the same thing in every dialog state
+GLOBAL_COMMANDS = {
+    "/start": "start",
+    "/login": "login",
+    "/logout": "logout",
+    "/startchat": "startchat",
+    "#": "end_chat",
+}
+
+_PHONE = re.compile(r"09\d{9}")
+_OTP = re.compile(r"\d{6}")
+_DIGITS = re.compile(r"\d+")
+
+
+def route_text(text):
+    """
+    Decide which command an incoming text maps to from its shape alone.
+    Returns one of: start, login, phone, otp, logout, startchat, end_chat, role, chat.
+
+    This is the routing of users without a known dialog state (idle), kept
+    as it was before the state machine existed.
+    """
+    command = GLOBAL_COMMANDS.get(text.lower())
+    if command:
+        return command
+    if _PHONE.fullmatch(text):
+        return "phone"
+    if _OTP.fullmatch(text):
+        return "otp"
+    if _DIGITS.fullmatch(text):
+        return "role"
+    return "chat"
+
+
+def _awaiting_phone(text):
+    return "phone" if _PHONE.fullmatch(text) else "invalid_phone"
+
+
+def _awaiting_otp(text):
+    if _OTP.fullmatch(text):
+        return "otp"
+    if _PHONE.fullmatch(text):
+        # A different number: send a new code there
+        return "phone"
+    return "invalid_otp"
+
+
+def _role_selection(text):
+    return "role" if _DIGITS.fullmatch(text) else "chat"
+
+
+def _chatting(text):
+    return "chat"
+
+
+# Dialog state -> classifier of the non-command texts valid in that state
+STATE_ROUTES = {
+    BaleUser.DIALOG_IDLE: route_text,
+    BaleUser.DIALOG_AWAITING_PHONE: _awaiting_phone,
+    BaleUser.DIALOG_AWAITING_OTP: _awaiting_otp,
+    BaleUser.DIALOG_CHOOSING_ROLE: _role_selection,
+    BaleUser.DIALOG_CONFIRMING_ROLE: _role_selection,
+    BaleUser.DIALOG_CHATTING: _chatting,
+}
+
+
+def route(state, text):
+    """
+    Map a text to a command given the chat's dialog state.
+
+    Global commands win in every state; otherwise the state's own classifier
+    decides, so e.g. a 6-digit number typed while chatting is a chat message
+    and not an OTP attempt.
+    """
+    command = GLOBAL_COMMANDS.get(text.lower())
+    if command:
+        return command
+    return STATE_ROUTES.get(state, route_text)(text)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from kavenegar import APIException, HTTPException
+
+from .benchmark import percentile
+from .dispatcher import UpdateDispatcher
+from .resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+SENT = "sent"
+FAILED = "failed"
+SHORT_CIRCUITED = "short_circuited"
+
+OTP_SMS_FAILED_MESSAGE = "خطایی در ارسال کد OTP رخ داد. لطفاً دوباره تلاش کنید."
+
+_API_STATUS = re.compile(r"APIException\[(\d+)\]")
+
+
+class _SMSStats:
+    """
+    Outcome and latency of every OTP SMS attempt, plus the most recent attempts.
+    """
+
+    def __init__(self, keep=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=keep)
+        self.recent = deque(maxlen=100)
+        self.counters = {SENT: 0, FAILED: 0, SHORT_CIRCUITED: 0, "retried": 0, "rejected": 0}
+
+    def record(self, chat_id, attempt, outcome, latency, error=None):
+        with self._lock:
+            self.counters[outcome] += 1
+            if attempt > 1:
+                self.counters["retried"] += 1
+            if outcome != SHORT_CIRCUITED:
+                self._latencies.append(latency)
+            self.recent.append({
+                "chat_id": chat_id,
+                "attempt": attempt,
+                "outcome": outcome,
+                "latency_ms": round(latency * 1000, 1),
+                "error": str(error) if error else "",
+            })
+        logger.info("OTP SMS for chat %s attempt %d: %s in %.0f ms%s", chat_id, attempt, outcome,
+                    latency * 1000, f" ({error})" if error else "")
+
+    def record_rejected(self):
+        with self._lock:
+            self.counters["rejected"] += 1
+
+    def as_dict(self):
+        with self._lock:
+            data = dict(self.counters)
+            latencies = list(self._latencies)
+        data["p50_ms"] = round(percentile(latencies, 50) * 1000, 1)
+        data["p95_ms"] = round(percentile(latencies, 95) * 1000, 1)
+        data["breaker"] = kavenegar_breaker.stats()
+        return data
+
+
+sms_stats = _SMSStats()
+
+kavenegar_breaker = CircuitBreaker(
+    "kavenegar",
+    failure_threshold=getattr(settings, 'OTP_SMS_BREAKER_FAILURES', 5),
+    reset_timeout=getattr(settings, 'OTP_SMS_BREAKER_RESET', 30.0),
+)
+
+
+def _retryable(exc):
+    """
+    Network errors and Kavenegar 5xx answers are worth retrying (and count
+    against the breaker); 4xx answers such as an invalid receptor are not.
+    """
+    if isinstance(exc, HTTPException):
+        return True
+    match = _API_STATUS.search(str(exc))
+    return match is None or int(match.group(1)) >= 500
+
+
+def _backoff(attempt):
+    return random.uniform(0, getattr(settings, 'OTP_SMS_RETRY_BACKOFF', 0.5) * 2 ** (attempt - 1))
+
+
+def _max_attempts():
+    return max(1, getattr(settings, 'OTP_SMS_MAX_ATTEMPTS', 3))
+
+
+def _attempt_outcome(chat_id, attempt, started, exc):
+    """
+    Record a failed attempt; returns True if another attempt should follow.
+    """
+    retryable = _retryable(exc)
+    if retryable:
+        kavenegar_breaker.record_failure()
+    else:
+        # A 4xx answer means Kavenegar is up; it also ends a half-open trial call
+        kavenegar_breaker.record_success()
+    sms_stats.record(chat_id, attempt, FAILED, time.monotonic() - started, exc)
+    return retryable and attempt < _max_attempts()
+
+
+def deliver_otp(chat_id, phone_number, otp):
+    """
+    Send the OTP SMS with bounded retries through the Kavenegar breaker.
+    Returns True once an attempt succeeded.
+    """
+    from .auth import send_otp_sms
+
+    for attempt in range(1, _max_attempts() + 1):
+        if not kavenegar_breaker.allow():
+            sms_stats.record(chat_id, attempt, SHORT_CIRCUITED, 0.0)
+            return False
+        started = time.monotonic()
+        try:
+            send_otp_sms(phone_number, otp)
+        except (APIException, HTTPException) as e:
+            if not _attempt_outcome(chat_id, attempt, started, e):
+                return False
+            time.sleep(_backoff(attempt))
+            continue
+        except BaseException:
+            # Not an answer from Kavenegar (a bug, a cancelled task): hand back a trial call
+            kavenegar_breaker.abandon()
+            raise
+        kavenegar_breaker.record_success()
+        sms_stats.record(chat_id, attempt, SENT, time.monotonic() - started)
+        return True
+    return False
+
+
+async def adeliver_otp(chat_id, phone_number, otp):
+    """
+    deliver_otp() for the asyncio path, using the async Kavenegar call.
+    """
+    from .auth import asend_otp_sms
+
+    for attempt in range(1, _max_attempts() + 1):
+        if not kavenegar_breaker.allow():
+            sms_stats.record(chat_id, attempt, SHORT_CIRCUITED, 0.0)
+            return False
+        started = time.monotonic()
+        try:
+            await asend_otp_sms(phone_number, otp)
+        except (APIException, HTTPException) as e:
+            if not _attempt_outcome(chat_id, attempt, started, e):
+                return False
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        except BaseException:
+            # Not an answer from Kavenegar (a bug, a cancelled task): hand back a trial call
+            kavenegar_breaker.abandon()
+            raise
+        kavenegar_breaker.record_success()
+        sms_stats.record(chat_id, attempt, SENT, time.monotonic() - started)
+        return True
+    return False
+
+
+def _run_job(job):
+    from .utils import send_message_to_bale
+
+    chat_id, phone_number, otp = job
+    if not deliver_otp(chat_id, phone_number, otp):
+        send_message_to_bale(chat_id, OTP_SMS_FAILED_MESSAGE)
+
+
+_sms_dispatcher = None
+_sms_dispatcher_lock = threading.Lock()
+
+
+def get_sms_dispatcher():
+    """
+    Return the worker pool that sends OTP SMS off the webhook's thread.
+    """
+    global _sms_dispatcher
+    if _sms_dispatcher is None:
+        with _sms_dispatcher_lock:
+            if _sms_dispatcher is None:
+                _sms_dispatcher = UpdateDispatcher(
+                    handler=_run_job,
+                    workers=getattr(settings, 'OTP_SMS_WORKERS', 4),
+                    queue_size=getattr(settings, 'OTP_SMS_QUEUE_SIZE', 500),
+                    put_timeout=0,
+                )
+    return _sms_dispatcher
+
+
+def queue_otp_sms(chat_id, phone_number, otp):
+    """
+    Hand the OTP SMS to the background senders. Returns False straight away,
+    without queueing, when Kavenegar's breaker is open or the queue is full;
+    the caller should then tell the user to try again later.
+    """
+    if not kavenegar_breaker.available():
+        sms_stats.record(chat_id, 1, SHORT_CIRCUITED, 0.0)
+        return False
+    if not get_sms_dispatcher().submit((chat_id, phone_number, otp)):
+        sms_stats.record_rejected()
+        logger.warning("OTP SMS queue full; rejected code for chat %s", chat_id)
+        return False
+    return True
+
+
+def sms_queue_mode():
+    return getattr(settings, 'OTP_SMS_MODE', 'queue') == 'queue'
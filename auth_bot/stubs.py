@@ -0,0 +1,229 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers the handful of TalkBot, Bale and Kavenegar endpoints the bot uses.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        stub.record(url.path)
+
+        if url.path.endswith("/getUpdates"):
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            payload = {"ok": True, "result": stub.take_updates(
+                offset=int(query.get("offset", 0)),
+                limit=int(query.get("limit", 100)),
+                timeout=float(query.get("timeout", 0)),
+            )}
+        elif url.path.endswith("/chat/completions"):
+            time.sleep(stub.latency_for(url.path, stub.talkbot_latency))
+            if stub.fails(stub.talkbot_error_rate):
+                self._send_json(503, {"error": "stub overloaded"})
+                return
+            try:
+                streamed = json.loads(body or b"{}").get("stream", False)
+            except ValueError:
+                streamed = False
+            if streamed and stub.talkbot_chunks > 0:
+                self._send_stream(stub)
+                return
+            payload = {
+                "choices": [
+                    {"message": {"role": "assistant", "content": stub.reply_text}}
+                ]
+            }
+        elif "/verify/lookup.json" in self.path:
+            time.sleep(stub.latency_for(url.path, stub.kavenegar_latency))
+            form = {key: values[-1] for key, values in parse_qs(body.decode("utf-8")).items()}
+            if stub.fails(stub.kavenegar_error_rate):
+                payload = {"return": {"status": 500, "message": "stub failure"}, "entries": []}
+            else:
+                stub.record_code(form.get("receptor"), form.get("token"))
+                payload = {"return": {"status": 200, "message": "تایید شد"}, "entries": [{}]}
+        elif self.path.startswith("/bot"):
+            time.sleep(stub.latency_for(url.path, stub.bale_latency))
+            payload = {"ok": True, "result": {"message_id": stub.next_message_id()}}
+        else:
+            self._send_json(404, {"error": "unknown stub endpoint"})
+            return
+        self._send_json(200, payload)
+
+    do_GET = do_POST
+
+    def _send_stream(self, stub):
+        # OpenAI-style server-sent events, closed by the server after [DONE]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        text = stub.reply_text
+        size = max(1, -(-len(text) // stub.talkbot_chunks))
+        for start in range(0, len(text), size):
+            chunk = {"choices": [{"delta": {"content": text[start:start + size]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(stub.talkbot_chunk_interval)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class StubServer:
+    """
+    Local stand-in for api.talkbot.ir, tapi.bale.ai and api.kavenegar.com.
+
+    Use as a context manager; `settings_overrides()` returns the settings that
+    point the bot at this server instead of the real services.
+
+    Latencies are medians: with jitter > 0 each call waits latency times a
+    log-normal factor (sigma=jitter), which gives the long tail real LLM
+    endpoints have. *_error_rate is the fraction of calls that fail (TalkBot
+    answers 503, Kavenegar a status 500 body). Streamed TalkBot requests get
+    the reply in talkbot_chunks SSE chunks, talkbot_chunk_interval apart.
+    OTP codes sent through Kavenegar are kept per phone number (last_code).
+    recorded_latencies maps an endpoint (the last path segment, e.g.
+    "sendMessage" or "completions") to latencies in seconds; calls to it
+    wait a random one of them instead.
+    """
+
+    def __init__(self, talkbot_latency=0.2, bale_latency=0.0, kavenegar_latency=0.0,
+                 reply_text="پاسخ آزمایشی", jitter=0.0, talkbot_error_rate=0.0,
+                 kavenegar_error_rate=0.0, talkbot_chunks=4, talkbot_chunk_interval=0.05,
+                 recorded_latencies=None, seed=None):
+        self.talkbot_latency = talkbot_latency
+        self.bale_latency = bale_latency
+        self.kavenegar_latency = kavenegar_latency
+        self.reply_text = reply_text
+        self.jitter = jitter
+        self.talkbot_error_rate = talkbot_error_rate
+        self.kavenegar_error_rate = kavenegar_error_rate
+        self.talkbot_chunks = talkbot_chunks
+        self.talkbot_chunk_interval = talkbot_chunk_interval
+        self.recorded_latencies = recorded_latencies or {}
+        self.calls = {}
+        self.codes = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._updates = []
+        self._updates_ready = threading.Condition(self._lock)
+        self._message_id = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def settings_overrides(self):
+        return {
+            "TALKBOT_API_URL": f"{self.base_url}/v1/chat/completions",
+            "BALE_API_BASE_URL": self.base_url,
+            "KAVENEGAR_API_BASE_URL": self.base_url,
+            # The harnesses post updates straight to the webhook views
+            "BALE_WEBHOOK_SECRET": "",
+        }
+
+    def record(self, path):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def sample_latency(self, median):
+        if median <= 0 or self.jitter <= 0:
+            return max(0.0, median)
+        with self._lock:
+            return median * self._random.lognormvariate(0.0, self.jitter)
+
+    def latency_for(self, path, median):
+        samples = self.recorded_latencies.get(path.rsplit("/", 1)[-1])
+        if samples:
+            with self._lock:
+                return self._random.choice(samples)
+        return self.sample_latency(median)
+
+    def fails(self, rate):
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def record_code(self, phone_number, code):
+        with self._lock:
+            self.codes[phone_number] = code
+
+    def last_code(self, phone_number):
+        """
+        The most recent OTP sent to phone_number through the Kavenegar stub.
+        """
+        with self._lock:
+            return self.codes.get(phone_number)
+
+    def next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def push_updates(self, updates):
+        """
+        Queue updates for the getUpdates endpoint (long-polling clients).
+        """
+        with self._updates_ready:
+            self._updates.extend(updates)
+            self._updates_ready.notify_all()
+
+    def take_updates(self, offset=0, limit=100, timeout=0.0):
+        """
+        getUpdates semantics: confirm everything below offset, then return up
+        to limit pending updates, waiting up to timeout seconds for one.
+        """
+        with self._updates_ready:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            if not self._updates and timeout > 0:
+                self._updates_ready.wait(timeout)
+            return self._updates[:limit]
+
+    def start(self):
+        self._server = _StubHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
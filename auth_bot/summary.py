@@ -0,0 +1,215 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .context import estimate_tokens
+from .dispatcher import UpdateDispatcher
+from .models import ChatSession, ChatTurn
+from .talkbot import talk_to_bot
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "شما خلاصه‌نویس یک گفتگوی پزشکی هستید. خلاصه قبلی (در صورت وجود) و گفتگوهای جدید را "
+    "در یک خلاصه کوتاه و به زبان فارسی ترکیب کنید. علائم، سوابق، داروها، توصیه‌های داده‌شده و "
+    "سوالات باز را نگه دارید و از تکرار و احوال‌پرسی صرف‌نظر کنید."
+)
+
+
+def summary_every():
+    """
+    Number of new turns (beyond the ones kept verbatim) that triggers a summary.
+    """
+    return getattr(settings, 'CHAT_SUMMARY_EVERY', 8)
+
+
+def summary_keep_turns():
+    """
+    Number of newest turns that always stay out of the summary.
+    """
+    return getattr(settings, 'CHAT_SUMMARY_KEEP_TURNS', 4)
+
+
+class _SummaryStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.failures = 0
+        self.turns_folded = 0
+        self.source_tokens = 0
+        self.summary_tokens = 0
+
+    def record(self, turns, source_tokens, summary_tokens):
+        with self._lock:
+            self.jobs += 1
+            self.turns_folded += turns
+            self.source_tokens += source_tokens
+            self.summary_tokens += summary_tokens
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def as_dict(self):
+        with self._lock:
+            data = {
+                "jobs": self.jobs,
+                "failures": self.failures,
+                "turns_folded": self.turns_folded,
+                "source_tokens": self.source_tokens,
+                "summary_tokens": self.summary_tokens,
+            }
+        data["compression_ratio"] = (
+            round(data["source_tokens"] / data["summary_tokens"], 2) if data["summary_tokens"] else 0.0
+        )
+        return data
+
+
+summary_stats = _SummaryStats()
+
+
+def _format_turns(turns):
+    return "\n".join(
+        f"کاربر: {turn.user_message}\nدستیار: {turn.bot_response}" for turn in turns
+    )
+
+
+def summarise_session(session_id):
+    """
+    Fold the session's older turns into its running summary.
+
+    Everything except the newest CHAT_SUMMARY_KEEP_TURNS turns that is not yet
+    summarized is sent to TalkBot together with the previous summary. The new
+    summary is stored only if nobody else summarized the session meanwhile.
+    Returns True when the summary was updated.
+    """
+    session = ChatSession.objects.filter(pk=session_id, is_active=True).first()
+    if session is None:
+        return False
+
+    turns = ChatTurn.objects.filter(user_id=session.user_id, session=session)
+    if session.summary_until is not None:
+        turns = turns.filter(created_at__gt=session.summary_until)
+    turns = list(turns.order_by('created_at', 'id').only(
+        'id', 'user_message', 'bot_response', 'token_count', 'created_at'
+    ))
+    keep = summary_keep_turns()
+    if len(turns) < summary_every() + keep:
+        return False
+    folded = turns[:len(turns) - keep] if keep else turns
+
+    parts = []
+    if session.summary:
+        parts.append(f"خلاصه قبلی:\n{session.summary}")
+    parts.append(f"گفتگوهای جدید:\n{_format_turns(folded)}")
+    response = talk_to_bot(
+        user_messages=[{"role": "user", "content": "\n\n".join(parts)}],
+        system_role_description=SUMMARY_PROMPT,
+        max_tokens=getattr(settings, 'CHAT_SUMMARY_MAX_TOKENS', 300),
+        temperature=0.0,
+    )
+    if "error" in response:
+        summary_stats.record_failure()
+        logger.warning("Summary of session %s failed: %s", session_id, response["error"])
+        return False
+    summary = (
+        response.get("choices", [{}])[0].get("message", {}).get("content") or ""
+    ).strip()
+    if not summary:
+        summary_stats.record_failure()
+        return False
+
+    # The previous summary stood for summary_source_tokens; the new one also
+    # replaces the folded turns.
+    source_tokens = session.summary_source_tokens + sum(turn.token_count for turn in folded)
+    updated = ChatSession.objects.filter(
+        pk=session.pk, summary_until=session.summary_until
+    ).update(
+        summary=summary,
+        summary_until=folded[-1].created_at,
+        summarized_turns=F('summarized_turns') + len(folded),
+        summary_source_tokens=source_tokens,
+    )
+    if not updated:
+        return False
+
+    summary_tokens = estimate_tokens(summary)
+    summary_stats.record(len(folded), source_tokens, summary_tokens)
+    logger.info(
+        "Summarized %d turns of session %s: %d -> %d tokens (ratio %.1f)",
+        len(folded), session_id, source_tokens, summary_tokens,
+        source_tokens / summary_tokens if summary_tokens else 0.0,
+    )
+    return True
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _run_summary(session_id):
+    try:
+        summarise_session(session_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(session_id)
+
+
+_summary_dispatcher = None
+_summary_dispatcher_lock = threading.Lock()
+
+
+def get_summary_dispatcher():
+    """
+    Return the worker pool that runs summaries, apart from the update
+    dispatcher so a slow summary never delays a user's message.
+    """
+    global _summary_dispatcher
+    if _summary_dispatcher is None:
+        with _summary_dispatcher_lock:
+            if _summary_dispatcher is None:
+                _summary_dispatcher = UpdateDispatcher(
+                    handler=_run_summary,
+                    workers=getattr(settings, 'CHAT_SUMMARY_WORKERS', 2),
+                    queue_size=getattr(settings, 'CHAT_SUMMARY_QUEUE_SIZE', 100),
+                    put_timeout=0,
+                )
+    return _summary_dispatcher
+
+
+def schedule_summary(session_id):
+    """
+    Queue a summary of the session once the current transaction commits.
+    At most one job per session is pending; a full queue just skips this round.
+    """
+    with _pending_lock:
+        if session_id in _pending:
+            return False
+        _pending.add(session_id)
+
+    def submit():
+        if not get_summary_dispatcher().submit(session_id):
+            with _pending_lock:
+                _pending.discard(session_id)
+
+    transaction.on_commit(submit)
+    return True
+
+
+def maybe_schedule_summary(session):
+    """
+    Called after a turn is stored: schedule a summary when enough turns have
+    piled up since the last one. Costs one indexed COUNT per message.
+    """
+    if not getattr(settings, 'CHAT_SUMMARY_ENABLED', True):
+        return False
+    turns = ChatTurn.objects.filter(user_id=session.user_id, session=session)
+    if session.summary_until is not None:
+        turns = turns.filter(created_at__gt=session.summary_until)
+    if turns.count() < summary_every() + summary_keep_turns():
+        return False
+    return schedule_summary(session.pk)
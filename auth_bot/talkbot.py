@@ -1,8 +1,143 @@
+import asyncio
 import requests
 import json
+import logging
+import threading
+import time
+from contextlib import closing
+
+import httpx
 from django.conf import settings
 
-def talk_to_bot(
+from .hedging import ahedged_call, hedge_stats, hedged_call, hedging_enabled
+from .http_client import http_request, ahttp_request
+from .resilience import AdaptiveLimiter, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Returned as the error when every endpoint is saturated, open or overloaded
+OVERLOADED_ERROR = "سرویس پاسخ‌گویی در حال حاضر شلوغ است. لطفاً کمی بعد دوباره تلاش کنید."
+
+_breakers = {}
+_limiters = {}
+_async_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def talkbot_upstreams(model, first=None):
+    """
+    The (url, model) pairs to try, in order: the requested model on
+    TALKBOT_API_URL, then every TALKBOT_FALLBACKS entry ("model" or
+    "model@url"; a missing part means the primary's). An entry passed as
+    first (same format) goes before all of them.
+    """
+    primary_url = getattr(settings, 'TALKBOT_API_URL', 'https://api.talkbot.ir/v1/chat/completions')
+    entries = [first] if first else []
+    entries += [model] + list(getattr(settings, 'TALKBOT_FALLBACKS', ()))
+    upstreams = []
+    for entry in entries:
+        entry_model, _, entry_url = entry.partition("@")
+        upstream = (entry_url or primary_url, entry_model or model)
+        if upstream not in upstreams:
+            upstreams.append(upstream)
+    return upstreams
+
+
+def get_breaker(url, model):
+    """
+    Circuit breaker of one model on one endpoint.
+    """
+    key = f"{model}@{url}"
+    with _registry_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(
+                key,
+                failure_threshold=getattr(settings, 'TALKBOT_BREAKER_FAILURES', 5),
+                reset_timeout=getattr(settings, 'TALKBOT_BREAKER_RESET', 30.0),
+            )
+        return breaker
+
+
+def get_limiter(url):
+    """
+    Adaptive in-flight limit of one endpoint, shared by all its models.
+    """
+    with _registry_lock:
+        limiter = _limiters.get(url)
+        if limiter is None:
+            limiter = _limiters[url] = AdaptiveLimiter(
+                url,
+                initial=getattr(settings, 'TALKBOT_CONCURRENCY', 4),
+                min_limit=getattr(settings, 'TALKBOT_MIN_CONCURRENCY', 1),
+                max_limit=getattr(settings, 'TALKBOT_MAX_CONCURRENCY', 6),
+                latency_target=getattr(settings, 'TALKBOT_LATENCY_TARGET', 20.0),
+            )
+        return limiter
+
+
+def get_async_limiter(url):
+    """
+    In-flight limit of one endpoint for the asyncio path (atalk_to_bot).
+    No worker pool bounds that path, so it has its own, much higher
+    ceiling (TALKBOT_ASYNC_*) instead of the sync limit sized for the
+    worker threads.
+    """
+    with _registry_lock:
+        limiter = _async_limiters.get(url)
+        if limiter is None:
+            limiter = _async_limiters[url] = AdaptiveLimiter(
+                f"{url} (async)",
+                initial=getattr(settings, 'TALKBOT_ASYNC_CONCURRENCY', 50),
+                min_limit=getattr(settings, 'TALKBOT_MIN_CONCURRENCY', 1),
+                max_limit=getattr(settings, 'TALKBOT_ASYNC_MAX_CONCURRENCY', 200),
+                latency_target=getattr(settings, 'TALKBOT_LATENCY_TARGET', 20.0),
+            )
+        return limiter
+
+
+def talkbot_resilience_stats():
+    with _registry_lock:
+        limiters, breakers = dict(_limiters), dict(_breakers)
+        async_limiters = dict(_async_limiters)
+    return {
+        "limiters": {url: limiter.stats() for url, limiter in limiters.items()},
+        "async_limiters": {url: limiter.stats() for url, limiter in async_limiters.items()},
+        "breakers": {key: breaker.stats() for key, breaker in breakers.items()},
+    }
+
+
+def reset_talkbot_resilience():
+    """
+    Forget every limiter and breaker (they are rebuilt from settings on next use).
+    """
+    with _registry_lock:
+        _limiters.clear()
+        _async_limiters.clear()
+        _breakers.clear()
+
+
+def _is_overloaded(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def _settle(breaker, limiter, started, overloaded):
+    limiter.release(time.monotonic() - started, overloaded)
+    if overloaded:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _queue_timeout():
+    return getattr(settings, 'TALKBOT_QUEUE_TIMEOUT', 2.0)
+
+
+def _async_queue_timeout():
+    return getattr(settings, 'TALKBOT_ASYNC_QUEUE_TIMEOUT', 10.0)
+
+
+def build_talkbot_request(
     user_messages,
     assistant_messages=None,
     system_role_description=None,
@@ -11,25 +146,14 @@ def talk_to_bot(
     temperature=0.3,
     top_p=1.0,
     frequency_penalty=0.0,
-    presence_penalty=0.0
+    presence_penalty=0.0,
+    stream=False,
+    url=None
 ):
     """
-    Interact with the TalkBot.ir service in an extended way:
-    1) We pass in a short "memory" (history) of user_messages and assistant_messages.
-    2) We optionally include a system prompt with role="system".
-    3) Model parameters (temperature, top_p, etc.) are configurable.
-
-    :param user_messages: List[Dict], e.g. [{"role": "user", "content": "..."}]
-    :param assistant_messages: List[Dict], e.g. [{"role": "assistant", "content": "..."}]
-    :param system_role_description: (str) The system message content, typically combining
-                                    assistant role, system role, and instructions for the model.
-    :param model: (str) Model name, e.g. "gpt-4o-mini"
-    :param max_tokens: (int) Maximum tokens in the response
-    :param temperature: (float) "Creativity" factor (0.0 - 1.0+)
-    :param top_p: (float) Probability threshold for sampling
-    :param frequency_penalty: (float) Repetition penalty
-    :param presence_penalty: (float) Presence penalty
-    :return: Dictionary containing the TalkBot response or an error key.
+    Build the (url, payload, headers) triple for a TalkBot chat completion.
+    Shared by talk_to_bot and atalk_to_bot; see talk_to_bot for the parameters.
+    url defaults to TALKBOT_API_URL.
     """
     messages = []
 
@@ -64,7 +188,7 @@ def talk_to_bot(
         "messages": messages,
         "max-token": max_tokens,
         "temperature": temperature,
-        "stream": False,  # Typically false unless streaming is supported
+        "stream": stream,  # Server-sent events; see stream_talk_to_bot
         "top_p": top_p,
         "frequency_penalty": frequency_penalty,
         "presence_penalty": presence_penalty
@@ -75,13 +199,259 @@ def talk_to_bot(
         'Authorization': f'Bearer {settings.TALKBOT_API_KEY}'
     }
 
-    url = 'https://api.talkbot.ir/v1/chat/completions'
+    url = url or getattr(settings, 'TALKBOT_API_URL', 'https://api.talkbot.ir/v1/chat/completions')
+    return url, payload, headers
+
+
+def talk_to_bot(
+    user_messages,
+    assistant_messages=None,
+    system_role_description=None,
+    model="gpt-4o-mini",
+    max_tokens=400,
+    temperature=0.3,
+    top_p=1.0,
+    frequency_penalty=0.0,
+    presence_penalty=0.0
+):
+    """
+    Interact with the TalkBot.ir service in an extended way:
+    1) We pass in a short "memory" (history) of user_messages and assistant_messages.
+    2) We optionally include a system prompt with role="system".
+    3) Model parameters (temperature, top_p, etc.) are configurable.
+
+    :param user_messages: List[Dict], e.g. [{"role": "user", "content": "..."}]
+    :param assistant_messages: List[Dict], e.g. [{"role": "assistant", "content": "..."}]
+    :param system_role_description: (str) The system message content, typically combining
+                                    assistant role, system role, and instructions for the model.
+    :param model: (str) Model name, e.g. "gpt-4o-mini"
+    :param max_tokens: (int) Maximum tokens in the response
+    :param temperature: (float) "Creativity" factor (0.0 - 1.0+)
+    :param top_p: (float) Probability threshold for sampling
+    :param frequency_penalty: (float) Repetition penalty
+    :param presence_penalty: (float) Presence penalty
+    :return: Dictionary containing the TalkBot response or an error key.
+
+    Each call takes a slot of its endpoint's adaptive concurrency limit
+    (waiting at most TALKBOT_QUEUE_TIMEOUT seconds) and goes through the
+    model's circuit breaker. An endpoint that is saturated, open, or answers
+    429/5xx or not at all is skipped for the next TALKBOT_FALLBACKS entry.
+    With TALKBOT_HEDGE_ENABLED, a call still unanswered after the hedge
+    delay is raced against a second one (to TALKBOT_HEDGE_MODEL, if set);
+    see hedging.py.
+    """
+    request_args = dict(
+        user_messages=user_messages,
+        assistant_messages=assistant_messages,
+        system_role_description=system_role_description,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        frequency_penalty=frequency_penalty,
+        presence_penalty=presence_penalty
+    )
+    if hedging_enabled():
+        hedge_entry = getattr(settings, 'TALKBOT_HEDGE_MODEL', '') or model
+        return hedged_call(
+            lambda: _call_upstreams(talkbot_upstreams(model), request_args),
+            lambda: _call_upstreams(talkbot_upstreams(model, first=hedge_entry), request_args),
+            hedge_stats,
+        )
+    return _call_upstreams(talkbot_upstreams(model), request_args)
+
+
+def _call_upstreams(upstreams, request_args):
+    """
+    Try the upstreams in order through their limiters and breakers; see talk_to_bot.
+    """
+    error = OVERLOADED_ERROR
+    saturated = set()
+    for upstream_url, upstream_model in upstreams:
+        breaker, limiter = get_breaker(upstream_url, upstream_model), get_limiter(upstream_url)
+        if upstream_url in saturated or not breaker.available():
+            continue
+        if not limiter.acquire(_queue_timeout()):
+            saturated.add(upstream_url)
+            continue
+        if not breaker.allow():
+            limiter.release()
+            continue
+        url, payload, headers = build_talkbot_request(model=upstream_model, url=upstream_url, **request_args)
+        started = time.monotonic()
+        try:
+            response = http_request(
+                "POST", url, data=json.dumps(payload), headers=headers,
+                read_timeout=getattr(settings, 'TALKBOT_READ_TIMEOUT', 60.0)
+            )
+        except requests.exceptions.RequestException as e:
+            _settle(breaker, limiter, started, overloaded=True)
+            error = f"Request error: {e}"
+            continue
+
+        if response.ok:
+            _settle(breaker, limiter, started, overloaded=False)
+            return response.json()
+        overloaded = _is_overloaded(response.status_code)
+        _settle(breaker, limiter, started, overloaded)
+        error = f"{response.status_code} - {response.text}"
+        if not overloaded:
+            # The request itself was refused; another model would refuse it too
+            break
+    return {"error": error}
+
+
+async def atalk_to_bot(user_messages, assistant_messages=None, system_role_description=None, **options):
+    """
+    Async counterpart of talk_to_bot using the shared async HTTP client,
+    so an ASGI worker can keep many TalkBot round-trips in flight at once.
+    Takes the same arguments, returns the same dictionary shape and goes
+    through the same limiters, breakers, fallbacks and hedging.
+    """
+    model = options.pop("model", "gpt-4o-mini")
+    request_args = dict(
+        user_messages=user_messages,
+        assistant_messages=assistant_messages,
+        system_role_description=system_role_description,
+        **options
+    )
+    if hedging_enabled():
+        hedge_entry = getattr(settings, 'TALKBOT_HEDGE_MODEL', '') or model
+        return await ahedged_call(
+            lambda: _acall_upstreams(talkbot_upstreams(model), request_args),
+            lambda: _acall_upstreams(talkbot_upstreams(model, first=hedge_entry), request_args),
+            hedge_stats,
+        )
+    return await _acall_upstreams(talkbot_upstreams(model), request_args)
+
+
+async def _acall_upstreams(upstreams, request_args):
+    error = OVERLOADED_ERROR
+    saturated = set()
+    for upstream_url, upstream_model in upstreams:
+        breaker, limiter = get_breaker(upstream_url, upstream_model), get_async_limiter(upstream_url)
+        if upstream_url in saturated or not breaker.available():
+            continue
+        if not await limiter.aacquire(_async_queue_timeout()):
+            saturated.add(upstream_url)
+            continue
+        if not breaker.allow():
+            limiter.release()
+            continue
+        url, payload, headers = build_talkbot_request(model=upstream_model, url=upstream_url, **request_args)
+        started = time.monotonic()
+        try:
+            response = await ahttp_request(
+                "POST", url, content=json.dumps(payload), headers=headers,
+                read_timeout=getattr(settings, 'TALKBOT_READ_TIMEOUT', 60.0)
+            )
+        except httpx.HTTPError as e:
+            _settle(breaker, limiter, started, overloaded=True)
+            error = f"Request error: {e}"
+            continue
+        except asyncio.CancelledError:
+            # The other request of a hedged pair won: free the slot, judge nothing
+            limiter.release()
+            breaker.abandon()
+            raise
+
+        if response.is_success:
+            _settle(breaker, limiter, started, overloaded=False)
+            return response.json()
+        overloaded = _is_overloaded(response.status_code)
+        _settle(breaker, limiter, started, overloaded)
+        error = f"{response.status_code} - {response.text}"
+        if not overloaded:
+            break
+    return {"error": error}
+
+
+class StreamingUnavailable(Exception):
+    """
+    Raised by stream_talk_to_bot when TalkBot could not stream a completion.
+    """
+
+
+def stream_talk_to_bot(user_messages, assistant_messages=None, system_role_description=None, **options):
+    """
+    Ask TalkBot for a streamed completion and yield the text deltas as they arrive.
+
+    TalkBot speaks the OpenAI-style SSE protocol: one `data: {json}` line per
+    chunk with the new text in choices[0].delta.content, ending with
+    `data: [DONE]`. If the server answers with a regular JSON completion
+    instead, its full content is yielded as a single chunk.
+    Takes the same arguments as talk_to_bot and raises StreamingUnavailable
+    on transport or HTTP errors.
+    """
+    url, payload, headers = build_talkbot_request(
+        user_messages,
+        assistant_messages=assistant_messages,
+        system_role_description=system_role_description,
+        stream=True,
+        **options
+    )
+    headers['Accept'] = 'text/event-stream'
+    # Streaming only uses the primary model; when it is saturated or open the
+    # caller falls back to talk_to_bot, which tries TALKBOT_FALLBACKS
+    breaker, limiter = get_breaker(url, payload["model"]), get_limiter(url)
+    if not limiter.acquire(0):
+        raise StreamingUnavailable("TalkBot is saturated")
+    if not breaker.allow():
+        limiter.release()
+        raise StreamingUnavailable("TalkBot circuit is open")
+
+    started = time.monotonic()
+    first_byte, overloaded = None, True
     try:
-        response = requests.post(url, data=json.dumps(payload), headers=headers)
-    except requests.exceptions.RequestException as e:
-        return {"error": f"Request error: {e}"}
+        try:
+            response = http_request(
+                "POST", url, data=json.dumps(payload), headers=headers, stream=True,
+                read_timeout=getattr(settings, 'TALKBOT_READ_TIMEOUT', 60.0)
+            )
+        except requests.exceptions.RequestException as e:
+            raise StreamingUnavailable(f"Request error: {e}")
+        first_byte = time.monotonic() - started
+        overloaded = not response.ok and _is_overloaded(response.status_code)
 
-    if response.ok:
-        return response.json()
-    else:
-        return {"error": f"{response.status_code} - {response.text}"}
+        with closing(response):
+            if not response.ok:
+                raise StreamingUnavailable(f"{response.status_code} - {response.text}")
+
+            if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+                try:
+                    content = (
+                        response.json().get("choices", [{}])[0]
+                        .get("message", {})
+                        .get("content", "")
+                    )
+                except (ValueError, AttributeError, IndexError) as e:
+                    raise StreamingUnavailable(f"Invalid response body: {e}")
+                if content:
+                    yield content
+                return
+
+            try:
+                # Raw bytes split on b"\n" only: an event stream without a charset would
+                # be decoded as ISO-8859-1, and str.splitlines also breaks on "\x85"
+                for line in response.iter_lines():
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[len(b"data:"):].strip()
+                    if data == b"[DONE]":
+                        return
+                    try:
+                        chunk = json.loads(data.decode("utf-8"))
+                    except ValueError:
+                        logger.warning("Skipping unreadable TalkBot stream chunk: %r", data[:200])
+                        continue
+                    delta = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+            except requests.exceptions.RequestException as e:
+                raise StreamingUnavailable(f"Stream interrupted: {e}")
+    finally:
+        # The slot is held for the whole stream; the limit adapts to time to first byte
+        limiter.release(first_byte if first_byte is not None else time.monotonic() - started, overloaded)
+        if overloaded:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
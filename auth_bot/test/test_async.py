@@ -0,0 +1,119 @@
+import asyncio
+import json
+from unittest.mock import patch, AsyncMock
+import httpx
+from django.test import TestCase
+from django.urls import reverse
+from auth_bot.models import BaleUser, ChatSession
+from auth_bot.response_cache import response_cache
+from auth_bot.talkbot import atalk_to_bot
+from auth_bot.utils import asend_message_to_bale
+
+
+def mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class AsyncClientTests(TestCase):
+
+    async def test_atalk_to_bot_success(self):
+        def handler(request):
+            payload = json.loads(request.content)
+            self.assertEqual(payload["messages"][0]["role"], "system")
+            return httpx.Response(200, json={
+                "choices": [{"message": {"role": "assistant", "content": "Test response"}}]
+            })
+
+        with patch("auth_bot.http_client.get_async_client", return_value=mock_client(handler)):
+            response = await atalk_to_bot(
+                user_messages=[{"role": "user", "content": "Hello"}],
+                system_role_description="System prompt here",
+            )
+        self.assertEqual(response["choices"][0]["message"]["content"], "Test response")
+
+    async def test_atalk_to_bot_error(self):
+        with patch("auth_bot.http_client.get_async_client",
+                   return_value=mock_client(lambda request: httpx.Response(400, text="Bad request"))):
+            response = await atalk_to_bot(user_messages=[{"role": "user", "content": "Hello"}])
+        self.assertIn("400", response["error"])
+
+    async def test_atalk_to_bot_request_exception(self):
+        def handler(request):
+            raise httpx.ConnectError("Connection error")
+
+        with patch("auth_bot.http_client.get_async_client", return_value=mock_client(handler)):
+            response = await atalk_to_bot(user_messages=[{"role": "user", "content": "Hello"}])
+        self.assertIn("Connection error", response["error"])
+
+    async def test_asend_message_to_bale(self):
+        sent = []
+
+        def handler(request):
+            sent.append(json.loads(request.content))
+            return httpx.Response(200, json={"ok": True})
+
+        with patch("auth_bot.http_client.get_async_client", return_value=mock_client(handler)):
+            await asend_message_to_bale("12345", "Hello from test")
+        self.assertEqual(sent, [{"chat_id": "12345", "text": "Hello from test"}])
+
+
+class AsyncWebhookTests(TestCase):
+
+    def setUp(self):
+        response_cache.clear()
+        self.url = reverse("bale_webhook_async")
+
+    @patch("auth_bot.views.asend_message_to_bale", new_callable=AsyncMock)
+    @patch("auth_bot.views.atalk_to_bot", new_callable=AsyncMock)
+    async def test_chat_message_flow(self, mock_talk, mock_send):
+        mock_talk.return_value = {"choices": [{"message": {"content": "Rest and drink water."}}]}
+        user = await BaleUser.objects.acreate(
+            chat_id="999",
+            phone_number="0912xxx",
+            is_authenticated=True,
+            assistant_role="psychologist"
+        )
+        data = {"message": {"chat": {"id": "999"}, "text": "Hello doctor."}}
+        response = await self.async_client.post(self.url, data, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        session = await ChatSession.objects.filter(user=user, is_active=True).afirst()
+        self.assertEqual(session.bot_response, "Rest and drink water.")
+        self.assertIn("Rest and drink water.", mock_send.call_args[0][1])
+
+    @patch("auth_bot.views.asend_message_to_bale", new_callable=AsyncMock)
+    @patch("auth_bot.views.atalk_to_bot", new_callable=AsyncMock)
+    async def test_response_cache_stays_off_the_event_loop(self, mock_talk, mock_send):
+        mock_talk.return_value = {"choices": [{"message": {"content": "Rest and drink water."}}]}
+        await BaleUser.objects.acreate(
+            chat_id="998", phone_number="0912xxx", is_authenticated=True, assistant_role="psychologist"
+        )
+        on_loop = []
+
+        def record(*args):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+
+        with patch("auth_bot.views.cached_reply", side_effect=record), \
+                patch("auth_bot.views.cache_reply", side_effect=record):
+            data = {"message": {"chat": {"id": "998"}, "text": "Hello doctor."}}
+            response = await self.async_client.post(self.url, data, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(on_loop, [False, False])
+
+    @patch("auth_bot.views.asend_message_to_bale", new_callable=AsyncMock)
+    async def test_chat_without_user_is_rejected(self, mock_send):
+        data = {"message": {"chat": {"id": "404"}, "text": "Hello doctor."}}
+        response = await self.async_client.post(self.url, data, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        mock_send.assert_awaited_once()
+
+    async def test_no_message_key(self):
+        response = await self.async_client.post(self.url, {}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    async def test_get_not_allowed(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 405)
@@ -1,6 +1,7 @@
 import random
 from unittest.mock import patch, MagicMock
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from auth_bot.auth import (
     handle_login_command,
     handle_phone_number,
@@ -8,13 +9,17 @@ from auth_bot.auth import (
     handle_logout_command,
 )
 from auth_bot.models import BaleUser
+from auth_bot.otp_store import otp_store
+from auth_bot.sms import kavenegar_breaker
 
 class AuthTests(TestCase):
 
     def setUp(self):
+        cache.clear()
+        kavenegar_breaker.reset()
         self.chat_id = "12345"
 
-    @patch("auth_bale.auth.send_message_to_bale")
+    @patch("auth_bot.auth.send_message_to_bale")
     def test_handle_login_command(self, mock_send):
         """
         Test that handle_login_command creates BaleUser if not exists
@@ -29,8 +34,9 @@ class AuthTests(TestCase):
         self.assertIsNotNone(user)
         mock_send.assert_called_with(self.chat_id, "لطفاً شماره موبایل خود را وارد کنید.")
 
-    @patch("auth_bale.auth.send_message_to_bale")
-    @patch("auth_bale.auth.KavenegarAPI")
+    @override_settings(OTP_SMS_MODE="sync")
+    @patch("auth_bot.auth.send_message_to_bale")
+    @patch("auth_bot.auth.get_kavenegar_api")
     def test_handle_phone_number(self, mock_kaveh, mock_send):
         """
         Test handle_phone_number sets phone_number, generates OTP, and sends it.
@@ -40,14 +46,15 @@ class AuthTests(TestCase):
 
         user.refresh_from_db()
         self.assertEqual(user.phone_number, "09123456789")
-        self.assertTrue(len(user.otp) == 6)  # It's random, but 6 digits
-        mock_kaveh.assert_called_once()  # KavenegarAPI was used
+        mock_kaveh.return_value.verify_lookup.assert_called_once()  # Kavenegar was used
+        otp = mock_kaveh.return_value.verify_lookup.call_args[0][0]['token']
+        self.assertTrue(len(otp) == 6)  # It's random, but 6 digits
         mock_send.assert_called_with(
             self.chat_id,
             "کد تأیید برای شماره موبایل شما ارسال شد. لطفاً کد را وارد کنید."
         )
 
-    @patch("myapp.auth.send_message_to_bale")
+    @patch("auth_bot.auth.send_message_to_bale")
     def test_handle_otp_success(self, mock_send):
         """
         Test a successful OTP match.
@@ -55,19 +62,20 @@ class AuthTests(TestCase):
         user = BaleUser.objects.create(
             chat_id=self.chat_id,
             phone_number="09123456789",
-            otp="123456",
             is_authenticated=False
         )
+        otp_store.issue(self.chat_id, "123456")
         handle_otp(self.chat_id, "123456")
         user.refresh_from_db()
         self.assertTrue(user.is_authenticated)
-        self.assertEqual(user.otp, "")
+        # The code is single-use
+        self.assertEqual(otp_store.verify(self.chat_id, "123456"), "missing")
         mock_send.assert_called_with(
             self.chat_id,
             "احراز هویت موفق بود! اکنون می‌توانید از خدمات استفاده کنید. 🌟"
         )
 
-    @patch("auth_bale.auth.send_message_to_bale")
+    @patch("auth_bot.auth.send_message_to_bale")
     def test_handle_otp_failure(self, mock_send):
         """
         Test an invalid OTP.
@@ -75,16 +83,16 @@ class AuthTests(TestCase):
         BaleUser.objects.create(
             chat_id=self.chat_id,
             phone_number="09123456789",
-            otp="999999",
             is_authenticated=False
         )
+        otp_store.issue(self.chat_id, "999999")
         handle_otp(self.chat_id, "123456")  # Wrong OTP
         mock_send.assert_called_with(
             self.chat_id,
             "کد واردشده نامعتبر است. لطفاً دوباره تلاش کنید."
         )
 
-    @patch("auth_bale.auth.send_message_to_bale")
+    @patch("auth_bot.auth.send_message_to_bale")
     def test_handle_logout_command(self, mock_send):
         """
         Test handle_logout_command sets is_authenticated=False.
@@ -92,7 +100,6 @@ class AuthTests(TestCase):
         user = BaleUser.objects.create(
             chat_id=self.chat_id,
             phone_number="09123456789",
-            otp="",
             is_authenticated=True
         )
         handle_logout_command(self.chat_id)
@@ -103,7 +110,7 @@ class AuthTests(TestCase):
             "شما با موفقیت از سیستم خارج شدید. 🌟"
         )
 
-    @patch("auth_bale.auth.send_message_to_bale")
+    @patch("auth_bot.auth.send_message_to_bale")
     def test_handle_logout_command_no_user(self, mock_send):
         """
         Test handle_logout_command if user not found.
@@ -0,0 +1,90 @@
+import os
+import tempfile
+from django.test import SimpleTestCase, override_settings
+from auth_bot.auth import send_otp_sms
+from auth_bot.benchmark import (
+    compare_results, conversation_script, load_results, previous_result, store_result,
+)
+from auth_bot.router import route
+from auth_bot.models import BaleUser
+from auth_bot.stubs import StubServer
+from auth_bot.talkbot import reset_talkbot_resilience, stream_talk_to_bot, talk_to_bot
+
+
+class ConversationScriptTests(SimpleTestCase):
+
+    def test_login_script_follows_the_dialog(self):
+        steps = conversation_script("c1", "09912345678", turns=2)
+        self.assertEqual(
+            [kind for kind, _ in steps],
+            ["start", "login", "phone", "otp", "startchat", "role", "confirm", "chat", "chat", "end_chat"],
+        )
+        self.assertIsNone(dict(steps)["otp"])
+        # The texts route to the step's command in the state that step expects
+        self.assertEqual(route(BaleUser.DIALOG_AWAITING_PHONE, steps[2][1]), "phone")
+        self.assertEqual(route(BaleUser.DIALOG_CHATTING, steps[7][1]), "chat")
+
+    def test_known_users_skip_login(self):
+        kinds = [kind for kind, _ in conversation_script("c1", None, turns=1, login=False)]
+        self.assertNotIn("login", kinds)
+
+
+class ResultStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_previous_run_of_the_same_scenario(self):
+        self.assertEqual(load_results(self.path), [])
+        store_result(self.path, {"commit": "a", "scenario": {"users": 10}, "overall": {"per_sec": 100}})
+        store_result(self.path, {"commit": "b", "scenario": {"users": 20}, "overall": {"per_sec": 50}})
+        results = load_results(self.path)
+        self.assertEqual(previous_result(results, {"users": 10})["commit"], "a")
+        self.assertIsNone(previous_result(results, {"users": 30}))
+
+    def test_compare_results(self):
+        changes = compare_results({"per_sec": 100, "p95_ms": 200, "queries": 0}, {"per_sec": 80, "p95_ms": 250})
+        self.assertEqual(changes, {"per_sec": -20.0, "p95_ms": 25.0})
+
+
+class StubServerTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_talkbot_resilience()
+
+    def test_streams_sse_chunks(self):
+        with StubServer(talkbot_latency=0, talkbot_chunks=3, talkbot_chunk_interval=0,
+                        reply_text="abcdefghi") as stub, override_settings(**stub.settings_overrides()):
+            deltas = list(stream_talk_to_bot(["hi"]))
+        self.assertEqual(deltas, ["abc", "def", "ghi"])
+
+    def test_streams_persian_chunks(self):
+        # Raw UTF-8 and no charset, like TalkBot itself
+        with StubServer(talkbot_latency=0, talkbot_chunks=2, talkbot_chunk_interval=0,
+                        reply_text="سلام مراقب") as stub, override_settings(**stub.settings_overrides()):
+            deltas = list(stream_talk_to_bot(["hi"]))
+        self.assertEqual("".join(deltas), "سلام مراقب")
+
+    def test_error_rate(self):
+        with StubServer(talkbot_latency=0, talkbot_error_rate=1.0) as stub, \
+                override_settings(**stub.settings_overrides(), TALKBOT_BREAKER_FAILURES=100):
+            self.assertIn("error", talk_to_bot(["hi"]))
+
+    def test_latency_jitter_is_seeded(self):
+        first = StubServer(jitter=0.5, seed=3)
+        second = StubServer(jitter=0.5, seed=3)
+        samples = [first.sample_latency(0.2) for _ in range(5)]
+        self.assertEqual(samples, [second.sample_latency(0.2) for _ in range(5)])
+        self.assertEqual(len(set(samples)), 5)
+        self.assertEqual(StubServer().sample_latency(0.2), 0.2)
+
+    def test_records_otp_codes(self):
+        with StubServer(kavenegar_latency=0) as stub, override_settings(**stub.settings_overrides()):
+            send_otp_sms("09912345678", "123456")
+            self.assertEqual(stub.last_code("09912345678"), "123456")
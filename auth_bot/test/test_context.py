@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+from django.test import TestCase
+from auth_bot.context import build_context, estimate_tokens, truncate_to_tokens, context_stats
+
+
+def turn(question, answer):
+    return SimpleNamespace(user_message=question, bot_response=answer)
+
+
+class EstimateTokensTests(TestCase):
+
+    def test_empty_text(self):
+        self.assertEqual(estimate_tokens(""), 0)
+
+    def test_persian_and_latin_text(self):
+        self.assertEqual(estimate_tokens("سردرد دارم"), 4)
+        self.assertEqual(estimate_tokens("Hello world"), 4)
+        self.assertEqual(estimate_tokens("۱۲۳۴۵۶"), 2)
+
+    def test_longer_text_costs_more(self):
+        short = "سردرد دارم چه کنم؟"
+        self.assertGreater(estimate_tokens(short * 10), estimate_tokens(short))
+
+    def test_truncate_is_deterministic(self):
+        text = "درد قفسه سینه " * 40
+        first = truncate_to_tokens(text, 20)
+        self.assertEqual(first, truncate_to_tokens(text, 20))
+        self.assertLessEqual(estimate_tokens(first), 20)
+        self.assertTrue(first.endswith("…"))
+
+
+class BuildContextTests(TestCase):
+
+    def setUp(self):
+        self.turns = [turn(f"سوال شماره {i}", "پاسخ طولانی " * 30) for i in range(5)]
+
+    def test_everything_fits(self):
+        context = build_context("system", self.turns, "سوال جدید", token_budget=10000)
+        self.assertEqual(context.turns_used, 5)
+        self.assertEqual(context.tokens_saved, 0)
+        self.assertEqual(context.user_messages[-1]["content"], "سوال جدید")
+        self.assertEqual(len(context.assistant_messages), 5)
+
+    def test_newest_turns_kept_within_budget(self):
+        context = build_context("system", self.turns, "سوال جدید", token_budget=300)
+        self.assertLess(context.turns_used, 5)
+        self.assertLessEqual(context.prompt_tokens, 300)
+        self.assertGreater(context.tokens_saved, 0)
+        # The newest turn is always the one kept
+        self.assertEqual(context.user_messages[-2]["content"], "سوال شماره 4")
+
+    def test_partial_turn_is_truncated(self):
+        context = build_context("system", self.turns, "سوال جدید", token_budget=260)
+        self.assertEqual(context.turns_truncated, 1)
+        self.assertTrue(context.assistant_messages[0]["content"].endswith("…"))
+
+    def test_stats_are_recorded(self):
+        before = context_stats.as_dict()["requests"]
+        build_context("system", [], "سلام", token_budget=100)
+        self.assertEqual(context_stats.as_dict()["requests"], before + 1)
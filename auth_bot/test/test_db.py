@@ -0,0 +1,66 @@
+import os
+import tempfile
+from unittest.mock import patch
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from auth_bot.db import REPLICA_ALIAS, ReplicaRouter, use_replica
+from auth_bot.models import BaleUser, ChatTurn
+
+
+def _pragma(conn, name):
+    with conn.cursor() as cursor:
+        cursor.execute(f"PRAGMA {name}")
+        return cursor.fetchone()[0]
+
+
+class SqliteConfigurationTests(TestCase):
+
+    def _open(self, path):
+        conn = DatabaseWrapper(dict(connection.settings_dict, NAME=path))
+        conn.ensure_connection()
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_new_connections_use_wal_and_busy_timeout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = self._open(os.path.join(tmp, "wal.sqlite3"))
+            self.assertEqual(_pragma(conn, "journal_mode"), "wal")
+            self.assertEqual(_pragma(conn, "busy_timeout"), 20000)
+            self.assertEqual(_pragma(conn, "synchronous"), 1)  # NORMAL
+            conn.close()
+
+    @override_settings(SQLITE_JOURNAL_MODE="")
+    def test_empty_journal_mode_keeps_sqlite_defaults(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = self._open(os.path.join(tmp, "default.sqlite3"))
+            self.assertEqual(_pragma(conn, "journal_mode"), "delete")
+            conn.close()
+
+
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_without_replica_reads_use_default(self):
+        self.assertNotIn(REPLICA_ALIAS, connections.databases)
+        self.assertIsNone(self.router.db_for_read(ChatTurn))
+        with use_replica():
+            self.assertIsNone(self.router.db_for_read(BaleUser))
+
+    def test_replica_reads_and_default_writes(self):
+        with patch.dict(connections.databases, {REPLICA_ALIAS: connections.databases["default"]}):
+            # Chat history is read right after it is written; it stays on the primary
+            self.assertIsNone(self.router.db_for_read(ChatTurn))
+            self.assertIsNone(self.router.db_for_read(BaleUser))
+            with use_replica():
+                self.assertEqual(self.router.db_for_read(ChatTurn), REPLICA_ALIAS)
+                self.assertEqual(self.router.db_for_read(BaleUser), REPLICA_ALIAS)
+            self.assertIsNone(self.router.db_for_read(BaleUser))
+            self.assertEqual(self.router.db_for_write(ChatTurn), "default")
+
+    def test_replica_is_never_migrated(self):
+        self.assertTrue(self.router.allow_migrate("default", "auth_bot"))
+        self.assertFalse(self.router.allow_migrate(REPLICA_ALIAS, "auth_bot"))
+
@@ -0,0 +1,94 @@
+import threading
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from auth_bot.dedup import UpdateDeduplicator, update_dedup
+from auth_bot.models import BaleUser
+from auth_bot.response_cache import response_cache
+
+
+class UpdateDeduplicatorTests(TestCase):
+
+    def test_replay_is_suppressed(self):
+        dedup = UpdateDeduplicator()
+        self.assertTrue(dedup.begin(1))
+        dedup.finish(1)
+        self.assertFalse(dedup.begin(1))
+        self.assertEqual(dedup.stats()["suppressed"], 1)
+
+    def test_released_update_can_be_processed_again(self):
+        dedup = UpdateDeduplicator()
+        self.assertTrue(dedup.begin(2))
+        dedup.release(2)
+        self.assertTrue(dedup.begin(2))
+
+    def test_expired_and_evicted_ids_are_forgotten(self):
+        dedup = UpdateDeduplicator(maxsize=2, ttl=-1)
+        dedup.begin(3)
+        dedup.finish(3)
+        self.assertTrue(dedup.begin(3))
+        dedup = UpdateDeduplicator(maxsize=2)
+        for update_id in (4, 5, 6):
+            dedup.begin(update_id)
+        self.assertEqual(dedup.stats()["tracked"], 2)
+        self.assertTrue(dedup.begin(4))
+
+    def test_concurrent_duplicate_waits_for_the_first(self):
+        dedup = UpdateDeduplicator()
+        self.assertTrue(dedup.begin(7))
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(dedup.begin(7)))
+        waiter.start()
+        while dedup.stats()["coalesced"] == 0:
+            pass
+        # The first copy fails: the waiting duplicate takes over
+        dedup.release(7)
+        waiter.join(5)
+        self.assertEqual(results, [True])
+
+    def test_shared_backend_claims_across_processes(self):
+        cache.clear()
+        first = UpdateDeduplicator(alias="default")
+        second = UpdateDeduplicator(alias="default")
+        self.assertTrue(first.begin(8))
+        self.assertFalse(second.begin(8))
+        first.release(8)
+        self.assertTrue(second.begin(8))
+
+
+class WebhookDedupTests(TestCase):
+
+    def setUp(self):
+        update_dedup.clear()
+        response_cache.clear()
+        self.client = APIClient()
+        BaleUser.objects.create(
+            chat_id="321",
+            phone_number="09120000321",
+            is_authenticated=True,
+            assistant_role="general_physician",
+        )
+
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_redelivered_update_runs_once(self, mock_talk, mock_send):
+        mock_talk.return_value = {"choices": [{"message": {"content": "Answer"}}]}
+        data = {"update_id": 9001, "message": {"chat": {"id": "321"}, "text": "سردرد دارم"}}
+        for _ in range(3):
+            response = self.client.post(reverse("bale_webhook"), data, format="json")
+            self.assertEqual(response.status_code, 200)
+        mock_talk.assert_called_once()
+        mock_send.assert_called_once()
+        self.assertEqual(BaleUser.objects.get(chat_id="321").current_message_count, 1)
+
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_failed_update_is_retried(self, mock_talk, mock_send):
+        mock_talk.side_effect = [RuntimeError("boom"), {"choices": [{"message": {"content": "Answer"}}]}]
+        data = {"update_id": 9002, "message": {"chat": {"id": "321"}, "text": "سردرد دارم"}}
+        with self.assertRaises(RuntimeError):
+            self.client.post(reverse("bale_webhook"), data, format="json")
+        self.client.post(reverse("bale_webhook"), data, format="json")
+        self.assertEqual(mock_talk.call_count, 2)
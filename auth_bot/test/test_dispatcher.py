@@ -0,0 +1,206 @@
+import threading
+import time
+from unittest.mock import patch, MagicMock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from auth_bot import dispatcher as dispatcher_module
+from auth_bot.dedup import update_dedup
+from auth_bot.dispatcher import ChatLaneDispatcher, ChatLease, UpdateDispatcher
+
+class DispatcherTests(TestCase):
+
+    def test_submit_runs_handler_in_worker(self):
+        seen = []
+        dispatcher = UpdateDispatcher(handler=seen.append, workers=2, queue_size=10)
+        self.assertTrue(dispatcher.submit({"update_id": 1}))
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(seen, [{"update_id": 1}])
+        self.assertEqual(dispatcher.stats()["processed"], 1)
+
+    def test_handler_errors_are_counted(self):
+        def boom(update):
+            raise RuntimeError("handler failed")
+
+        dispatcher = UpdateDispatcher(handler=boom, workers=1, queue_size=10)
+        with self.assertLogs("auth_bot.dispatcher", level="ERROR"):
+            dispatcher.submit({"update_id": 2})
+            dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(dispatcher.stats()["failed"], 1)
+
+    def test_full_queue_rejects(self):
+        release = threading.Event()
+        dispatcher = UpdateDispatcher(
+            handler=lambda update: release.wait(5),
+            workers=1,
+            queue_size=1,
+            put_timeout=0.01,
+        )
+        results = [dispatcher.submit({"update_id": i}) for i in range(4)]
+        release.set()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertIn(False, results)
+        self.assertGreaterEqual(dispatcher.stats()["rejected"], 1)
+
+@override_settings(BALE_WEBHOOK_MODE="queue")
+class QueuedWebhookTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("bale_webhook")
+        self.data = {"message": {"chat": {"id": "111"}, "text": "/start"}}
+
+    @patch("auth_bot.views.process_update")
+    @patch("auth_bot.views.get_dispatcher")
+    def test_webhook_enqueues_and_acknowledges(self, mock_get, mock_process):
+        mock_get.return_value.submit.return_value = True
+        response = self.client.post(self.url, self.data, format="json")
+        self.assertEqual(response.status_code, 200)
+        mock_get.return_value.submit.assert_called_once_with(self.data)
+        mock_process.assert_not_called()
+
+    @patch("auth_bot.views.get_dispatcher")
+    def test_webhook_returns_503_when_queue_full(self, mock_get):
+        mock_get.return_value.submit.return_value = False
+        response = self.client.post(self.url, self.data, format="json")
+        self.assertEqual(response.status_code, 503)
+
+
+class ChatLaneDispatcherTests(TestCase):
+
+    def update(self, chat_id, n):
+        return {"update_id": n, "message": {"chat": {"id": chat_id}, "text": str(n)}}
+
+    def test_each_chat_keeps_its_order(self):
+        seen = {}
+        lock = threading.Lock()
+
+        def handler(update):
+            chat_id = update["message"]["chat"]["id"]
+            time.sleep(0.001)
+            with lock:
+                seen.setdefault(chat_id, []).append(update["update_id"])
+
+        dispatcher = ChatLaneDispatcher(handler=handler, lanes=4, queue_size=400)
+        for n in range(100):
+            self.assertTrue(dispatcher.submit(self.update(n % 5, n)))
+        dispatcher.join()
+        dispatcher.stop()
+        for chat_id, ids in seen.items():
+            self.assertEqual(ids, sorted(ids))
+        self.assertEqual(dispatcher.stats()["processed"], 100)
+
+    def test_chats_run_in_parallel(self):
+        other_chat_ran = threading.Event()
+        release = threading.Event()
+
+        def handler(update):
+            if update["message"]["chat"]["id"] == "slow":
+                release.wait(5)
+            else:
+                other_chat_ran.set()
+
+        dispatcher = ChatLaneDispatcher(handler=handler, lanes=8, queue_size=80)
+        fast = next(str(n) for n in range(100)
+                    if dispatcher.lane_for(str(n)) != dispatcher.lane_for("slow"))
+        dispatcher.submit(self.update("slow", 1))
+        dispatcher.submit(self.update(fast, 2))
+        self.assertTrue(other_chat_ran.wait(5))
+        stats = dispatcher.stats()
+        self.assertEqual(len(stats["lanes"]), 8)
+        release.set()
+        dispatcher.join()
+        dispatcher.stop()
+
+    def test_full_lane_rejects(self):
+        release = threading.Event()
+        dispatcher = ChatLaneDispatcher(handler=lambda update: release.wait(5), lanes=2,
+                                        queue_size=2, put_timeout=0.01)
+        results = [dispatcher.submit(self.update("same", n)) for n in range(4)]
+        self.assertIn(False, results)
+        self.assertGreaterEqual(dispatcher.stats()["max_lane_depth"], 1)
+        release.set()
+        dispatcher.join()
+        dispatcher.stop()
+
+
+class ChatLeaseTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lease_is_exclusive_until_released(self):
+        lease = ChatLease(wait=0.05)
+        token = lease.acquire("42")
+        self.assertIsNotNone(token)
+        self.assertIsNone(lease.acquire("42"))
+        lease.release("42", token)
+        self.assertIsNotNone(lease.acquire("42"))
+        self.assertEqual(lease.stats()["expired_waits"], 1)
+
+    def test_waiter_gets_the_lease_once_released(self):
+        lease = ChatLease(wait=5)
+        token = lease.acquire("7")
+        threading.Timer(0.05, lease.release, args=("7", token)).start()
+        self.assertIsNotNone(lease.acquire("7"))
+        self.assertEqual(lease.stats()["contended"], 1)
+
+    def test_lease_is_renewed_while_held(self):
+        lease = ChatLease(ttl=1, wait=0.01)
+        token = lease.acquire("5")
+        time.sleep(1.5)
+        # Past the ttl, but the renewer kept it
+        self.assertEqual(cache.get("chat-lease:5"), token)
+        self.assertGreaterEqual(lease.stats()["renewed"], 1)
+        lease.release("5", token)
+        self.assertEqual(lease.stats()["held"], 0)
+        self.assertIsNotNone(lease.acquire("5"))
+
+    @override_settings(CHAT_LEASE_ENABLED=True)
+    def test_async_webhook_holds_the_lease(self):
+        held = []
+
+        async def handle(update):
+            held.append(cache.get("chat-lease:77") is not None)
+            return 200
+
+        update_dedup.clear()
+        self.addCleanup(update_dedup.clear)
+        with patch.object(dispatcher_module, "_chat_lease", None), \
+                patch("auth_bot.views.aprocess_update", side_effect=handle):
+            response = self.client.post(
+                reverse("bale_webhook_async"),
+                {"update_id": 7701, "message": {"chat": {"id": 77}, "text": "hi"}},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(held, [True])
+        self.assertIsNone(cache.get("chat-lease:77"))
+
+    def test_lease_taken_over_is_not_renewed(self):
+        lease = ChatLease(ttl=60, wait=0.01)
+        lease.acquire("6")
+        cache.set("chat-lease:6", "other-node")
+        with self.assertLogs("auth_bot.dispatcher", level="WARNING"):
+            lease.renew()
+        self.assertEqual(cache.get("chat-lease:6"), "other-node")
+        self.assertEqual(lease.stats()["lost"], 1)
+        self.assertEqual(lease.stats()["held"], 0)
+
+    def test_dispatcher_holds_the_lease_while_handling(self):
+        lease = ChatLease(wait=0.01)
+        held = []
+        dispatcher = ChatLaneDispatcher(
+            handler=lambda update: held.append(cache.get("chat-lease:9") is not None),
+            lanes=1,
+            lease=lease,
+        )
+        dispatcher.submit({"update_id": 1, "message": {"chat": {"id": 9}, "text": "hi"}})
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(held, [True])
+        self.assertIsNone(cache.get("chat-lease:9"))
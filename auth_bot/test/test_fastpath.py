@@ -0,0 +1,89 @@
+import json
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.client import Client
+from django.urls import reverse
+from unittest.mock import patch
+from auth_bot import fastpath
+from auth_bot.dedup import update_dedup
+from auth_bot.models import BaleUser
+from auth_bot.response_cache import response_cache
+
+URL = "/auth/bale-webhook-fast/"
+
+
+class LoadsTests(SimpleTestCase):
+
+    def test_parses_with_and_without_orjson(self):
+        body = json.dumps({"update_id": 1, "message": {"text": "سلام"}}, ensure_ascii=False).encode()
+        self.assertEqual(fastpath.loads(body)["message"]["text"], "سلام")
+        with patch.object(fastpath, "orjson", None):
+            self.assertEqual(fastpath.loads(body)["update_id"], 1)
+            with self.assertRaises(ValueError):
+                fastpath.loads(b"{not json")
+
+
+class FastWebhookTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        update_dedup.clear()
+        self.client = Client()
+
+    def tearDown(self):
+        update_dedup.clear()
+
+    def post(self, data, url=URL, **extra):
+        body = data if isinstance(data, bytes) else json.dumps(data)
+        return self.client.post(url, body, content_type="application/json", **extra)
+
+    def test_update_is_dispatched_to_the_handlers(self):
+        response = self.post({"update_id": 1, "message": {"chat": {"id": "111"}, "text": "/login"}})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(BaleUser.objects.get(chat_id="111").is_authenticated)
+
+    def test_redelivery_is_acknowledged_without_handling(self):
+        update = {"update_id": 2, "message": {"chat": {"id": "112"}, "text": "/login"}}
+        self.assertEqual(self.post(update).status_code, 200)
+        BaleUser.objects.filter(chat_id="112").delete()
+        self.assertEqual(self.post(update).status_code, 200)
+        self.assertFalse(BaleUser.objects.filter(chat_id="112").exists())
+
+    def test_malformed_requests(self):
+        self.assertEqual(self.post(b"{not json").status_code, 400)
+        self.assertEqual(self.post([1, 2]).status_code, 400)
+        self.assertEqual(self.client.get(URL).status_code, 405)
+        self.assertEqual(self.post({}, url=URL + "a/b/").status_code, 404)
+
+    @override_settings(BALE_WEBHOOK_SECRET="s3cret")
+    def test_secret_token(self):
+        update = {"update_id": 3, "edited_message": {"text": "hi"}}
+        self.assertEqual(self.post(update).status_code, 403)
+        self.assertEqual(self.post(update, HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN="wrong").status_code, 403)
+        self.assertEqual(self.post(update, url=URL + "wrong/").status_code, 403)
+        self.assertEqual(self.post(update, HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN="s3cret").status_code, 200)
+        self.assertEqual(self.post(update, url=URL + "s3cret/").status_code, 200)
+
+    @override_settings(BALE_WEBHOOK_SECRET="s3cret")
+    def test_secret_token_guards_every_webhook(self):
+        update = {"update_id": 6, "edited_message": {"text": "hi"}}
+        for name in ("bale_webhook", "bale_webhook_async"):
+            url = reverse(name)
+            self.assertEqual(self.post(update, url=url).status_code, 403)
+            self.assertEqual(self.post(update, url=url + "wrong/").status_code, 403)
+            self.assertEqual(self.post(update, url=url, HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN="s3cret").status_code, 200)
+            self.assertEqual(self.post(update, url=url + "s3cret/").status_code, 200)
+
+    def test_bypasses_the_middleware_stack(self):
+        response = self.post({"update_id": 4, "edited_message": {"text": "hi"}})
+        self.assertEqual(response.status_code, 200)
+        # SessionMiddleware / Auth never saw the request
+        self.assertFalse(hasattr(response.wsgi_request, "session"))
+        self.assertFalse(hasattr(response.wsgi_request, "user"))
+
+    @override_settings(BALE_FAST_WEBHOOK_PATH="")
+    def test_url_route_without_the_middleware(self):
+        response = self.post({"update_id": 5, "edited_message": {"text": "hi"}}, url=reverse("bale_webhook_fast"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hasattr(response.wsgi_request, "session"))
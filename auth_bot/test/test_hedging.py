@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+from django.test import SimpleTestCase, override_settings
+from auth_bot import hedging
+from auth_bot.hedging import HedgeStats, ahedged_call, hedged_call
+from auth_bot.metrics import record_call, trace_update
+from auth_bot.talkbot import reset_talkbot_resilience, talk_to_bot
+
+
+def answer(content, delay=0.0):
+    def call():
+        time.sleep(delay)
+        return {"choices": [{"message": {"content": content}}]}
+    return call
+
+
+def funded(calls=40):
+    stats = HedgeStats()
+    for _ in range(calls):
+        stats.start()
+    return stats
+
+
+@override_settings(TALKBOT_HEDGE_DELAY=0.05, TALKBOT_HEDGE_BUDGET=0.05)
+class HedgedCallTests(SimpleTestCase):
+
+    def test_fast_primary_is_not_hedged(self):
+        stats = funded()
+        result = hedged_call(answer("primary"), answer("hedge"), stats)
+        self.assertEqual(result["choices"][0]["message"]["content"], "primary")
+        self.assertEqual(stats.as_dict()["hedged"], 0)
+
+    def test_slow_primary_is_hedged(self):
+        stats = funded()
+        result = hedged_call(answer("primary", delay=1.0), answer("hedge"), stats)
+        self.assertEqual(result["choices"][0]["message"]["content"], "hedge")
+        data = stats.as_dict()
+        self.assertEqual(data["hedged"], 1)
+        self.assertEqual(data["hedge_wins"], 1)
+
+    def test_failed_hedge_waits_for_primary(self):
+        stats = funded()
+        result = hedged_call(answer("primary", delay=0.2), lambda: {"error": "503"}, stats)
+        self.assertEqual(result["choices"][0]["message"]["content"], "primary")
+
+    def test_budget_limits_hedges(self):
+        stats = HedgeStats()  # no calls yet, so no credit
+        result = hedged_call(answer("primary", delay=0.1), answer("hedge"), stats)
+        self.assertEqual(result["choices"][0]["message"]["content"], "primary")
+        self.assertEqual(stats.as_dict()["over_budget"], 1)
+        for _ in range(100):
+            stats.start()
+        hedges = sum(stats.try_hedge() for _ in range(100))
+        self.assertEqual(hedges, 5)
+
+    def test_calls_stay_in_the_update_trace(self):
+        def call(endpoint, delay):
+            def run():
+                time.sleep(delay)
+                record_call(endpoint, delay, 200)
+                return {"choices": [{"message": {"content": endpoint}}]}
+            return run
+
+        with trace_update(1) as trace:
+            hedged_call(call("primary", 0.2), call("hedge", 0.0), funded())
+            time.sleep(0.3)  # the losing primary finishes in the background
+        self.assertEqual(sorted(endpoint for endpoint, _, _ in trace.calls), ["hedge", "primary"])
+
+    def test_no_free_hedge_thread_waits_for_primary(self):
+        pool, _ = hedging._hedge_pool()
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        stats = funded()
+        with patch("auth_bot.hedging._hedge_pool", return_value=(pool, slots)):
+            result = hedged_call(answer("primary", delay=0.1), answer("hedge"), stats)
+        self.assertEqual(result["choices"][0]["message"]["content"], "primary")
+        self.assertEqual((stats.as_dict()["hedged"], stats.as_dict()["pool_full"]), (0, 1))
+
+    def test_unhedgeable_call_runs_on_the_callers_thread(self):
+        threads = []
+        hedged_call(lambda: threads.append(threading.current_thread()) or {}, answer("hedge"), HedgeStats())
+        self.assertEqual(threads, [threading.current_thread()])
+
+    @override_settings(TALKBOT_HEDGE_MIN_SAMPLES=3, TALKBOT_HEDGE_PERCENTILE=50, TALKBOT_HEDGE_MIN_DELAY=0)
+    def test_delay_follows_observed_latency(self):
+        stats = HedgeStats()
+        self.assertEqual(stats.delay(), 0.05)
+        for latency in (1.0, 2.0, 3.0):
+            stats.record_primary(latency)
+        self.assertEqual(stats.delay(), 2.0)
+
+    def test_async_loser_is_cancelled(self):
+        stats = funded()
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def fast():
+            return {"choices": [{"message": {"content": "hedge"}}]}
+
+        result = asyncio.run(ahedged_call(slow, fast, stats))
+        self.assertEqual(result["choices"][0]["message"]["content"], "hedge")
+        self.assertEqual(cancelled, [True])
+
+
+@override_settings(TALKBOT_HEDGE_ENABLED=True, TALKBOT_HEDGE_MODEL="gpt-4o", TALKBOT_HEDGE_DELAY=0.05)
+class TalkToBotHedgingTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_talkbot_resilience()
+
+    @patch("auth_bot.talkbot.hedge_stats", new_callable=funded)
+    @patch("auth_bot.talkbot._call_upstreams")
+    def test_hedge_goes_to_the_hedge_model(self, mock_call, mock_stats):
+        def call(upstreams, request_args):
+            if upstreams[0][1] == "gpt-4o-mini":
+                time.sleep(1.0)
+            return {"model": upstreams[0][1]}
+
+        mock_call.side_effect = call
+        result = talk_to_bot([{"role": "user", "content": "hi"}], model="gpt-4o-mini")
+        self.assertEqual(result, {"model": "gpt-4o"})
@@ -0,0 +1,87 @@
+import asyncio
+from unittest.mock import patch, AsyncMock, MagicMock
+import requests
+from django.test import TestCase, override_settings
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from auth_bot import http_client
+from auth_bot.http_client import ahttp_request, http_request, get_http_stats
+
+
+def connect_refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/", reason))
+
+
+def response(status):
+    resp = MagicMock()
+    resp.status_code = status
+    return resp
+
+
+@override_settings(HTTP_MAX_RETRIES=2, HTTP_RETRY_BACKOFF=0)
+class HttpClientTests(TestCase):
+
+    def setUp(self):
+        self.session = MagicMock()
+        patcher = patch("auth_bot.http_client.get_session", return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_applies_default_timeouts(self):
+        self.session.request.return_value = response(200)
+        http_request("POST", "https://tapi.bale.ai/bot/sendMessage", json={})
+        kwargs = self.session.request.call_args[1]
+        self.assertEqual(kwargs["timeout"], (3.05, 10.0))
+
+    def test_post_retried_when_never_sent(self):
+        self.session.request.side_effect = [connect_refused(), response(200)]
+        resp = http_request("POST", "https://api.talkbot.ir/v1/chat/completions")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_post_not_retried_after_read_timeout(self):
+        self.session.request.side_effect = requests.exceptions.ReadTimeout("slow")
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            http_request("POST", "https://api.talkbot.ir/v1/chat/completions")
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_post_not_retried_on_503(self):
+        self.session.request.return_value = response(503)
+        resp = http_request("POST", "https://tapi.bale.ai/bot/sendMessage")
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_get_retried_on_503_until_budget_spent(self):
+        self.session.request.return_value = response(503)
+        http_request("GET", "https://tapi.bale.ai/bot/getUpdates")
+        self.assertEqual(self.session.request.call_count, 3)
+
+    def test_stats_are_recorded_per_host(self):
+        self.session.request.return_value = response(200)
+        http_request("GET", "https://stats.example/ping")
+        stats = get_http_stats()["stats.example"]
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["pool_size"], 20)
+
+    def test_other_errors_leave_nothing_in_flight(self):
+        self.session.request.side_effect = ValueError("bad header")
+        with self.assertRaises(ValueError):
+            http_request("POST", "https://broken.example/send")
+        stats = get_http_stats()["broken.example"]
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["errors"], 1)
+
+    def test_cancelled_async_call_leaves_nothing_in_flight(self):
+        client = MagicMock(request=AsyncMock(side_effect=asyncio.CancelledError))
+        with patch("auth_bot.http_client.get_async_client", return_value=client):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(ahttp_request("POST", "https://cancelled.example/send"))
+        self.assertEqual(get_http_stats()["cancelled.example"]["in_flight"], 0)
+
+
+class SessionPoolTests(TestCase):
+
+    def test_one_session_per_host(self):
+        self.assertIs(http_client.get_session("a.example"), http_client.get_session("a.example"))
+        self.assertIsNot(http_client.get_session("a.example"), http_client.get_session("b.example"))
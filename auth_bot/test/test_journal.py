@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from unittest.mock import patch
+from auth_bot import journal
+from auth_bot.journal import TurnJournal, get_turn_journal
+from auth_bot.models import BaleUser, ChatSession, ChatTurn
+from auth_bot.response_cache import response_cache
+
+
+class TurnJournalTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "journal.jsonl")
+        self.user = BaleUser.objects.create(chat_id="j1", phone_number="09900000001", is_authenticated=True)
+        self.session = ChatSession.objects.create(user=self.user, is_active=True, assistant_role="psychologist")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def turn(self, text):
+        return ChatTurn(user=self.user, session=self.session, user_message=text,
+                        bot_response="Answer", assistant_role="psychologist")
+
+    def test_turns_are_stored_in_one_batch_on_flush(self):
+        wal = TurnJournal(self.path, flush_interval=0)
+        for text in ("one", "two", "three"):
+            self.assertTrue(wal.append(self.turn(text)))
+        self.assertFalse(ChatTurn.objects.exists())
+        self.assertEqual([turn.user_message for turn in wal.pending_turns(self.session.pk)], ["one", "two", "three"])
+
+        with self.assertNumQueries(2):  # live-session check + bulk insert
+            self.assertEqual(wal.flush(), 3)
+        stored = list(ChatTurn.objects.order_by("created_at"))
+        self.assertEqual([turn.user_message for turn in stored], ["one", "two", "three"])
+        self.assertGreater(stored[0].token_count, 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(wal.stats()["stored"], 3)
+        wal.close()
+
+    def test_history_includes_pending_turns(self):
+        wal = TurnJournal(self.path, flush_interval=0)
+        ChatTurn.objects.create(user=self.user, session=self.session, user_message="old", bot_response="a")
+        wal.append(self.turn("new"))
+        stored = ChatTurn.objects.tail(self.user, self.session, limit=5)
+        merged = wal.with_pending(stored, self.session.pk, limit=5)
+        self.assertEqual([turn.user_message for turn in merged], ["old", "new"])
+        self.assertEqual(len(wal.with_pending(stored, self.session.pk, limit=1)), 1)
+        wal.close()
+
+    def test_unflushed_turns_survive_a_crash(self):
+        crashed = TurnJournal(self.path, flush_interval=0)
+        crashed.append(self.turn("one"))
+        crashed.append(self.turn("two"))
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"u": 1, "s"')  # torn last write
+
+        with self.assertLogs("auth_bot.journal", level="WARNING"):
+            reopened = TurnJournal(self.path, flush_interval=0)
+        self.assertEqual(reopened.stats()["recovered"], 2)
+        self.assertEqual(reopened.flush(), 2)
+        self.assertEqual(ChatTurn.objects.count(), 2)
+        reopened.close()
+
+    def test_turns_stored_just_before_a_crash_are_not_duplicated(self):
+        wal = TurnJournal(self.path, flush_interval=0)
+        wal.append(self.turn("one"))
+        with open(self.path, encoding="utf-8") as f:
+            journaled = f.read()
+        wal.flush()
+        wal.close()
+        # Crash between the insert and the journal rewrite
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(journaled)
+
+        reopened = TurnJournal(self.path, flush_interval=0)
+        reopened.append(self.turn("two"))
+        self.assertEqual(reopened.flush(), 1)
+        self.assertEqual(
+            sorted(ChatTurn.objects.values_list("user_message", flat=True)), ["one", "two"]
+        )
+        reopened.close()
+
+    def test_turns_of_deleted_sessions_are_dropped(self):
+        wal = TurnJournal(self.path, flush_interval=0)
+        wal.append(self.turn("gone"))
+        self.session.delete()
+        self.assertEqual(wal.flush(), 0)
+        self.assertEqual(wal.stats()["dropped"], 1)
+        wal.close()
+
+
+class WriteBehindViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.dir = tempfile.mkdtemp()
+        self.settings = override_settings(
+            CHAT_WRITE_BEHIND=True,
+            CHAT_JOURNAL_PATH=os.path.join(self.dir, "chat-journal-{slot}.jsonl"),
+            CHAT_JOURNAL_FLUSH_INTERVAL=0,
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        journal._close_journal()
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_reply_is_sent_before_the_turn_is_stored(self, mock_talk, mock_send):
+        user = BaleUser.objects.create(chat_id="2001", phone_number="09900000002",
+                                       is_authenticated=True, assistant_role="psychologist")
+        mock_talk.return_value = {"choices": [{"message": {"content": "Answer"}}]}
+        url = reverse("bale_webhook")
+        for text in ("First question", "Second question"):
+            APIClient().post(url, {"message": {"chat": {"id": "2001"}, "text": text}}, format="json")
+
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertFalse(ChatTurn.objects.filter(user=user).exists())
+        # The unflushed first exchange was still part of the second prompt
+        history = mock_talk.call_args[1]["user_messages"]
+        self.assertEqual(history[0]["content"], "First question")
+
+        self.assertEqual(get_turn_journal().flush(), 2)
+        self.assertEqual(ChatTurn.objects.filter(user=user).count(), 2)
+
+    def test_each_process_gets_its_own_slot(self):
+        first = get_turn_journal()
+        self.assertTrue(first.path.endswith("chat-journal-0.jsonl"))
+        path, lock = journal._claim(os.path.join(self.dir, "chat-journal-{slot}.jsonl"))
+        self.assertTrue(path.endswith("chat-journal-1.jsonl"))
+        lock.close()
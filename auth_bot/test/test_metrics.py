@@ -0,0 +1,143 @@
+import json
+import time
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from unittest.mock import patch
+from auth_bot.metrics import (
+    STAGE_SECONDS, UPDATE_SECONDS, UPDATES_TOTAL, Histogram, _flatten,
+    label_update, render_metrics, reset_metrics, span, trace_update,
+)
+from auth_bot.models import BaleUser
+from auth_bot.response_cache import response_cache
+
+
+class HistogramTests(SimpleTestCase):
+
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram("x_seconds", "Test.", labelnames=("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, stage="llm")
+        lines = histogram.render()
+        self.assertIn('x_seconds_bucket{stage="llm",le="0.1"} 1', lines)
+        self.assertIn('x_seconds_bucket{stage="llm",le="1.0"} 3', lines)
+        self.assertIn('x_seconds_bucket{stage="llm",le="+Inf"} 4', lines)
+        self.assertIn('x_seconds_count{stage="llm"} 4', lines)
+        self.assertIn('x_seconds_sum{stage="llm"} 6.05', lines)
+
+    def test_label_values_are_escaped(self):
+        histogram = Histogram("x_seconds", "Test.", labelnames=("command",), buckets=(1.0,))
+        histogram.observe(0.1, command='a"b\\c')
+        self.assertIn('x_seconds_count{command="a\\"b\\\\c"} 1', histogram.render())
+
+    def test_nested_stats_become_labels(self):
+        samples = []
+        _flatten("bale_talkbot", {"breakers": {"gpt@http://x": {"failures": 2, "state": "open"}},
+                                  "lanes": [{"depth": 3}]}, [], samples)
+        self.assertIn(("bale_talkbot_breakers_failures", [("key", "gpt@http://x")], 2), samples)
+        self.assertIn(("bale_talkbot_lanes_depth", [("index", 0)], 3), samples)
+        self.assertEqual(len(samples), 2)  # the state string is skipped
+
+    @patch("auth_bot.metrics._builtin_stats")
+    def test_families_are_contiguous(self, mock_stats):
+        mock_stats.return_value = {"dispatcher": {"lanes": [
+            {"queue_depth": 1, "processed": 5}, {"queue_depth": 2, "processed": 7},
+        ]}}
+        names = [line.split("{")[0] for line in render_metrics().splitlines() if line.startswith("bale_dispatcher")]
+        self.assertEqual(names, ["bale_dispatcher_lanes_queue_depth"] * 2 + ["bale_dispatcher_lanes_processed"] * 2)
+
+
+class TraceTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_metrics()
+
+    def test_spans_are_labelled_with_the_command(self):
+        user = BaleUser(chat_id="1", assistant_role="psychologist")
+        with trace_update(7):
+            with span("user_load"):
+                pass
+            label_update("chat", user)
+            with span("llm"):
+                pass
+        labels = {"command": "chat", "assistant_role": "psychologist"}
+        self.assertEqual(STAGE_SECONDS.count(stage="user_load", **labels), 1)
+        self.assertEqual(STAGE_SECONDS.count(stage="llm", **labels), 1)
+        self.assertEqual(UPDATE_SECONDS.count(**labels), 1)
+        self.assertEqual(UPDATES_TOTAL.value(**labels), 1)
+
+    def test_nested_traces_count_once(self):
+        with trace_update():
+            with trace_update(9) as trace:
+                label_update("start")
+            self.assertEqual(trace.update_id, 9)
+        self.assertEqual(UPDATES_TOTAL.value(command="start", assistant_role=""), 1)
+
+    def test_span_outside_an_update(self):
+        with span("send"):
+            pass
+        self.assertEqual(STAGE_SECONDS.count(stage="send", command="none", assistant_role=""), 1)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        with trace_update(1):
+            with span("send"):
+                pass
+        self.assertNotIn("bale_stage_seconds_count", render_metrics())
+
+    @override_settings(TRACE_SLOW_SECONDS=0.01)
+    def test_slow_update_is_logged(self):
+        with self.assertLogs("auth_bot.trace", level="INFO") as logs:
+            with trace_update(5):
+                with span("llm"):
+                    time.sleep(0.02)
+            with trace_update(6):
+                pass
+        self.assertEqual(len(logs.records), 1)
+        trace = json.loads(logs.records[0].getMessage())
+        self.assertEqual(trace["update_id"], 5)
+        self.assertEqual(trace["stages"][0]["stage"], "llm")
+        self.assertGreaterEqual(trace["stages"][0]["ms"], 20)
+
+
+class MetricsEndpointTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        reset_metrics()
+        self.client = APIClient()
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_chat_update_stages_are_exported(self, mock_talk, mock_send):
+        mock_talk.return_value = {"choices": [{"message": {"content": "سلام"}}]}
+        BaleUser.objects.create(
+            chat_id="555", is_authenticated=True, assistant_role="psychologist",
+            dialog_state=BaleUser.DIALOG_CHATTING,
+        )
+        data = {"update_id": 1, "message": {"chat": {"id": "555"}, "text": "hello"}}
+        self.assertEqual(self.client.post(reverse("bale_webhook"), data, format="json").status_code, 200)
+
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        for stage in ("parse", "user_load", "route", "history", "llm", "persist"):
+            self.assertIn(
+                f'bale_stage_seconds_count{{stage="{stage}",command="chat",assistant_role="psychologist"}} 1',
+                body,
+            )
+        self.assertIn('bale_updates_total{command="chat",assistant_role="psychologist"} 1', body)
+        self.assertIn("# TYPE bale_user_cache_hits gauge", body)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+
+    def test_off_without_a_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
@@ -1,5 +1,8 @@
+from django.db import IntegrityError, transaction
 from django.test import TestCase
-from auth_bot.models import BaleUser, ChatSession
+from datetime import timedelta
+from django.utils.timezone import now
+from auth_bot.models import BaleUser, ChatSession, ChatTurn
 
 class ModelsTestCase(TestCase):
 
@@ -56,3 +59,53 @@ class ModelsTestCase(TestCase):
         self.assertEqual(session.bot_response, "Hello, how can I help?")
         self.assertEqual(session.assistant_role, "general_physician")
         self.assertEqual(session.system_role, "therapeutic")
+
+    def test_one_active_session_per_user(self):
+        user = BaleUser.objects.create(chat_id="321", phone_number="09120000321")
+        ChatSession.objects.create(user=user, is_active=True, assistant_role="a", system_role="s")
+        ChatSession.objects.create(user=user, is_active=False, assistant_role="a", system_role="s")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ChatSession.objects.create(user=user, is_active=True, assistant_role="a", system_role="s")
+        session, created = ChatSession.objects.get_or_create(user=user, is_active=True)
+        self.assertFalse(created)
+
+class ChatTurnTestCase(TestCase):
+
+    def setUp(self):
+        self.user = BaleUser.objects.create(chat_id="turns", phone_number="09121111111")
+        self.session = ChatSession.objects.create(user=self.user, is_active=True)
+        start = now()
+        for i in range(8):
+            ChatTurn.objects.create(
+                user=self.user,
+                session=self.session,
+                user_message=f"question {i}",
+                bot_response=f"answer {i}",
+                assistant_role="general_physician",
+                token_count=10,
+                created_at=start + timedelta(seconds=i),
+            )
+
+    def test_token_count_is_estimated(self):
+        turn = ChatTurn.objects.create(
+            user=self.user,
+            session=self.session,
+            user_message="x" * 40,
+            bot_response="y" * 40,
+            assistant_role="general_physician",
+        )
+        self.assertEqual(turn.token_count, 20)
+
+    def test_tail_returns_latest_turns_oldest_first(self):
+        with self.assertNumQueries(1):
+            turns = ChatTurn.objects.tail(self.user, self.session, limit=3)
+        self.assertEqual([t.user_message for t in turns], ["question 5", "question 6", "question 7"])
+
+    def test_tail_respects_token_budget(self):
+        turns = ChatTurn.objects.tail(self.user, self.session, limit=5, token_budget=25)
+        self.assertEqual([t.user_message for t in turns], ["question 6", "question 7"])
+
+    def test_tail_is_scoped_to_session(self):
+        other = ChatSession.objects.create(user=self.user, is_active=False)
+        self.assertEqual(ChatTurn.objects.tail(self.user, other), [])
+        self.assertEqual(len(ChatTurn.objects.tail(self.user, limit=20)), 8)
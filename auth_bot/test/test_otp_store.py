@@ -0,0 +1,99 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from auth_bot.auth import handle_otp, handle_phone_number
+from auth_bot.checks import check_shared_state
+from auth_bot.models import BaleUser
+from auth_bot.otp_store import INVALID, LOCKED, MISSING, THROTTLED, VERIFIED, OTPStore, otp_store
+
+
+class OTPStoreTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_code_is_stored_hashed_and_single_use(self):
+        store = OTPStore()
+        code = store.issue("1")
+        self.assertEqual(len(code), 6)
+        self.assertNotIn(code, str(cache.get("otp:code:1")))
+        self.assertEqual(store.verify("1", code), VERIFIED)
+        self.assertEqual(store.verify("1", code), MISSING)
+
+    def test_codes_expire(self):
+        store = OTPStore(ttl=-1)
+        store.issue("1", "123456")
+        self.assertEqual(store.verify("1", "123456"), MISSING)
+
+    def test_wrong_guesses_lock_the_code(self):
+        store = OTPStore(max_attempts=3)
+        store.issue("1", "123456")
+        self.assertEqual(store.verify("1", "000000"), INVALID)
+        self.assertEqual(store.verify("1", "000001"), INVALID)
+        self.assertEqual(store.verify("1", "000002"), LOCKED)
+        self.assertEqual(store.verify("1", "123456"), MISSING)
+
+    def test_new_code_replaces_the_old_one(self):
+        store = OTPStore()
+        store.issue("1", "111111")
+        store.issue("1", "222222")
+        self.assertEqual(store.verify("1", "111111"), INVALID)
+        self.assertEqual(store.verify("1", "222222"), VERIFIED)
+
+    def test_sends_are_throttled_per_phone_and_chat(self):
+        store = OTPStore(phone_rate=(2, 1), chat_rate=(2, 1))
+        self.assertTrue(store.allow_send("1", "09120000001"))
+        self.assertTrue(store.allow_send("2", "09120000001"))
+        self.assertFalse(store.allow_send("3", "09120000001"))
+        self.assertTrue(store.allow_send("1", "09120000002"))
+        self.assertFalse(store.allow_send("1", "09120000003"))
+        self.assertEqual(store.stats()["throttled"], 2)
+
+    def test_refused_send_takes_no_chat_token(self):
+        store = OTPStore(phone_rate=(1, 1), chat_rate=(2, 1))
+        self.assertTrue(store.allow_send("1", "09120000001"))
+        self.assertFalse(store.allow_send("1", "09120000001"))
+        # The chat's second token is still there for another number
+        self.assertTrue(store.allow_send("1", "09120000002"))
+        self.assertFalse(store.allow_send("1", "09120000003"))
+
+    def test_per_process_cache_is_flagged_with_several_workers(self):
+        self.assertEqual(check_shared_state(None), [])
+        with override_settings(WEB_CONCURRENCY=2):
+            self.assertIn("auth_bot.W002", [warning.id for warning in check_shared_state(None)])
+
+    def test_guesses_are_throttled_per_chat(self):
+        store = OTPStore(verify_rate=(2, 1))
+        store.issue("1", "123456")
+        store.verify("1", "000000")
+        store.verify("1", "000001")
+        self.assertEqual(store.verify("1", "123456"), THROTTLED)
+
+
+@patch("auth_bot.auth.send_message_to_bale")
+class OTPHandlerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(OTP_SMS_MODE="sync")
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_sms_bombing_is_throttled(self, mock_sms, mock_send):
+        for _ in range(5):
+            handle_phone_number("1", "09120000001")
+        self.assertEqual(mock_sms.call_count, 3)
+        self.assertIn("بیش از حد مجاز", mock_send.call_args[0][1])
+
+    def test_wrong_guess_does_not_write_the_user(self, mock_send):
+        user = BaleUser.objects.create(chat_id="7", phone_number="09120000007", dialog_state="awaiting_otp")
+        otp_store.issue("7", "123456")
+        with patch.object(BaleUser, "save") as mock_save:
+            handle_otp("7", "000000", user)
+        mock_save.assert_not_called()
+
+    def test_expired_code_asks_for_the_phone_again(self, mock_send):
+        user = BaleUser.objects.create(chat_id="8", phone_number="09120000008", dialog_state="awaiting_otp")
+        handle_otp("8", "123456", user)
+        user.refresh_from_db()
+        self.assertEqual(user.dialog_state, "awaiting_phone")
+        self.assertIn("منقضی", mock_send.call_args[0][1])
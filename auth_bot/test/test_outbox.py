@@ -0,0 +1,154 @@
+import time
+import threading
+from unittest.mock import MagicMock, patch
+from django.test import TestCase
+from auth_bot.outbox import (
+    OutboundScheduler, TokenBucket, split_message, SENT, QUEUED, DROPPED, FAILED, PENDING,
+)
+from auth_bot.utils import edit_message_in_bale, send_message_to_bale
+
+
+def response(status, retry_after=None):
+    resp = MagicMock()
+    resp.status_code = status
+    resp.ok = status < 400
+    resp.json.return_value = {"ok": status < 400, "parameters": {"retry_after": retry_after}}
+    resp.headers = {}
+    return resp
+
+
+class FakeBale:
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, method, payload):
+        with self.lock:
+            self.calls.append(payload["text"])
+            return self.replies.pop(0) if self.replies else response(200)
+
+
+class SplitMessageTests(TestCase):
+
+    def test_short_text_is_one_part(self):
+        self.assertEqual(split_message("سلام"), ["سلام"])
+
+    def test_long_text_splits_on_words(self):
+        text = " ".join(["کلمه"] * 2000)
+        parts = split_message(text, limit=4096)
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(len(part) <= 4096 for part in parts))
+        self.assertEqual(" ".join(parts), text)
+
+
+class TokenBucketTests(TestCase):
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        self.assertIsNone(bucket.reserve(max_wait=0.05))
+
+
+class OutboundSchedulerTests(TestCase):
+
+    def test_short_retry_after_is_retried_inline(self):
+        bale = FakeBale(response(429, retry_after=0.01), response(200))
+        scheduler = OutboundScheduler(bale, max_wait=1.0)
+        delivery = scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "a"})
+        self.assertEqual(delivery.status, SENT)
+        self.assertEqual(delivery.attempts, 2)
+        self.assertEqual(scheduler.stats()["rate_limited"], 1)
+
+    def test_429_without_retry_after_backs_off(self):
+        bale = FakeBale(response(429), response(429, retry_after=0), response(200))
+        scheduler = OutboundScheduler(bale, max_wait=1.0, min_retry_delay=0.05)
+        started = time.monotonic()
+        delivery = scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "a"})
+        self.assertEqual(delivery.status, SENT)
+        # 0.05 s, then 0.1 s
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+    def test_unqueued_delivery_is_not_sent_later(self):
+        bale = FakeBale()
+        scheduler = OutboundScheduler(bale, chat_rate=1.0, chat_burst=1, max_wait=0.01)
+        scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "a"})
+        delivery = scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "b"}, queue=False)
+        self.assertEqual(delivery.status, PENDING)
+        self.assertIsNone(delivery.response)
+        self.assertEqual(scheduler.stats()["queue_depth"], 0)
+        self.assertEqual(bale.calls, ["a"])
+
+    def test_long_retry_after_goes_to_queue_and_keeps_chat_order(self):
+        bale = FakeBale(response(429, retry_after=0.05))
+        scheduler = OutboundScheduler(bale, max_wait=0.01)
+        first = scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "a"})
+        second = scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "b"})
+        other = scheduler.deliver("sendMessage", "2", {"chat_id": "2", "text": "c"})
+        self.assertEqual(first.status, QUEUED)
+        self.assertEqual(second.status, QUEUED)
+        self.assertEqual(other.status, SENT)
+
+        self.assertTrue(scheduler.wait_idle())
+        self.assertEqual((first.status, second.status), (SENT, SENT))
+        self.assertEqual(bale.calls, ["a", "c", "a", "b"])
+
+    def test_full_queue_drops(self):
+        bale = FakeBale(response(429, retry_after=60))
+        scheduler = OutboundScheduler(bale, max_wait=0.01, max_queue=1)
+        scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "a"})
+        dropped = scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "b"})
+        self.assertEqual(dropped.status, DROPPED)
+        self.assertEqual(scheduler.stats()["dropped"], 1)
+
+    def test_unreachable_bale_fails(self):
+        scheduler = OutboundScheduler(lambda method, payload: None)
+        delivery = scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "a"})
+        self.assertEqual(delivery.status, FAILED)
+
+    def test_per_chat_pacing(self):
+        scheduler = OutboundScheduler(FakeBale(), chat_rate=1.0, chat_burst=1, max_wait=0.01)
+        self.assertEqual(scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "a"}).status, SENT)
+        # The second message to the same chat would have to wait ~1s: it is queued
+        self.assertEqual(scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": "b"}).status, QUEUED)
+
+    def test_backlog_drain_keeps_to_the_rate_limits(self):
+        sent_at = []
+        bale = FakeBale()
+
+        def transport(method, payload):
+            sent_at.append(time.monotonic())
+            return bale(method, payload)
+
+        scheduler = OutboundScheduler(transport, chat_rate=4.0, chat_burst=1, max_wait=0.01)
+        for text in "abc":
+            scheduler.deliver("sendMessage", "1", {"chat_id": "1", "text": text})
+        self.assertTrue(scheduler.wait_idle())
+        self.assertEqual(bale.calls, ["a", "b", "c"])
+        gaps = [later - earlier for earlier, later in zip(sent_at, sent_at[1:])]
+        # 4 per second for this chat, also for the queued ones
+        self.assertTrue(all(gap >= 0.2 for gap in gaps), gaps)
+
+
+class SendMessageSplitTests(TestCase):
+
+    @patch("auth_bot.utils.http_request")
+    def test_long_reply_is_sent_in_order(self, mock_request):
+        mock_request.return_value = response(200)
+        text = "الف " * 1500 + "پایان"
+        send_message_to_bale("77", text)
+        sent = [call[1]["json"]["text"] for call in mock_request.call_args_list]
+        self.assertEqual(len(sent), 2)
+        self.assertTrue(sent[1].endswith("پایان"))
+
+    @patch("auth_bot.utils.http_request")
+    def test_overflow_of_an_edited_message_is_sent_once(self, mock_request):
+        mock_request.return_value = response(200)
+        text = "الف " * 1500
+        edit_message_in_bale("78", 5, text, final=False)
+        edit_message_in_bale("78", 5, text + "پایان")
+        methods = [call[0][1].rsplit("/", 1)[-1] for call in mock_request.call_args_list]
+        self.assertEqual(methods, ["editMessageText", "editMessageText", "sendMessage"])
@@ -0,0 +1,55 @@
+from datetime import timedelta
+from django.test import TestCase
+from auth_bot import quota
+from auth_bot.models import BaleUser
+
+
+class QuotaTests(TestCase):
+
+    def setUp(self):
+        self.user = BaleUser.objects.create(
+            chat_id="321",
+            phone_number="09120000001",
+            daily_message_limit=2,
+        )
+
+    def test_consume_until_limit(self):
+        self.assertTrue(quota.consume(self.user))
+        self.assertTrue(quota.consume(self.user))
+        self.assertFalse(quota.consume(self.user))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_message_count, 2)
+        self.assertEqual(quota.remaining(self.user), 0)
+
+    def test_stale_instances_cannot_overrun_limit(self):
+        # Two concurrent requests that both loaded the row before either counted
+        first = BaleUser.objects.get(pk=self.user.pk)
+        second = BaleUser.objects.get(pk=self.user.pk)
+        quota.consume(self.user)
+        results = [quota.consume(first), quota.consume(second)]
+        self.assertEqual(results.count(True), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_message_count, 2)
+
+    def test_new_day_resets_lazily(self):
+        BaleUser.objects.filter(pk=self.user.pk).update(
+            current_message_count=2,
+            quota_day=quota.quota_today() - timedelta(days=1),
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(quota.remaining(self.user), 2)
+        self.assertTrue(quota.consume(self.user))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_message_count, 1)
+        self.assertEqual(self.user.quota_day, quota.quota_today())
+
+    def test_release_gives_message_back(self):
+        quota.consume(self.user)
+        self.assertTrue(quota.release(self.user))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_message_count, 0)
+
+    def test_zero_limit_never_allows(self):
+        self.user.daily_message_limit = 0
+        self.user.save()
+        self.assertFalse(quota.consume(self.user))
@@ -0,0 +1,111 @@
+import os
+import tempfile
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from auth_bot.recorder import (
+    OTP_PLACEHOLDER, TrafficRecorder, chat_sampled, get_recorder, read_log, scrub_text,
+    scrub_update, update_kind,
+)
+from auth_bot.response_cache import response_cache
+from auth_bot.stubs import StubServer
+
+
+def temp_log():
+    fd, path = tempfile.mkstemp(suffix=".jsonl.gz")
+    os.close(fd)
+    os.remove(path)
+    return path
+
+
+class ScrubTests(SimpleTestCase):
+
+    def test_commands_and_role_choices_are_kept(self):
+        for text in ("/start", "/login", "#", "2"):
+            self.assertEqual(scrub_text(text), text)
+
+    def test_phone_numbers_get_a_stable_pseudonym(self):
+        fake = scrub_text("09123456789")
+        self.assertRegex(fake, r"^09\d{9}$")
+        self.assertNotEqual(fake, "09123456789")
+        self.assertEqual(fake, scrub_text("09123456789"))
+        self.assertNotEqual(fake, scrub_text("09123456780"))
+
+    def test_otp_and_free_text(self):
+        self.assertEqual(scrub_text("123456"), OTP_PLACEHOLDER)
+        self.assertEqual(scrub_text("سلام دکتر،  سردرد"), "xxxx xxxxx  xxxxx")
+
+    def test_update_keeps_only_what_the_bot_reads(self):
+        update = {
+            "update_id": 5,
+            "message": {"chat": {"id": 42, "first_name": "Ali"}, "from": {"username": "ali"}, "text": "/start"},
+        }
+        scrubbed = scrub_update(update)
+        self.assertEqual(scrubbed["update_id"], 5)
+        self.assertEqual(scrubbed["message"]["text"], "/start")
+        self.assertEqual(set(scrubbed["message"]), {"chat", "text"})
+        self.assertEqual(set(scrubbed["message"]["chat"]), {"id"})
+        self.assertNotEqual(scrubbed["message"]["chat"]["id"], "42")
+        self.assertEqual(scrubbed["message"]["chat"]["id"], scrub_update(update)["message"]["chat"]["id"])
+
+    def test_update_kind(self):
+        self.assertEqual(update_kind({"message": {"chat": {"id": "r1"}, "text": OTP_PLACEHOLDER}}), "otp")
+        self.assertEqual(update_kind({"message": {"chat": {"id": "r1"}, "text": "xxxx"}}), "chat")
+        self.assertEqual(update_kind({"update_id": 1}), "other")
+
+    def test_chats_are_sampled_whole(self):
+        updates = [{"message": {"chat": {"id": i}, "text": "hi"}} for i in range(200)]
+        sampled = [chat_sampled(update, 0.5) for update in updates]
+        self.assertTrue(40 < sum(sampled) < 160)
+        self.assertEqual(sampled, [chat_sampled(update, 0.5) for update in updates])
+
+
+class TrafficRecorderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.path = temp_log()
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_buffered_members_read_back_in_order(self):
+        recorder = TrafficRecorder(self.path, flush_every=2)
+        for i in range(5):
+            recorder.record({"update_id": i, "message": {"chat": {"id": 1}, "text": "/start"}},
+                            arrived=1000.0 + i, elapsed=0.05, calls=[("sendMessage", 0.02, 200)])
+        self.assertEqual(recorder.stats()["buffered"], 1)
+        recorder.flush()
+        records = list(read_log(self.path))
+        self.assertEqual([record["u"]["update_id"] for record in records], [0, 1, 2, 3, 4])
+        self.assertEqual(records[0]["calls"], [["sendMessage", 20.0, 200]])
+        self.assertEqual(records[0]["ms"], 50.0)
+        self.assertEqual(recorder.stats()["flushes"], 3)
+
+
+class WebhookRecordingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.path = temp_log()
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_webhook_records_scrubbed_update_and_outbound_calls(self):
+        with StubServer() as stub, override_settings(**stub.settings_overrides(), TRAFFIC_RECORD_PATH=self.path):
+            data = {"update_id": 3, "message": {"chat": {"id": "777"}, "text": "/start"}}
+            response = APIClient().post(reverse("bale_webhook"), data, format="json")
+            self.assertEqual(response.status_code, 200)
+            get_recorder().flush()
+        (record,) = read_log(self.path)
+        self.assertEqual(record["u"]["message"]["text"], "/start")
+        self.assertNotEqual(record["u"]["message"]["chat"]["id"], "777")
+        self.assertEqual([call[0] for call in record["calls"]], ["sendMessage"])
+        self.assertEqual(record["calls"][0][2], 200)
+
+    def test_recording_is_off_by_default(self):
+        self.assertIsNone(get_recorder())
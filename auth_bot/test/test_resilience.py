@@ -0,0 +1,39 @@
+from django.test import SimpleTestCase
+from auth_bot.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def boom():
+    raise RuntimeError("down")
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(lambda: "never")
+        self.assertEqual(breaker.stats()["rejected"], 2)
+
+    def test_half_open_allows_one_trial_call(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        with self.assertRaises(RuntimeError):
+            breaker.call(boom)
+        self.assertEqual(breaker.stats()["opened"], 2)
+        self.assertEqual(breaker.stats()["consecutive_failures"], 2)
@@ -0,0 +1,113 @@
+from unittest.mock import patch
+from django.test import TestCase
+from auth_bot.models import BaleUser
+from auth_bot.response_cache import ResponseCache, normalize_prompt, response_cache
+from auth_bot.user_cache import LocalLRUBackend
+from auth_bot.views import handle_chat_message
+
+ANSWER = {"choices": [{"message": {"content": "استراحت کنید و آب بنوشید."}}]}
+
+
+class NormalizePromptTests(TestCase):
+
+    def test_arabic_letters_spaces_and_punctuation(self):
+        self.assertEqual(normalize_prompt("سردرد  دارم، چه كنم؟"), "سردرد دارم چه کنم")
+        self.assertEqual(normalize_prompt("سَردرد داري"), "سردرد داری")
+
+    def test_digits(self):
+        self.assertEqual(normalize_prompt("تب ۳۸ درجه"), "تب 38 درجه")
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(LocalLRUBackend(maxsize=10, ttl=60), similarity=0.7)
+
+    def test_exact_hit_after_normalisation(self):
+        key = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد دارم چه کنم؟")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, ANSWER, elapsed=2.0)
+
+        same = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد دارم چه كنم")
+        self.assertEqual(self.cache.get(same), ANSWER)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+        self.assertGreater(stats["latency_saved"], 1.9)
+
+    def test_roles_are_part_of_the_key(self):
+        key = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد دارم")
+        self.cache.put(key, ANSWER, elapsed=1.0)
+        other = self.cache.key_for("psychologist", "therapeutic", "gpt-4o-mini", "سردرد دارم")
+        self.assertIsNone(self.cache.get(other))
+
+    def test_similar_question_hits(self):
+        key = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد شدید دارم چه کنم")
+        self.cache.put(key, ANSWER, elapsed=1.0)
+        near = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد شدید دارم چه کار کنم")
+        self.assertEqual(self.cache.get(near), ANSWER)
+        self.assertEqual(self.cache.stats()["similar_hits"], 1)
+
+    def test_similar_questions_with_other_numbers_or_negations_miss(self):
+        dose = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "دوز استامینوفن برای کودک ۲ ساله چقدر است")
+        self.cache.put(dose, ANSWER, elapsed=1.0)
+        older = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "دوز استامینوفن برای کودک ۱۲ ساله چقدر است")
+        self.assertIsNone(self.cache.get(older))
+
+        ate = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "امروز قرصم را خوردم چه کنم")
+        self.cache.put(ate, ANSWER, elapsed=1.0)
+        for text in ("امروز قرصم را نخوردم چه کنم", "امروز قرصم را نه خوردم چه کنم"):
+            self.assertIsNone(self.cache.get(self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", text)))
+        self.assertEqual(self.cache.stats()["similar_hits"], 0)
+
+    def test_token_limit_is_part_of_the_key(self):
+        key = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد دارم", max_tokens=300)
+        self.cache.put(key, ANSWER, elapsed=1.0)
+        longer = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد دارم", max_tokens=1000)
+        self.assertIsNone(self.cache.get(longer))
+
+    def test_errors_are_not_stored(self):
+        key = self.cache.key_for("general_physician", "therapeutic", "gpt-4o-mini", "سردرد دارم")
+        self.cache.put(key, {"error": "HTTP 500"}, elapsed=1.0)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_role_bypass(self):
+        self.cache.set_bypass("psychiatrist")
+        self.assertIsNone(self.cache.key_for("psychiatrist", "therapeutic", "gpt-4o-mini", "بی‌خوابی"))
+        self.assertEqual(self.cache.stats()["bypassed"], 1)
+        self.cache.set_bypass("psychiatrist", False)
+        self.assertIsNotNone(self.cache.key_for("psychiatrist", "therapeutic", "gpt-4o-mini", "بی‌خوابی"))
+
+
+class CachedChatTests(TestCase):
+
+    def setUp(self):
+        response_cache.clear()
+        for chat_id in ("801", "802"):
+            BaleUser.objects.create(
+                chat_id=chat_id,
+                phone_number=f"0912{chat_id}",
+                is_authenticated=True,
+                assistant_role="general_physician",
+            )
+
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_second_user_first_message_served_from_cache(self, mock_talk, mock_send):
+        mock_talk.return_value = ANSWER
+        handle_chat_message("801", "سردرد دارم چه کنم؟")
+        handle_chat_message("802", "سردرد دارم چه كنم")
+
+        mock_talk.assert_called_once()
+        self.assertTrue(mock_send.call_args[0][1].startswith("استراحت کنید"))
+
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_follow_up_messages_are_not_cached(self, mock_talk, mock_send):
+        mock_talk.return_value = ANSWER
+        handle_chat_message("801", "سردرد دارم")
+        handle_chat_message("801", "سردرد دارم")
+        self.assertEqual(mock_talk.call_count, 2)
+
+    def test_similarity_matching_is_off_by_default(self):
+        self.assertEqual(response_cache.similarity, 0)
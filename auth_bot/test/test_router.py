@@ -0,0 +1,97 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from auth_bot.models import BaleUser
+from auth_bot.router import route, route_text
+from auth_bot.views import process_update
+
+
+def update(chat_id, text):
+    return {"message": {"chat": {"id": chat_id}, "text": text}}
+
+
+class RouteTests(TestCase):
+
+    def test_idle_keeps_shape_based_routing(self):
+        self.assertEqual(route_text("09123456789"), "phone")
+        self.assertEqual(route_text("123456"), "otp")
+        self.assertEqual(route_text("3"), "role")
+        self.assertEqual(route_text("سلام"), "chat")
+        self.assertEqual(route("idle", "123456"), "otp")
+
+    def test_global_commands_in_every_state(self):
+        for state, _ in BaleUser.DIALOG_STATES:
+            self.assertEqual(route(state, "/LOGOUT"), "logout")
+            self.assertEqual(route(state, "#"), "end_chat")
+
+    def test_numbers_while_chatting_are_messages(self):
+        self.assertEqual(route("chatting", "123456"), "chat")
+        self.assertEqual(route("chatting", "09123456789"), "chat")
+        self.assertEqual(route("chatting", "2"), "chat")
+
+    def test_login_states(self):
+        self.assertEqual(route("awaiting_phone", "09123456789"), "phone")
+        self.assertEqual(route("awaiting_phone", "123456"), "invalid_phone")
+        self.assertEqual(route("awaiting_otp", "123456"), "otp")
+        self.assertEqual(route("awaiting_otp", "12"), "invalid_otp")
+
+    def test_role_states(self):
+        self.assertEqual(route("choosing_role", "4"), "role")
+        self.assertEqual(route("confirming_role", "1"), "role")
+        self.assertEqual(route("confirming_role", "سلام"), "chat")
+
+
+@override_settings(OTP_SMS_MODE="sync")
+@patch("auth_bot.auth.send_message_to_bale")
+@patch("auth_bot.views.send_message_to_bale")
+class DialogFlowTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @patch("auth_bot.auth.send_otp_sms")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_full_dialog(self, mock_talk, mock_sms, mock_send, mock_auth_send):
+        mock_talk.return_value = {"choices": [{"message": {"content": "Answer"}}]}
+
+        def state():
+            return BaleUser.objects.get(chat_id="42").dialog_state
+
+        process_update(update("42", "/login"))
+        self.assertEqual(state(), "awaiting_phone")
+        process_update(update("42", "09120000042"))
+        self.assertEqual(state(), "awaiting_otp")
+        otp = mock_sms.call_args[0][1]
+        process_update(update("42", otp))
+        self.assertEqual(state(), "idle")
+        process_update(update("42", "/startchat"))
+        self.assertEqual(state(), "choosing_role")
+        process_update(update("42", "3"))
+        self.assertEqual(state(), "confirming_role")
+        process_update(update("42", "1"))
+        self.assertEqual(state(), "chatting")
+
+        process_update(update("42", "654321"))
+        self.assertEqual(mock_talk.call_args[1]["user_messages"][-1]["content"], "654321")
+        process_update(update("42", "#"))
+        self.assertEqual(state(), "idle")
+
+    @patch("auth_bot.auth.handle_otp")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_six_digits_while_chatting_skip_otp(self, mock_talk, mock_otp, mock_send, mock_auth_send):
+        mock_talk.return_value = {"choices": [{"message": {"content": "Answer"}}]}
+        BaleUser.objects.create(
+            chat_id="43",
+            phone_number="09120000043",
+            is_authenticated=True,
+            assistant_role="general_physician",
+            dialog_state="chatting",
+        )
+        process_update(update("43", "123456"))
+        mock_otp.assert_not_called()
+        mock_talk.assert_called_once()
+
+    def test_one_user_read_per_command(self, mock_send, mock_auth_send):
+        BaleUser.objects.create(chat_id="44", phone_number="09120000044", is_authenticated=True)
+        with self.assertNumQueries(1):
+            process_update(update("44", "/start"))
@@ -0,0 +1,104 @@
+import asyncio
+from unittest.mock import patch
+import httpx
+import requests
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from kavenegar import APIException, HTTPException
+from auth_bot import sms
+from auth_bot.auth import OTP_QUEUED_MESSAGE, asend_otp_sms, handle_phone_number
+from auth_bot.models import BaleUser
+from auth_bot.sms import deliver_otp, get_sms_dispatcher, kavenegar_breaker, sms_stats
+
+
+@override_settings(OTP_SMS_RETRY_BACKOFF=0)
+class DeliverOtpTests(TestCase):
+
+    def setUp(self):
+        kavenegar_breaker.reset()
+
+    def tearDown(self):
+        kavenegar_breaker.reset()
+
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_retries_transient_failures(self, mock_sms):
+        mock_sms.side_effect = [HTTPException("timeout"), None]
+        sent = sms_stats.as_dict()["sent"]
+        self.assertTrue(deliver_otp("1", "09120000001", "123456"))
+        self.assertEqual(mock_sms.call_count, 2)
+        self.assertEqual(sms_stats.as_dict()["sent"], sent + 1)
+        self.assertEqual(sms_stats.recent[-1]["attempt"], 2)
+
+    @override_settings(OTP_SMS_MAX_ATTEMPTS=3)
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_gives_up_after_max_attempts(self, mock_sms):
+        mock_sms.side_effect = HTTPException("down")
+        self.assertFalse(deliver_otp("1", "09120000001", "123456"))
+        self.assertEqual(mock_sms.call_count, 3)
+
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_client_errors_are_not_retried(self, mock_sms):
+        mock_sms.side_effect = APIException("APIException[411] invalid receptor")
+        self.assertFalse(deliver_otp("1", "0912", "123456"))
+        self.assertEqual(mock_sms.call_count, 1)
+        self.assertEqual(kavenegar_breaker.stats()["consecutive_failures"], 0)
+
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_open_breaker_fails_fast(self, mock_sms):
+        for _ in range(kavenegar_breaker.failure_threshold):
+            kavenegar_breaker.record_failure()
+        self.assertFalse(deliver_otp("1", "09120000001", "123456"))
+        self.assertFalse(sms.queue_otp_sms("1", "09120000001", "123456"))
+        mock_sms.assert_not_called()
+
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_failed_trial_call_without_an_outage_frees_the_breaker(self, mock_sms):
+        for _ in range(kavenegar_breaker.failure_threshold):
+            kavenegar_breaker.record_failure()
+        with patch.object(kavenegar_breaker, "reset_timeout", 0):
+            # Half open: the trial call hits a bad number (4xx: Kavenegar is up)
+            mock_sms.side_effect = APIException("APIException[411] invalid receptor")
+            self.assertFalse(deliver_otp("1", "0912", "123456"))
+            mock_sms.side_effect = None
+            self.assertTrue(deliver_otp("2", "09120000002", "123456"))
+            self.assertEqual(kavenegar_breaker.state, "closed")
+
+            for _ in range(kavenegar_breaker.failure_threshold):
+                kavenegar_breaker.record_failure()
+            mock_sms.side_effect = RuntimeError("bug")
+            with self.assertRaises(RuntimeError):
+                deliver_otp("1", "09120000001", "123456")
+            mock_sms.side_effect = None
+            self.assertTrue(deliver_otp("2", "09120000002", "123456"))
+        self.assertEqual(mock_sms.call_count, 4)
+
+    @override_settings(KAVEH_NEGAR_API_KEY="SECRETKEY", OTP_SMS_MAX_ATTEMPTS=1)
+    def test_api_key_is_not_logged(self):
+        error = "Max retries exceeded with url: /v1/SECRETKEY/verify/lookup.json"
+        with patch("auth_bot.auth.http_request", side_effect=requests.exceptions.ConnectionError(error)):
+            with self.assertLogs("auth_bot.sms", level="INFO") as logs:
+                self.assertFalse(deliver_otp("1", "09120000001", "123456"))
+        self.assertIn("/v1/***/verify", sms_stats.recent[-1]["error"])
+        self.assertNotIn("SECRETKEY", sms_stats.recent[-1]["error"])
+        self.assertNotIn("SECRETKEY", "\n".join(logs.output))
+        with patch("auth_bot.auth.ahttp_request", side_effect=httpx.ConnectError(error)):
+            with self.assertRaises(HTTPException) as raised:
+                asyncio.run(asend_otp_sms("09120000001", "123456"))
+        self.assertNotIn("SECRETKEY", str(raised.exception))
+
+
+@patch("auth_bot.auth.send_message_to_bale")
+class QueuedOtpTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        kavenegar_breaker.reset()
+
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_user_is_answered_before_the_sms_is_sent(self, mock_sms, mock_send):
+        BaleUser.objects.create(chat_id="5", phone_number="09120000005")
+        handle_phone_number("5", "09120000005")
+        mock_send.assert_called_once_with("5", OTP_QUEUED_MESSAGE)
+        get_sms_dispatcher().join()
+        mock_sms.assert_called_once()
+        self.assertEqual(mock_sms.call_args[0][0], "09120000005")
@@ -0,0 +1,155 @@
+import io
+import json
+import requests
+from unittest.mock import patch, MagicMock
+from django.test import TestCase, override_settings
+from auth_bot.models import BaleUser, ChatSession
+from auth_bot.response_cache import response_cache
+from auth_bot.talkbot import stream_talk_to_bot, StreamingUnavailable
+from auth_bot.views import handle_chat_message
+
+
+def sse_response(*deltas):
+    response = MagicMock()
+    response.ok = True
+    response.headers = {"Content-Type": "text/event-stream"}
+    lines = [
+        ('data: {"choices": [{"delta": {"content": "%s"}}]}' % delta).encode() for delta in deltas
+    ]
+    response.iter_lines.return_value = lines + [b"", b"data: [DONE]"]
+    return response
+
+
+def bale_response(message_id):
+    response = MagicMock()
+    response.ok = True
+    response.json.return_value = {"ok": True, "result": {"message_id": message_id}}
+    return response
+
+
+class StreamTalkToBotTests(TestCase):
+
+    @patch("auth_bot.talkbot.http_request")
+    def test_yields_sse_deltas(self, mock_request):
+        mock_request.return_value = sse_response("Hel", "lo")
+        chunks = list(stream_talk_to_bot(user_messages=[{"role": "user", "content": "Hi"}]))
+        self.assertEqual(chunks, ["Hel", "lo"])
+        self.assertTrue(mock_request.call_args[1]["stream"])
+
+    @patch("auth_bot.talkbot.http_request")
+    def test_plain_json_answer_is_one_chunk(self, mock_request):
+        response = MagicMock()
+        response.ok = True
+        response.headers = {"Content-Type": "application/json"}
+        response.json.return_value = {"choices": [{"message": {"content": "Whole answer"}}]}
+        mock_request.return_value = response
+        chunks = list(stream_talk_to_bot(user_messages=[{"role": "user", "content": "Hi"}]))
+        self.assertEqual(chunks, ["Whole answer"])
+
+    @patch("auth_bot.talkbot.http_request")
+    def test_utf8_event_stream_without_charset(self, mock_request):
+        # "م" is D9 85 in UTF-8; 0x85 is NEL in ISO-8859-1, which str.splitlines breaks on
+        deltas = ["سلام ", "دکتر، ", "مراقب باشید."]
+        body = "".join(
+            "data: %s\n\n" % json.dumps({"choices": [{"delta": {"content": delta}}]}, ensure_ascii=False)
+            for delta in deltas
+        ) + "data: [DONE]\n\n"
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "text/event-stream"
+        response.raw = io.BytesIO(body.encode("utf-8"))
+        mock_request.return_value = response
+        chunks = list(stream_talk_to_bot(user_messages=[{"role": "user", "content": "Hi"}]))
+        self.assertEqual(chunks, deltas)
+
+    @patch("auth_bot.talkbot.http_request")
+    def test_unreadable_json_answer_raises(self, mock_request):
+        response = MagicMock()
+        response.ok = True
+        response.headers = {"Content-Type": "application/json"}
+        response.json.side_effect = ValueError("Expecting value")
+        mock_request.return_value = response
+        with self.assertRaises(StreamingUnavailable):
+            list(stream_talk_to_bot(user_messages=[{"role": "user", "content": "Hi"}]))
+
+    @patch("auth_bot.talkbot.http_request")
+    def test_http_error_raises(self, mock_request):
+        mock_request.return_value.ok = False
+        mock_request.return_value.status_code = 404
+        with self.assertRaises(StreamingUnavailable):
+            list(stream_talk_to_bot(user_messages=[{"role": "user", "content": "Hi"}]))
+
+
+@override_settings(TALKBOT_STREAMING=True, BALE_EDIT_INTERVAL=3600)
+class StreamingChatTests(TestCase):
+
+    def setUp(self):
+        response_cache.clear()
+        self.user = BaleUser.objects.create(
+            chat_id="999",
+            phone_number="0912xxx",
+            is_authenticated=True,
+            assistant_role="psychologist"
+        )
+
+    @patch("auth_bot.views.edit_message_in_bale")
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    @patch("auth_bot.views.stream_talk_to_bot")
+    def test_first_chunk_sent_then_final_edit(self, mock_stream, mock_talk, mock_send, mock_edit):
+        mock_stream.return_value = iter(["Drink ", "water."])
+        mock_send.return_value = bale_response(42)
+
+        handle_chat_message("999", "Headache")
+
+        mock_talk.assert_not_called()
+        mock_send.assert_called_once_with("999", "Drink ", queue=False)
+        # Throttled: no intermediate edit, only the final one with the footer
+        mock_edit.assert_called_once()
+        chat_id, message_id, text = mock_edit.call_args[0]
+        self.assertEqual(message_id, 42)
+        self.assertTrue(text.startswith("Drink water."))
+        session = ChatSession.objects.get(user=self.user, is_active=True)
+        self.assertEqual(session.bot_response, "Drink water.")
+
+    @override_settings(BALE_EDIT_INTERVAL=0)
+    @patch("auth_bot.views.edit_message_in_bale")
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.stream_talk_to_bot")
+    def test_edits_as_tokens_arrive(self, mock_stream, mock_send, mock_edit):
+        mock_stream.return_value = iter(["a", "b", "c"])
+        mock_send.return_value = bale_response(7)
+        handle_chat_message("999", "Headache")
+        edited = [call[0][2] for call in mock_edit.call_args_list]
+        self.assertEqual(edited[:2], ["ab", "abc"])
+
+    @patch("auth_bot.views.edit_message_in_bale")
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    @patch("auth_bot.views.stream_talk_to_bot")
+    def test_unsent_first_chunk_gives_one_answer(self, mock_stream, mock_talk, mock_send, mock_edit):
+        mock_stream.return_value = iter(["Drink ", "water."])
+        # Rate limited: the first chunk is not sent (and not queued either)
+        mock_send.side_effect = [None, bale_response(43)]
+
+        handle_chat_message("999", "Headache")
+
+        mock_talk.assert_not_called()
+        mock_edit.assert_not_called()
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertEqual(mock_send.call_args_list[0][1], {"queue": False})
+        self.assertTrue(mock_send.call_args[0][1].startswith("Drink water."))
+
+    @patch("auth_bot.views.edit_message_in_bale")
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    @patch("auth_bot.views.stream_talk_to_bot")
+    def test_falls_back_to_one_shot(self, mock_stream, mock_talk, mock_send, mock_edit):
+        mock_stream.side_effect = StreamingUnavailable("404 - not found")
+        mock_talk.return_value = {"choices": [{"message": {"content": "One shot"}}]}
+
+        handle_chat_message("999", "Headache")
+
+        mock_talk.assert_called_once()
+        mock_edit.assert_not_called()
+        self.assertTrue(mock_send.call_args[0][1].startswith("One shot"))
@@ -0,0 +1,87 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from auth_bot.models import BaleUser, ChatSession, ChatTurn
+from auth_bot.summary import summarise_session, maybe_schedule_summary, summary_stats
+from auth_bot.views import build_chat_request
+
+
+@override_settings(CHAT_SUMMARY_EVERY=4, CHAT_SUMMARY_KEEP_TURNS=2)
+class RollingSummaryTests(TestCase):
+
+    def setUp(self):
+        self.user = BaleUser.objects.create(
+            chat_id="555",
+            phone_number="09125555555",
+            is_authenticated=True,
+            assistant_role="general_physician",
+        )
+        self.session = ChatSession.objects.create(user=self.user, is_active=True)
+        self.start = now() - timedelta(hours=1)
+
+    def add_turns(self, count, offset=0):
+        for i in range(offset, offset + count):
+            ChatTurn.objects.create(
+                user=self.user,
+                session=self.session,
+                user_message=f"سوال {i}",
+                bot_response="پاسخ مفصل درباره سردرد و استراحت " * 10,
+                created_at=self.start + timedelta(minutes=i),
+            )
+
+    @patch("auth_bot.summary.talk_to_bot")
+    def test_not_enough_turns(self, mock_talk):
+        self.add_turns(5)
+        self.assertFalse(summarise_session(self.session.pk))
+        mock_talk.assert_not_called()
+
+    @patch("auth_bot.summary.talk_to_bot")
+    def test_folds_all_but_newest_turns(self, mock_talk):
+        mock_talk.return_value = {"choices": [{"message": {"content": "سردرد؛ استراحت توصیه شد."}}]}
+        self.add_turns(6)
+        jobs = summary_stats.as_dict()["jobs"]
+
+        self.assertTrue(summarise_session(self.session.pk))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "سردرد؛ استراحت توصیه شد.")
+        self.assertEqual(self.session.summarized_turns, 4)
+        self.assertEqual(self.session.summary_until, self.start + timedelta(minutes=3))
+        self.assertGreater(self.session.summary_compression_ratio(), 10)
+        self.assertEqual(summary_stats.as_dict()["jobs"], jobs + 1)
+        prompt = mock_talk.call_args[1]["user_messages"][0]["content"]
+        self.assertIn("سوال 3", prompt)
+        self.assertNotIn("سوال 4", prompt)
+
+    @patch("auth_bot.summary.talk_to_bot")
+    def test_failed_summary_keeps_history(self, mock_talk):
+        mock_talk.return_value = {"error": "HTTP 500 - down"}
+        self.add_turns(6)
+        with self.assertLogs("auth_bot.summary", level="WARNING"):
+            self.assertFalse(summarise_session(self.session.pk))
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "")
+        self.assertIsNone(self.session.summary_until)
+
+    def test_request_uses_summary_and_unsummarized_turns(self):
+        self.add_turns(6)
+        self.session.summary = "خلاصه: سردرد"
+        self.session.summary_until = self.start + timedelta(minutes=3)
+        self.session.save()
+
+        chat_request, rejection = build_chat_request("555", "سوال جدید")
+
+        self.assertIsNone(rejection)
+        kwargs = chat_request.bot_kwargs
+        self.assertIn("خلاصه: سردرد", kwargs["system_role_description"])
+        questions = [message["content"] for message in kwargs["user_messages"]]
+        self.assertEqual(questions, ["سوال 4", "سوال 5", "سوال جدید"])
+
+    @patch("auth_bot.summary.schedule_summary")
+    def test_scheduled_once_enough_turns_pile_up(self, mock_schedule):
+        self.add_turns(5)
+        self.assertFalse(maybe_schedule_summary(self.session))
+        self.add_turns(1, offset=5)
+        maybe_schedule_summary(self.session)
+        mock_schedule.assert_called_once_with(self.session.pk)
@@ -1,11 +1,15 @@
 import json
+import requests
 from unittest.mock import patch, MagicMock
 from django.test import TestCase
-from auth_bot.talkbot import talk_to_bot
+from auth_bot.talkbot import talk_to_bot, reset_talkbot_resilience
 
 class TalkbotTests(TestCase):
 
-    @patch("auth_bale.talkbot.requests.post")
+    def setUp(self):
+        reset_talkbot_resilience()
+
+    @patch("auth_bot.talkbot.http_request")
     def test_talk_to_bot_success(self, mock_post):
         # Mock a successful response
         mock_post.return_value.ok = True
@@ -30,7 +34,7 @@ class TalkbotTests(TestCase):
         self.assertEqual(response["choices"][0]["message"]["content"], "Test response")
         self.assertTrue(mock_post.called)
 
-    @patch("auth_bale.talkbot.requests.post")
+    @patch("auth_bot.talkbot.http_request")
     def test_talk_to_bot_error(self, mock_post):
         # Mock an error response
         mock_post.return_value.ok = False
@@ -44,10 +48,10 @@ class TalkbotTests(TestCase):
         self.assertIn("400", response["error"])
         self.assertTrue(mock_post.called)
 
-    @patch("auth_bale.talkbot.requests.post")
+    @patch("auth_bot.talkbot.http_request")
     def test_talk_to_bot_request_exception(self, mock_post):
         # Mock an exception in requests
-        mock_post.side_effect = Exception("Connection error")
+        mock_post.side_effect = requests.exceptions.ConnectionError("Connection error")
 
         response = talk_to_bot(
             user_messages=[{"role": "user", "content": "Hello"}]
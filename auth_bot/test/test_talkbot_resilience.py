@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+import requests
+from django.test import SimpleTestCase, TestCase, override_settings
+from auth_bot.resilience import AdaptiveLimiter
+from auth_bot.talkbot import (
+    OVERLOADED_ERROR,
+    atalk_to_bot,
+    get_async_limiter,
+    get_breaker,
+    get_limiter,
+    reset_talkbot_resilience,
+    talk_to_bot,
+    talkbot_upstreams,
+)
+
+PRIMARY = "https://api.talkbot.ir/v1/chat/completions"
+
+
+def reply(status, content="ok"):
+    response = MagicMock()
+    response.ok = status < 400
+    response.status_code = status
+    response.text = "error"
+    response.json.return_value = {"choices": [{"message": {"content": content}}]}
+    return response
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter("test", initial=4, max_limit=8, latency_target=1.0, cooldown=0)
+        for _ in range(8):
+            self.assertTrue(limiter.acquire())
+            limiter.release(0.1)
+        self.assertEqual(limiter.limit, 5)
+        limiter.acquire()
+        limiter.release(0.1, overloaded=True)
+        self.assertEqual(limiter.limit, 2)
+        limiter.acquire()
+        limiter.release(5.0)  # slower than the target
+        self.assertEqual(limiter.limit, 1)
+
+    def test_callers_over_the_limit_are_turned_away(self):
+        limiter = AdaptiveLimiter("test", initial=1)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire(timeout=0.01))
+        threading.Timer(0.05, limiter.release).start()
+        self.assertTrue(limiter.acquire(timeout=2))
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+
+@override_settings(
+    TALKBOT_API_URL=PRIMARY,
+    TALKBOT_FALLBACKS=["gpt-4o", "small@https://backup.example/v1/chat/completions"],
+    TALKBOT_BREAKER_FAILURES=2,
+    TALKBOT_QUEUE_TIMEOUT=0,
+)
+@patch("auth_bot.talkbot.http_request")
+class TalkbotResilienceTests(TestCase):
+
+    def setUp(self):
+        reset_talkbot_resilience()
+
+    def tearDown(self):
+        reset_talkbot_resilience()
+
+    def call(self):
+        return talk_to_bot([{"role": "user", "content": "hi"}], model="gpt-4o-mini")
+
+    def test_upstream_order(self, mock_post):
+        self.assertEqual(talkbot_upstreams("gpt-4o-mini"), [
+            (PRIMARY, "gpt-4o-mini"),
+            (PRIMARY, "gpt-4o"),
+            ("https://backup.example/v1/chat/completions", "small"),
+        ])
+
+    def test_overloaded_model_falls_back(self, mock_post):
+        mock_post.side_effect = [reply(503), reply(200, "from fallback")]
+        result = self.call()
+        self.assertEqual(result["choices"][0]["message"]["content"], "from fallback")
+        self.assertEqual(json_model(mock_post.call_args_list[1]), "gpt-4o")
+
+    def test_client_errors_do_not_fall_back(self, mock_post):
+        mock_post.return_value = reply(400)
+        self.assertIn("400", self.call()["error"])
+        self.assertEqual(mock_post.call_count, 1)
+
+    def test_open_breaker_skips_the_model(self, mock_post):
+        def post(method, url, **kwargs):
+            if json.loads(kwargs["data"])["model"] == "gpt-4o-mini":
+                raise requests.exceptions.ConnectTimeout("down")
+            return reply(200)
+
+        mock_post.side_effect = post
+        self.call()
+        self.call()
+        self.assertEqual(get_breaker(PRIMARY, "gpt-4o-mini").state, "open")
+        mock_post.reset_mock()
+        self.call()
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(json_model(mock_post.call_args), "gpt-4o")
+
+    def test_saturated_endpoint_fails_fast(self, mock_post):
+        limiter = get_limiter(PRIMARY)
+        backup = get_limiter("https://backup.example/v1/chat/completions")
+        for _ in range(limiter.limit):
+            limiter.acquire()
+        for _ in range(backup.limit):
+            backup.acquire()
+        self.assertEqual(self.call(), {"error": OVERLOADED_ERROR})
+        mock_post.assert_not_called()
+
+
+@override_settings(TALKBOT_ASYNC_CONCURRENCY=30)
+class AsyncLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_talkbot_resilience()
+
+    def tearDown(self):
+        reset_talkbot_resilience()
+
+    def test_async_path_has_its_own_limit(self):
+        limiter = get_limiter(PRIMARY)
+        for _ in range(limiter.limit):
+            limiter.acquire()
+        answer = MagicMock(is_success=True)
+        answer.json.return_value = {"choices": [{"message": {"content": "ok"}}]}
+        with patch("auth_bot.talkbot.ahttp_request", AsyncMock(return_value=answer)):
+            result = asyncio.run(atalk_to_bot([{"role": "user", "content": "hi"}]))
+        # The saturated sync limit does not apply to the event loop's calls
+        self.assertEqual(result["choices"][0]["message"]["content"], "ok")
+        self.assertEqual(get_async_limiter(PRIMARY).limit, 30)
+        self.assertGreater(get_async_limiter(PRIMARY).limit, limiter.limit)
+
+
+def json_model(call):
+    return json.loads(call[1]["data"])["model"]
@@ -0,0 +1,122 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from auth_bot.checks import check_shared_state
+from auth_bot.models import BaleUser
+from auth_bot.user_cache import LocalLRUBackend, SharedCacheBackend, user_cache, get_cached_user
+
+
+class LocalLRUBackendTests(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        backend = LocalLRUBackend(maxsize=2, ttl=60)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+        self.assertEqual(backend.get("a"), 1)
+        self.assertIsNone(backend.get("b"))
+
+    def test_expired_entries_are_dropped(self):
+        backend = LocalLRUBackend(maxsize=2, ttl=-1)
+        backend.set("a", 1)
+        self.assertIsNone(backend.get("a"))
+
+
+class SharedCacheBackendTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_clear_only_drops_its_own_entries(self):
+        backend = SharedCacheBackend(ttl=60)
+        other_process = SharedCacheBackend(ttl=60, generation_refresh=0)
+        backend.set("a", 1)
+        cache.set("chat-lease:a", "token")
+        self.assertEqual(other_process.get("a"), 1)
+
+        backend.clear()
+        self.assertIsNone(backend.get("a"))
+        self.assertIsNone(other_process.get("a"))
+        self.assertEqual(cache.get("chat-lease:a"), "token")
+        backend.set("a", 2)
+        backend.clear()
+        self.assertIsNone(other_process.get("a"))
+
+
+class SharedStateCheckTests(SimpleTestCase):
+
+    def ids(self):
+        return [warning.id for warning in check_shared_state(None)]
+
+    def test_local_user_cache_with_several_workers(self):
+        self.assertEqual(self.ids(), [])
+        with override_settings(WEB_CONCURRENCY=4):
+            self.assertIn("auth_bot.W001", self.ids())
+            with override_settings(USER_CACHE_BACKEND="shared", CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://x"},
+            }):
+                self.assertNotIn("auth_bot.W001", self.ids())
+
+
+class UserStateCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = BaleUser.objects.create(
+            chat_id="123",
+            phone_number="09123456789",
+            is_authenticated=True,
+        )
+
+    def tearDown(self):
+        user_cache.clear()
+
+    def test_hit_skips_database(self):
+        user_cache.invalidate("123")
+        get_cached_user("123")
+        with self.assertNumQueries(0):
+            cached = get_cached_user("123")
+        self.assertEqual(cached.pk, self.user.pk)
+        self.assertTrue(cached.is_authenticated)
+
+    def test_save_writes_through(self):
+        get_cached_user("123")
+        self.user.assistant_role = "cardiologist"
+        self.user.save(update_fields=["assistant_role"])
+        with self.assertNumQueries(0):
+            cached = get_cached_user("123")
+        self.assertEqual(cached.assistant_role, "cardiologist")
+
+    def test_partial_save_of_a_stale_instance_caches_the_row(self):
+        stale = get_cached_user("123")
+        # Logged out by another worker meanwhile (no signal reaches this one)
+        BaleUser.objects.filter(pk=self.user.pk).update(is_authenticated=False)
+        stale.assistant_role = "cardiologist"
+        stale.save(update_fields=["assistant_role"])
+        with self.assertNumQueries(0):
+            cached = get_cached_user("123")
+        self.assertFalse(cached.is_authenticated)
+        self.assertEqual(cached.assistant_role, "cardiologist")
+
+    def test_delete_invalidates(self):
+        get_cached_user("123")
+        self.user.delete()
+        self.assertIsNone(get_cached_user("123"))
+
+    def test_hit_and_miss_metrics(self):
+        user_cache.invalidate("123")
+        before = user_cache.stats()
+        get_cached_user("123")
+        get_cached_user("123")
+        after = user_cache.stats()
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+
+class UncommittedStateTests(TestCase):
+
+    def test_rows_read_inside_a_transaction_are_not_cached(self):
+        user_cache.clear()
+        BaleUser.objects.create(chat_id="456", phone_number="09120000000")
+        get_cached_user("456")
+        self.assertIsNone(user_cache.backend.get("456"))
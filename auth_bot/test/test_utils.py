@@ -1,17 +1,34 @@
+import asyncio
 from unittest.mock import patch
-from django.test import TestCase
-from auth_bot.utils import send_message_to_bale
+import httpx
+import requests
+from django.test import TestCase, override_settings
+from auth_bot.utils import _acall_bale, _call_bale, send_message_to_bale
 
 class UtilsTests(TestCase):
 
-    @patch("auth_bale.utils.requests.post")
+    @patch("auth_bot.utils.http_request")
     def test_send_message_to_bale(self, mock_post):
         chat_id = "12345"
         text = "Hello from test"
 
         send_message_to_bale(chat_id, text)
-        # Check if requests.post was called with the correct URL and payload
+        # Check if the pooled client was called with the correct URL and payload
         mock_post.assert_called_once()
         args, kwargs = mock_post.call_args
         self.assertIn("json", kwargs)
         self.assertEqual(kwargs["json"], {"chat_id": chat_id, "text": text})
+
+    @override_settings(BALE_BOT_TOKEN="123:SECRET")
+    def test_bot_token_is_not_logged(self):
+        error = "HTTPSConnectionPool(host='tapi.bale.ai'): Max retries exceeded with url: /bot123:SECRET/sendMessage"
+        with patch("auth_bot.utils.http_request", side_effect=requests.exceptions.ConnectionError(error)):
+            with self.assertLogs("auth_bot.utils", level="WARNING") as logs:
+                self.assertIsNone(_call_bale("sendMessage", {"chat_id": "1"}))
+        with patch("auth_bot.utils.ahttp_request", side_effect=httpx.ConnectError(error)):
+            with self.assertLogs("auth_bot.utils", level="WARNING") as async_logs:
+                self.assertIsNone(asyncio.run(_acall_bale("sendMessage", {"chat_id": "1"})))
+        output = "\n".join(logs.output + async_logs.output)
+        self.assertNotIn("SECRET", output)
+        self.assertIn("ConnectionError: ", output)
+        self.assertIn("/bot***/sendMessage", output)
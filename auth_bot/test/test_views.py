@@ -1,11 +1,17 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from rest_framework.test import APIClient
-from auth_bot.models import BaleUser, ChatSession
+from unittest.mock import patch
+from auth_bot.models import BaleUser, ChatSession, ChatTurn
+from auth_bot.otp_store import otp_store
+from auth_bot.response_cache import response_cache
 from django.urls import reverse
 
 class ViewsTests(TestCase):
 
     def setUp(self):
+        cache.clear()
+        response_cache.clear()
         self.client = APIClient()
         self.url = reverse("bale_webhook")  # points to bale_webhook_view
 
@@ -33,7 +39,9 @@ class ViewsTests(TestCase):
         user = BaleUser.objects.get(chat_id="111")
         self.assertFalse(user.is_authenticated)
 
-    def test_phone_number_input(self):
+    @override_settings(OTP_SMS_MODE="sync")
+    @patch("auth_bot.auth.send_otp_sms")
+    def test_phone_number_input(self, mock_sms):
         BaleUser.objects.create(chat_id="222", is_authenticated=False)
         data = {
             "message": {
@@ -45,16 +53,17 @@ class ViewsTests(TestCase):
         self.assertEqual(response.status_code, 200)
         user = BaleUser.objects.get(chat_id="222")
         self.assertEqual(user.phone_number, "09123456789")
-        self.assertTrue(len(user.otp) == 6)
+        self.assertEqual(user.dialog_state, "awaiting_otp")
+        mock_sms.assert_called_once()
 
     def test_otp_input(self):
         # Prepare user with known OTP
         BaleUser.objects.create(
             chat_id="333",
             phone_number="0912000",
-            otp="123456",
             is_authenticated=False
         )
+        otp_store.issue("333", "123456")
         data = {
             "message": {
                 "chat": {"id": "333"},
@@ -65,7 +74,6 @@ class ViewsTests(TestCase):
         self.assertEqual(response.status_code, 200)
         user = BaleUser.objects.get(chat_id="333")
         self.assertTrue(user.is_authenticated)
-        self.assertEqual(user.otp, "")
 
     def test_logout_command(self):
         BaleUser.objects.create(chat_id="444", is_authenticated=True)
@@ -151,7 +159,7 @@ class ViewsTests(TestCase):
                 "text": "Hello doctor."
             }
         }
-        with self.assertNumQueries(6):  # or so, depends on your DB hits
+        with self.assertNumQueries(9):  # first message: opens the session and stores the first turn
             response = self.client.post(self.url, data, format="json")
         self.assertEqual(response.status_code, 200)
         # Check if ChatSession is created/updated
@@ -159,6 +167,27 @@ class ViewsTests(TestCase):
         self.assertIsNotNone(session)
         self.assertIn("Hello doctor.", session.user_message)
 
+    @patch("auth_bot.views.send_message_to_bale")
+    @patch("auth_bot.views.talk_to_bot")
+    def test_chat_turns_are_kept_as_history(self, mock_talk, mock_send):
+        user = BaleUser.objects.create(
+            chat_id="1001",
+            phone_number="0912yyy",
+            is_authenticated=True,
+            assistant_role="psychologist"
+        )
+        mock_talk.return_value = {"choices": [{"message": {"content": "Answer"}}]}
+        for text in ("First question", "Second question"):
+            data = {"message": {"chat": {"id": "1001"}, "text": text}}
+            self.client.post(self.url, data, format="json")
+
+        self.assertEqual(ChatSession.objects.filter(user=user).count(), 1)
+        self.assertEqual(ChatTurn.objects.filter(user=user).count(), 2)
+        # The second call carried the first exchange as memory
+        history = mock_talk.call_args[1]["user_messages"]
+        self.assertEqual(history[0]["content"], "First question")
+        self.assertEqual(history[-1]["content"], "Second question")
+
     def test_end_chat(self):
         user = BaleUser.objects.create(
             chat_id="1010",
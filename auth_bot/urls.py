@@ -1,6 +1,15 @@
 from django.urls import path
-from .views import bale_webhook_view
+from .views import bale_webhook_view, bale_webhook_async_view, fast_webhook_view, metrics_view
 
 urlpatterns = [
+    # With BALE_WEBHOOK_SECRET set, each webhook needs the secret (header or <token>)
     path('bale-webhook/', bale_webhook_view, name='bale_webhook'),
+    path('bale-webhook/<str:token>/', bale_webhook_view, name='bale_webhook_token'),
+    path('bale-webhook-async/', bale_webhook_async_view, name='bale_webhook_async'),
+    path('bale-webhook-async/<str:token>/', bale_webhook_async_view, name='bale_webhook_async_token'),
+    # Normally answered by fastpath.WebhookFastPathMiddleware before URL resolving
+    path('bale-webhook-fast/', fast_webhook_view, name='bale_webhook_fast'),
+    path('bale-webhook-fast/<str:token>/', fast_webhook_view, name='bale_webhook_fast_token'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
+
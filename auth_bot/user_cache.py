@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import BaleUser
+
+
+class LocalLRUBackend:
+    """
+    Per-process LRU with a TTL; the default, needs no extra infrastructure.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SharedCacheBackend:
+    """
+    Backend on top of a Django cache alias (e.g. django.core.cache.backends.redis.RedisCache),
+    shared by every worker process so invalidations are seen everywhere.
+
+    The alias also holds OTPs, dedup markers and chat leases, so clear()
+    does not flush it: keys carry a generation number kept in the cache,
+    and clear() bumps it. Entries of older generations are never read
+    again and age out with their TTL. Other processes re-read the
+    generation at most generation_refresh seconds later.
+    """
+
+    def __init__(self, alias="default", ttl=300, prefix="baleuser:", generation_refresh=1.0):
+        self.alias = alias
+        self.ttl = ttl
+        self.prefix = prefix
+        self.generation_refresh = generation_refresh
+        self._generation = None
+        self._generation_read = 0.0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, key):
+        now = time.monotonic()
+        if self._generation is None or now - self._generation_read >= self.generation_refresh:
+            self._generation = self.cache.get(self.prefix + "generation", 0)
+            self._generation_read = now
+        return f"{self.prefix}{self._generation}:{key}"
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value):
+        self.cache.set(self._key(key), value, self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(self._key(key))
+
+    def clear(self):
+        """
+        Drop every entry under this prefix, and nothing else in the alias.
+        """
+        try:
+            self._generation = self.cache.incr(self.prefix + "generation")
+        except ValueError:
+            # First clear: no generation stored yet
+            self.cache.set(self.prefix + "generation", 1, None)
+            self._generation = 1
+        self._generation_read = time.monotonic()
+
+
+class UserStateCache:
+    """
+    Read-through cache of BaleUser rows keyed by chat_id.
+
+    Entries are compact dicts of the concrete field values, rebuilt into
+    BaleUser instances on a hit. Saving or deleting a user drops its entry
+    immediately and, once the transaction commits, caches the row read back
+    from the database. Rows read inside an open transaction are never cached, so a
+    rollback cannot leave uncommitted state behind.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._field_names = [f.attname for f in BaleUser._meta.concrete_fields]
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "invalidations": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def snapshot(self, user):
+        return {name: getattr(user, name) for name in self._field_names}
+
+    def get(self, chat_id):
+        """
+        Return the BaleUser for chat_id (None if there is no such user).
+        """
+        chat_id = str(chat_id)
+        data = self.backend.get(chat_id)
+        if data is not None:
+            self._count("hits")
+            return BaleUser.from_db(None, self._field_names, [data[name] for name in self._field_names])
+
+        self._count("misses")
+        user = BaleUser.objects.filter(chat_id=chat_id).first()
+        if user is not None and not transaction.get_connection().in_atomic_block:
+            self.store(user)
+        return user
+
+    def store(self, user):
+        self.put(user.chat_id, self.snapshot(user))
+
+    def put(self, chat_id, state):
+        self.backend.set(str(chat_id), state)
+        self._count("writes")
+
+    def invalidate(self, chat_id):
+        self.backend.delete(str(chat_id))
+        self._count("invalidations")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / lookups, 3) if lookups else 0.0
+        return data
+
+
+def _build_cache():
+    ttl = getattr(settings, 'USER_CACHE_TTL', 300)
+    if getattr(settings, 'USER_CACHE_BACKEND', 'local') == 'shared':
+        backend = SharedCacheBackend(alias=getattr(settings, 'USER_CACHE_ALIAS', 'default'), ttl=ttl)
+    else:
+        backend = LocalLRUBackend(maxsize=getattr(settings, 'USER_CACHE_SIZE', 10000), ttl=ttl)
+    return UserStateCache(backend)
+
+
+user_cache = _build_cache()
+
+
+def get_cached_user(chat_id):
+    """
+    Shortcut for user_cache.get(chat_id); used by the handlers instead of
+    BaleUser.objects.filter(chat_id=...).first().
+    """
+    if not getattr(settings, 'USER_CACHE_ENABLED', True):
+        return BaleUser.objects.filter(chat_id=chat_id).first()
+    return user_cache.get(chat_id)
+
+
+def write_through(user):
+    """
+    Drop the cached entry now and cache the row as stored once committed.
+    Call this after changing a user with QuerySet.update(), which sends no signals.
+
+    The row is read back instead of caching the instance: after
+    save(update_fields=...) or QuerySet.update() its other attributes can
+    be older than the row, e.g. an instance served by the cache before a
+    /logout committed elsewhere.
+    """
+    chat_id, pk = user.chat_id, user.pk
+    user_cache.invalidate(chat_id)
+    transaction.on_commit(lambda: _reload(chat_id, pk))
+
+
+def _reload(chat_id, pk):
+    user = BaleUser.objects.filter(pk=pk).first()
+    if user is None:
+        user_cache.invalidate(chat_id)
+    else:
+        user_cache.store(user)
+
+
+@receiver(post_save, sender=BaleUser)
+def _write_through(sender, instance, **kwargs):
+    write_through(instance)
+
+
+@receiver(post_delete, sender=BaleUser)
+def _drop_deleted(sender, instance, **kwargs):
+    user_cache.invalidate(instance.chat_id)
@@ -1,14 +1,125 @@
+import logging
+
+import httpx
 import requests
 from django.conf import settings
 
-def send_message_to_bale(chat_id, text):
+from .http_client import http_request, ahttp_request, redact
+from .metrics import span
+from .outbox import SENT, get_scheduler, split_message
+
+logger = logging.getLogger(__name__)
+
+
+def _bale_method_url(method):
+    base_url = getattr(settings, 'BALE_API_BASE_URL', 'https://tapi.bale.ai')
+    return f"{base_url}/bot{settings.BALE_BOT_TOKEN}/{method}"
+
+
+def _call_bale(method, payload):
+    """
+    POST one Bot API call; returns the HTTP response, or None if Bale could not be reached.
+    """
+    try:
+        return http_request("POST", _bale_method_url(method), json=payload)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Could not call Bale %s for chat %s: %s: %s",
+                       method, payload.get("chat_id"), type(e).__name__, redact(e))
+        return None
+
+
+def send_message_to_bale(chat_id, text, queue=True):
     """
     Helper function to send a message to a user in Bale messenger.
+
+    Goes through the outbound scheduler (outbox.py), which applies the global
+    and per-chat rate limits and retries 429 replies. Texts longer than Bale's
+    limit are sent as several messages, in order. Returns the HTTP response
+    of the first part, or None if Bale could not be reached or the message
+    was queued to be sent later. With queue=False nothing is queued: a
+    message that cannot be sent now is not sent at all.
+    """
+    scheduler = get_scheduler(_call_bale)
+    with span("send"):
+        first, *rest = split_message(text)
+        delivery = scheduler.deliver("sendMessage", chat_id, {"chat_id": chat_id, "text": first}, queue=queue)
+        if queue or delivery.status == SENT:
+            for part in rest:
+                scheduler.deliver("sendMessage", chat_id, {"chat_id": chat_id, "text": part})
+    return delivery.response
+
+
+def get_updates_from_bale(offset=None, limit=100, timeout=30):
+    """
+    Long-poll Bale's getUpdates and return the list of updates.
+    Raises requests.exceptions.RequestException (or ValueError for a bad reply),
+    so the polling loop can back off.
+    """
+    params = {"limit": limit, "timeout": timeout}
+    if offset:
+        params["offset"] = offset
+    response = http_request(
+        "GET", _bale_method_url("getUpdates"), params=params,
+        read_timeout=timeout + getattr(settings, 'HTTP_READ_TIMEOUT', 10.0)
+    )
+    response.raise_for_status()
+    data = response.json()
+    if not data.get("ok", False):
+        raise ValueError(f"getUpdates failed: {data.get('description', data)}")
+    return data.get("result", [])
+
+
+def edit_message_in_bale(chat_id, message_id, text, final=True):
+    """
+    Replace the text of a message the bot sent earlier (Bale's editMessageText).
+    If the new text is longer than Bale allows, the message keeps the first
+    part; on the final edit the rest follows as new messages (intermediate
+    edits of a streamed answer only update the first part).
+    Returns the HTTP response, or None if Bale could not be reached.
+    """
+    scheduler = get_scheduler(_call_bale)
+    first, *rest = split_message(text)
+    with span("send"):
+        delivery = scheduler.deliver(
+            "editMessageText", chat_id, {"chat_id": chat_id, "message_id": message_id, "text": first}
+        )
+        if final:
+            for part in rest:
+                scheduler.deliver("sendMessage", chat_id, {"chat_id": chat_id, "text": part})
+    return delivery.response
+
+
+def bale_message_id(response):
+    """
+    Extract the message_id from a sendMessage response (None if unavailable).
+    """
+    if response is None or not response.ok:
+        return None
+    try:
+        return response.json().get("result", {}).get("message_id")
+    except ValueError:
+        return None
+
+
+async def _acall_bale(method, payload):
+    try:
+        return await ahttp_request("POST", _bale_method_url(method), json=payload)
+    except httpx.HTTPError as e:
+        logger.warning("Could not call Bale %s for chat %s: %s: %s",
+                       method, payload.get("chat_id"), type(e).__name__, redact(e))
+        return None
+
+
+async def asend_message_to_bale(chat_id, text):
+    """
+    Async counterpart of send_message_to_bale using the shared async HTTP client.
     """
-    bot_token = settings.BALE_BOT_TOKEN
-    url = f"https://tapi.bale.ai/bot{bot_token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": text
-    }
-    requests.post(url, json=payload)
+    scheduler = get_scheduler(_call_bale)
+    first = None
+    with span("send"):
+        for part in split_message(text):
+            delivery = await scheduler.adeliver(
+                "sendMessage", chat_id, {"chat_id": chat_id, "text": part}, _acall_bale
+            )
+            first = first or delivery
+    return first.response
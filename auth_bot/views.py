@@ -1,72 +1,285 @@
+import hmac
+import logging
+import time
+from collections import namedtuple
+
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
-from .models import BaleUser, ChatSession
-from .talkbot import talk_to_bot
-from . import auth
-from .utils import send_message_to_bale
+from .models import BaleUser, ChatSession, ChatTurn
+from .talkbot import talk_to_bot, atalk_to_bot, stream_talk_to_bot, StreamingUnavailable
+from . import auth, fastpath, quota
+from .utils import send_message_to_bale, asend_message_to_bale, edit_message_in_bale, bale_message_id
+from .context import build_context
+from .response_cache import cache_key_for, response_cache
+from .summary import maybe_schedule_summary
+from .dedup import update_dedup
+from .journal import get_turn_journal
+from .dispatcher import get_chat_lease, get_dispatcher, update_chat_key
+from .metrics import label_update, render_metrics, span, trace_update
+from .recorder import record_update
+from .router import route
+from .user_cache import get_cached_user
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_authorized(request, token=""):
+    """
+    With BALE_WEBHOOK_SECRET set, every webhook route requires the secret,
+    either as the last path segment (…/bale-webhook/<secret>/) or in the
+    X-Telegram-Bot-Api-Secret-Token header (setWebhook's secret_token).
+    """
+    secret = getattr(settings, 'BALE_WEBHOOK_SECRET', '')
+    if not secret:
+        return True
+    supplied = token or request.META.get("HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN", "")
+    return hmac.compare_digest(supplied.encode(), secret.encode())
+
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
-def bale_webhook_view(request):
+def bale_webhook_view(request, token=""):
     """
     Main Bale bot webhook to handle all incoming messages.
+
+    In "queue" mode (settings.BALE_WEBHOOK_MODE) the update is only handed to
+    the background dispatcher and acknowledged right away, so slow TalkBot or
+    Kavenegar calls never hold the request open. When the dispatch queue is
+    full we answer 503 and let Bale redeliver the update later.
+
+    Redeliveries of an update_id that was already accepted are acknowledged
+    without running any handler (see dedup.py).
     """
-    update_json = request.data
+    if not webhook_authorized(request, token):
+        return Response(status=403)
+    with trace_update():
+        with span("parse"):
+            update_json = request.data
+        with record_update(update_json):
+            return Response(status=accept_update(update_json))
 
-    if "message" in update_json:
-        message = update_json["message"]
-        chat_id = str(message["chat"]["id"])
-        text = message.get("text", "").strip()
 
-        # 1) /start command
-        if text.lower() == "/start":
-            return handle_start(chat_id)
+def fast_webhook_view(request, token=""):
+    """
+    Lean variant of bale_webhook_view without DRF. Normally answered by
+    fastpath.WebhookFastPathMiddleware before any other middleware runs.
+    Checks BALE_WEBHOOK_SECRET like the other webhooks (webhook_authorized).
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if not webhook_authorized(request, token):
+        return HttpResponse(status=403)
+    with trace_update():
+        try:
+            with span("parse"):
+                update_json = fastpath.loads(request.body or b"{}")
+        except ValueError:
+            return HttpResponse(status=400)
+        if not isinstance(update_json, dict):
+            return HttpResponse(status=400)
+        with record_update(update_json):
+            return HttpResponse(status=accept_update(update_json))
+
+# Bale posts without a CSRF token (only matters when the middleware is not installed)
+fast_webhook_view.csrf_exempt = True
+
+
+def accept_update(update_json):
+    """
+    Take one parsed update from a webhook and return the HTTP status to answer.
+    """
+    update_id = update_json.get("update_id")
+    if update_id is not None and not update_dedup.begin(update_id):
+        return 200
+
+    if getattr(settings, 'BALE_WEBHOOK_MODE', 'sync') == 'queue':
+        # The worker traces the handling itself; this trace is only the hand-off
+        label_update(command="queued")
+        if "message" not in update_json:
+            finish_update(update_id, None)
+            return 200
+        if not get_dispatcher().submit(update_json):
+            if update_id is not None:
+                update_dedup.release(update_id)
+            return 503
+        finish_update(update_id, None)
+        return 200
+
+    return run_claimed_update(update_id, update_json).status_code
+
+
+def process_update_once(update_json):
+    """
+    process_update for updates that may be delivered more than once (webhook
+    retries, a poller restarted before saving its offset). Returns None for
+    an update_id that was already handled.
+    """
+    update_id = update_json.get("update_id")
+    if update_id is not None and not update_dedup.begin(update_id):
+        return None
+    return run_claimed_update(update_id, update_json)
 
-        # 2) /login command
-        elif text.lower() == "/login":
-            auth.handle_login_command(chat_id)
-            return Response(status=200)
 
-        # 3) If the user enters something like 09xxxxxxxxx (phone number)
-        elif text.isdigit() and len(text) == 11 and text.startswith("09"):
-            auth.handle_phone_number(chat_id, text)
-            return Response(status=200)
+def run_claimed_update(update_id, update_json):
+    # With CHAT_LEASE_ENABLED, other nodes wait while this one handles the chat
+    lease = get_chat_lease()
+    key = update_chat_key(update_json) if lease else None
+    token = lease.acquire(key) if lease else None
+    try:
+        response = process_update(update_json)
+    except Exception:
+        if update_id is not None:
+            update_dedup.release(update_id)
+        raise
+    finally:
+        if lease:
+            lease.release(key, token)
+    return finish_update(update_id, response)
+
+
+def finish_update(update_id, response):
+    """
+    Mark update_id as handled once its response is ready, and return the response.
+    """
+    if update_id is not None:
+        update_dedup.finish(update_id)
+    return response
 
-        # 4) If the user enters a 6-digit OTP code
-        elif text.isdigit() and len(text) == 6:
-            auth.handle_otp(chat_id, text)
-            return Response(status=200)
 
-        # 5) /logout command
-        elif text.lower() == "/logout":
-            auth.handle_logout_command(chat_id)
-            return Response(status=200)
+def process_update(update_json):
+    """
+    Route a single Bale update to the matching handler and return its Response.
+    Shared by the webhook view and the background dispatcher workers.
 
-        # 6) /startchat command
-        elif text.lower() == "/startchat":
-            return start_chat(chat_id)
+    The user row (normally a cache hit) is read once; its dialog_state picks
+    the command (router.route) and the handler is looked up in COMMAND_HANDLERS.
+    Each stage is timed into the update's trace (see metrics.py).
+    """
+    with trace_update(update_json.get("update_id")):
+        if "message" in update_json:
+            message = update_json["message"]
+            chat_id = str(message["chat"]["id"])
+            text = message.get("text", "").strip()
+            with span("user_load"):
+                user = get_cached_user(chat_id)
+            with span("route"):
+                command = route(user.dialog_state if user else BaleUser.DIALOG_IDLE, text)
+            label_update(command, user)
+            return COMMAND_HANDLERS[command](chat_id, text, user)
+
+        # If the incoming structure isn't what we expect, just respond 200
+        return Response(status=200)
 
-        # 7) '#' symbol to end chat
-        elif text == "#":
-            return end_chat(chat_id)
 
-        # 8) Check if input is a digit for role selection/confirmation
-        elif text.isdigit():
-            return handle_role_selection_or_confirmation(chat_id, text)
+async def bale_webhook_async_view(request, token=""):
+    """
+    Native asyncio variant of bale_webhook_view, meant to be served under ASGI.
 
-        # 9) Otherwise, treat this as a normal user message
-        else:
-            return handle_chat_message(chat_id, text)
+    The chat and phone-number paths await TalkBot, Bale and Kavenegar through
+    the shared httpx.AsyncClient, so a single worker process can keep hundreds
+    of LLM round-trips in flight. The remaining short commands reuse the sync
+    handlers in a worker thread.
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if not webhook_authorized(request, token):
+        return HttpResponse(status=403)
+    with trace_update():
+        try:
+            with span("parse"):
+                update_json = fastpath.loads(request.body or b"{}")
+        except ValueError:
+            return HttpResponse(status=400)
+
+        with record_update(update_json):
+            # Duplicates are dropped without waiting: blocking here would stall the event loop
+            update_id = update_json.get("update_id")
+            if update_id is not None:
+                if update_dedup.alias:
+                    # The shared backend may be the database cache
+                    claimed = await sync_to_async(update_dedup.begin)(update_id, wait=False)
+                else:
+                    claimed = update_dedup.begin(update_id, wait=False)
+                if not claimed:
+                    return HttpResponse(status=200)
+
+            # Same per-chat lease as run_claimed_update, waited for without blocking the loop
+            lease = get_chat_lease()
+            key = update_chat_key(update_json) if lease else None
+            token = await lease.aacquire(key) if lease else None
+            try:
+                status = await aprocess_update(update_json)
+            except Exception:
+                if update_id is not None:
+                    await sync_to_async(update_dedup.release)(update_id)
+                raise
+            finally:
+                if lease:
+                    await lease.arelease(key, token)
+            return finish_update(update_id, HttpResponse(status=status))
+
+# Bale posts without a CSRF token; set the flag directly because
+# csrf_exempt only learned to wrap coroutine views in Django 5.0.
+bale_webhook_async_view.csrf_exempt = True
+
+
+def metrics_view(request):
+    """
+    Stage latency histograms and component stats in the Prometheus text format.
+    Scrapers must send "Authorization: Bearer <METRICS_TOKEN>"; without a
+    token configured the endpoint is off, since the stats name users' chats.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not getattr(settings, 'METRICS_ENABLED', True) or not token:
+        return HttpResponse(status=404)
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
-    # If the incoming structure isn't what we expect, just respond 200
-    return Response(status=200)
+
+async def aprocess_update(update_json):
+    """
+    Async counterpart of process_update. Returns the HTTP status code.
+    """
+    message = update_json.get("message")
+    if not message:
+        return 200
+
+    with trace_update(update_json.get("update_id")):
+        chat_id = str(message["chat"]["id"])
+        text = message.get("text", "").strip()
+        with span("user_load"):
+            user = await sync_to_async(get_cached_user)(chat_id)
+        with span("route"):
+            command = route(user.dialog_state if user else BaleUser.DIALOG_IDLE, text)
+        label_update(command, user)
+
+        if command == "chat":
+            return await ahandle_chat_message(chat_id, text, user)
+        elif command == "phone":
+            await auth.ahandle_phone_number(chat_id, text, user)
+            return 200
+
+        return await sync_to_async(_handle_in_thread, thread_sensitive=False)(command, chat_id, text, user)
 
 
-def handle_start(chat_id):
+def _handle_in_thread(command, chat_id, text, user):
+    close_old_connections()
+    try:
+        return COMMAND_HANDLERS[command](chat_id, text, user).status_code
+    finally:
+        close_old_connections()
+
+
+def handle_start(chat_id, user=None):
     """
     /start command to greet the user and show basic info.
     """
@@ -83,11 +296,12 @@ def handle_start(chat_id):
     send_message_to_bale(chat_id, welcome_message)
     return Response(status=200)
 
-def start_chat(chat_id):
+def start_chat(chat_id, user=None):
     """
     Start chat if user is authenticated. Sends the list of roles for selection.
     """
-    user = BaleUser.objects.filter(chat_id=chat_id).first()
+    if user is None:
+        user = get_cached_user(chat_id)
     if not user:
         send_message_to_bale(
             chat_id,
@@ -109,15 +323,17 @@ def start_chat(chat_id):
         f"{role_list}\n\n"
         "شماره مورد نظر را وارد کنید."
     )
+    user.set_dialog_state(BaleUser.DIALOG_CHOOSING_ROLE)
     send_message_to_bale(chat_id, message)
     return Response(status=200)
 
-def handle_role_selection_or_confirmation(chat_id, text):
+def handle_role_selection_or_confirmation(chat_id, text, user=None):
     """
     If the number is 1 or 0, user might be confirming or rejecting the role.
     If another number, user might be selecting a role from the list.
     """
-    user = BaleUser.objects.filter(chat_id=chat_id).first()
+    if user is None:
+        user = get_cached_user(chat_id)
     if not user:
         send_message_to_bale(
             chat_id,
@@ -135,6 +351,7 @@ def handle_role_selection_or_confirmation(chat_id, text):
     if text == "1":
         # Confirm role
         if user.assistant_role:
+            user.set_dialog_state(BaleUser.DIALOG_CHATTING)
             send_message_to_bale(
                 chat_id,
                 f"نقش «{user.get_assistant_role_display()}» تأیید شد.\n"
@@ -150,7 +367,7 @@ def handle_role_selection_or_confirmation(chat_id, text):
 
     elif text == "0":
         # Reject role and re-select
-        return start_chat(chat_id)
+        return start_chat(chat_id, user)
 
     # Otherwise, user is selecting a role from the list
     roles = BaleUser.ASSISTANT_ROLES
@@ -159,7 +376,8 @@ def handle_role_selection_or_confirmation(chat_id, text):
         if 0 <= role_index < len(roles):
             role_value, role_label = roles[role_index]
             user.assistant_role = role_value
-            user.save()
+            user.dialog_state = BaleUser.DIALOG_CONFIRMING_ROLE
+            user.save(update_fields=['assistant_role', 'dialog_state'])
             send_message_to_bale(
                 chat_id,
                 f"نقش انتخاب‌شده: {role_label}\n"
@@ -175,85 +393,105 @@ def handle_role_selection_or_confirmation(chat_id, text):
 
     return Response(status=200)
 
-def handle_chat_message(chat_id, text):
+# What build_chat_request hands to the LLM call and to record_chat_reply
+ChatRequest = namedtuple('ChatRequest', ['user', 'session', 'bot_kwargs', 'cache_key'])
+
+def build_chat_request(chat_id, text, user=None):
     """
-    Handle a normal user message.
-    Only allowed if the user is authenticated and has selected/confirmed a role.
+    Load the user, check that they may chat, and assemble the talk_to_bot arguments.
+    The first message of a chat (no history) also gets a response cache key.
+    Returns (ChatRequest, None) on success, or (None, (status, reply)) when the
+    message must be rejected with the given reply.
     """
-    user = BaleUser.objects.filter(chat_id=chat_id).first()
+    if user is None:
+        user = get_cached_user(chat_id)
     if not user:
-        send_message_to_bale(
-            chat_id,
+        return None, (
+            400,
             "شما هنوز ثبت‌نام نکرده‌اید. لطفاً ابتدا دستور /login را وارد کنید."
         )
-        return Response(status=400)
 
     if not user.is_authenticated:
-        send_message_to_bale(
-            chat_id,
+        return None, (
+            400,
             "ابتدا باید وارد شوید. لطفاً دستور /login را وارد کنید."
         )
-        return Response(status=400)
 
     if not user.assistant_role:
-        send_message_to_bale(
-            chat_id,
+        return None, (
+            400,
             "شما هنوز نقشی انتخاب نکرده‌اید. دستور /startchat را ارسال کنید."
         )
-        return Response(status=400)
 
-    # Check daily limit
-    if user.current_message_count >= user.daily_message_limit:
-        send_message_to_bale(
-            chat_id,
+    # Check daily limit (cheap check on the loaded row; consume() below is the atomic one)
+    if quota.remaining(user) <= 0:
+        return None, (
+            400,
             "شما به حد پیام روزانه خود رسیده‌اید. لطفاً فردا دوباره تلاش کنید."
         )
-        return Response(status=400)
 
-    # Gather recent conversation history to provide memory
-    # Let's say we want the last 5 sessions for short-term memory.
-    # You can customize as needed:
-    recent_sessions = ChatSession.objects.filter(user=user).order_by('-created_at')[:5]
-    # We reverse them (oldest -> newest) for correct order
-    recent_sessions = reversed(recent_sessions)
-
-    user_messages = []
-    assistant_messages = []
-
-    for s in recent_sessions:
-        # Each session has user_message, bot_response
-        user_messages.append({
-            "role": "user",
-            "content": s.user_message
-        })
-        assistant_messages.append({
-            "role": "assistant",
-            "content": s.bot_response
-        })
+    # Gather recent conversation history of the active session to provide memory.
+    # ChatTurn.tail reads only the newest turns off the (user, session, created_at) index;
+    # turns already folded into the session summary are skipped.
+    with span("history"):
+        session = ChatSession.objects.filter(user=user, is_active=True).first()
+        recent_turns = []
+        if session is not None:
+            limit = getattr(settings, 'CHAT_HISTORY_TURNS', 5)
+            recent_turns = ChatTurn.objects.tail(user, session, limit=limit, since=session.summary_until)
+            journal = get_turn_journal()
+            if journal is not None:
+                # Turns of the last few seconds may still be waiting in the write-behind journal
+                recent_turns = journal.with_pending(recent_turns, session.pk, limit, since=session.summary_until)
 
     # We'll provide a system prompt that includes the user's assistant role description
     system_prompt = (
         f"{user.get_assistant_description()}\n"
         "شما یک دستیار هوشمند هستید؛ لطفاً ابتدا گام‌به‌گام فکر کنید ولی در نهایت خلاصه و مفید پاسخ دهید."
     )
+    if session is not None and session.summary:
+        system_prompt += f"\n\nخلاصه گفتگوی قبلی با کاربر:\n{session.summary}"
 
-    # Now call talk_to_bot with the new user message appended (if needed).
-    # We'll pass the history + new user message as the last item in user_messages.
-    # We'll do that by just appending the new text to user_messages:
-    user_messages.append({"role": "user", "content": text})
+    # Pack system prompt, newest-first history and the new message into the input budget
+    context = build_context(
+        system_prompt, recent_turns, text,
+        token_budget=getattr(settings, 'CHAT_CONTEXT_TOKEN_BUDGET', 1500)
+    )
+    if context.tokens_saved:
+        logger.debug(
+            "Chat %s: prompt %d tokens, %d saved by the context budget",
+            chat_id, context.prompt_tokens, context.tokens_saved
+        )
 
-    bot_response_data = talk_to_bot(
-        user_messages=user_messages,
-        assistant_messages=assistant_messages,
+    bot_kwargs = dict(
+        user_messages=context.user_messages,
+        assistant_messages=context.assistant_messages,
         system_role_description=system_prompt,
         model="gpt-4o-mini",
         max_tokens=user.token_limit,
         temperature=0.3
     )
 
+    # Reserve the message before calling TalkBot so concurrent messages can't overrun the limit
+    if not quota.consume(user):
+        return None, (
+            400,
+            "شما به حد پیام روزانه خود رسیده‌اید. لطفاً فردا دوباره تلاش کنید."
+        )
+    cache_key = cache_key_for(user, text, bot_kwargs["model"], has_history=session is not None)
+    return ChatRequest(user, session, bot_kwargs, cache_key), None
+
+def record_chat_reply(chat_request, text, bot_response_data):
+    """
+    Store the exchange as a new turn of the active session and return the text
+    to send back to the user. The message was already counted by build_chat_request.
+    """
+    user = chat_request.user
     # Extract final answer
     if "error" in bot_response_data:
         answer = f"خطایی رخ داد: {bot_response_data['error']}"
+        # Failed answers don't count against the daily limit
+        quota.release(user)
     else:
         answer = (
             bot_response_data.get("choices", [{}])[0]
@@ -261,33 +499,169 @@ def handle_chat_message(chat_id, text):
             .get("content", "پاسخی دریافت نشد.")
         )
 
-    # Create/Update the active chat session
-    session, _ = ChatSession.objects.get_or_create(user=user, is_active=True)
-    session.user_message = text
-    session.bot_response = answer
-    # Use the roles from BaleUser
-    session.assistant_role = user.assistant_role
-    session.system_role = user.system_role
-    session.save()
-
-    # Increment message count
-    user.increment_message_count()
-
-    # Send response to Bale
-    remaining = user.daily_message_limit - user.current_message_count
+    # Open a session on the first message (it keeps that first exchange and the roles)
+    session = chat_request.session
+    with span("persist"):
+        if session is None:
+            session, _ = ChatSession.objects.get_or_create(
+                user=user,
+                is_active=True,
+                defaults={
+                    "user_message": text,
+                    "bot_response": answer,
+                    "assistant_role": user.assistant_role,
+                    "system_role": user.system_role,
+                }
+            )
+        turn = ChatTurn(
+            user=user,
+            session=session,
+            user_message=text,
+            bot_response=answer,
+            assistant_role=user.assistant_role,
+        )
+        # With CHAT_WRITE_BEHIND the turn is journaled and bulk-inserted after the reply
+        journal = get_turn_journal()
+        if journal is None or not journal.append(turn):
+            turn.save()
+    if chat_request.session is not None:
+        # Long chats: compress older turns in the background (never on this request)
+        maybe_schedule_summary(session)
+
+    remaining = quota.remaining(user)
     final_text = (
         f"{answer}\n\n"
         f"پیام‌های باقی‌مانده امروز شما: {remaining}\n"
         "برای پایان چت علامت # را ارسال کنید."
     )
-    send_message_to_bale(chat_id, final_text)
+    return final_text
+
+def handle_chat_message(chat_id, text, user=None):
+    """
+    Handle a normal user message.
+    Only allowed if the user is authenticated and has selected/confirmed a role.
+    """
+    chat_request, rejection = build_chat_request(chat_id, text, user)
+    if rejection:
+        status, reply = rejection
+        send_message_to_bale(chat_id, reply)
+        return Response(status=status)
+    bot_kwargs = chat_request.bot_kwargs
+
+    message_id = None
+    bot_response_data = cached_reply(chat_request)
+    if bot_response_data is None:
+        started = time.monotonic()
+        answer = None
+        complete = True
+        # While streaming, the "send" spans of the relayed chunks fall inside this one
+        with span("llm"):
+            if getattr(settings, 'TALKBOT_STREAMING', False):
+                answer, message_id, complete = relay_streamed_reply(chat_id, bot_kwargs)
+
+            if answer is None:
+                # One-shot path (streaming disabled or unavailable)
+                bot_response_data = talk_to_bot(**bot_kwargs)
+        if answer is not None:
+            bot_response_data = {"choices": [{"message": {"content": answer}}]}
+        if complete:
+            cache_reply(chat_request, bot_response_data, time.monotonic() - started)
+    final_text = record_chat_reply(chat_request, text, bot_response_data)
+
+    # Send response to Bale
+    if message_id is not None:
+        edit_message_in_bale(chat_id, message_id, final_text)
+    else:
+        send_message_to_bale(chat_id, final_text)
     return Response(status=200)
 
-def end_chat(chat_id):
+def relay_streamed_reply(chat_id, bot_kwargs):
+    """
+    Stream the TalkBot answer to the user while it is being generated.
+    The first text chunk is sent as a new Bale message right away and then
+    updated with editMessageText at most once per BALE_EDIT_INTERVAL seconds.
+    Returns (answer, message_id, complete); answer is None when nothing could be
+    streamed, so the caller falls back to the one-shot talk_to_bot path, and
+    complete is False when the stream broke off midway. When the first chunk
+    cannot be sent right away (rate limited or Bale unreachable) the rest of
+    the stream is still read, and message_id is None: the caller sends the
+    whole answer once instead of asking TalkBot again.
+    """
+    interval = getattr(settings, 'BALE_EDIT_INTERVAL', 1.0)
+    answer = ""
+    message_id = None
+    relaying = True
+    last_update = 0.0
+    try:
+        for delta in stream_talk_to_bot(**bot_kwargs):
+            answer += delta
+            now = time.monotonic()
+            if not relaying:
+                continue
+            if message_id is None:
+                if not answer.strip():
+                    continue
+                # Not queued: a partial message delivered later would become a second answer
+                message_id = bale_message_id(send_message_to_bale(chat_id, answer, queue=False))
+                if message_id is None:
+                    relaying = False
+                last_update = now
+            elif now - last_update >= interval:
+                edit_message_in_bale(chat_id, message_id, answer, final=False)
+                last_update = now
+    except StreamingUnavailable as e:
+        if message_id is None:
+            # Nothing reached the user yet: the one-shot call can still give a whole answer
+            return None, None, False
+        answer += f"\n\n(پاسخ ناقص ماند: {e})"
+        return answer, message_id, False
+
+    if not answer.strip():
+        return None, None, False
+    return answer, message_id, True
+
+def cached_reply(chat_request):
+    """
+    Return the cached TalkBot response for a first message, or None.
+    """
+    if chat_request.cache_key is None:
+        return None
+    return response_cache.get(chat_request.cache_key)
+
+def cache_reply(chat_request, bot_response_data, elapsed):
+    """
+    Remember a TalkBot response for later identical first messages (errors are skipped).
+    """
+    if chat_request.cache_key is not None:
+        response_cache.put(chat_request.cache_key, bot_response_data, elapsed)
+
+async def ahandle_chat_message(chat_id, text, user=None):
+    """
+    Async counterpart of handle_chat_message. Returns the HTTP status code.
+    """
+    chat_request, rejection = await sync_to_async(build_chat_request)(chat_id, text, user)
+    if rejection:
+        status, reply = rejection
+        await asend_message_to_bale(chat_id, reply)
+        return status
+
+    bot_response_data = await sync_to_async(cached_reply)(chat_request)
+    if bot_response_data is None:
+        started = time.monotonic()
+        with span("llm"):
+            bot_response_data = await atalk_to_bot(**chat_request.bot_kwargs)
+        await sync_to_async(cache_reply)(chat_request, bot_response_data, time.monotonic() - started)
+    final_text = await sync_to_async(record_chat_reply)(chat_request, text, bot_response_data)
+
+    await asend_message_to_bale(chat_id, final_text)
+    return 200
+
+def end_chat(chat_id, user=None):
     """
     End the active chat session when user sends '#'.
     """
-    user = BaleUser.objects.filter(chat_id=chat_id).first()
+    if user is None:
+        user = get_cached_user(chat_id)
     if not user:
         send_message_to_bale(
             chat_id,
@@ -298,7 +672,8 @@ def end_chat(chat_id):
     session = ChatSession.objects.filter(user=user, is_active=True).first()
     if session:
         session.is_active = False
-        session.save()
+        session.save(update_fields=['is_active'])
+        user.set_dialog_state(BaleUser.DIALOG_IDLE)
         send_message_to_bale(
             chat_id,
             "چت شما پایان یافت. برای شروع چت جدید دستور /startchat را ارسال کنید."
@@ -306,3 +681,34 @@ def end_chat(chat_id):
     else:
         send_message_to_bale(chat_id, "شما در حال حاضر چت فعالی ندارید.")
     return Response(status=200)
+
+def _reply(handler):
+    # Adapt the auth handlers, which only send messages, to the table signature
+    def wrapper(chat_id, text, user):
+        handler(chat_id, text, user)
+        return Response(status=200)
+    return wrapper
+
+def invalid_phone(chat_id, text, user):
+    send_message_to_bale(chat_id, "لطفاً شماره موبایل معتبر (مانند 09123456789) وارد کنید.")
+    return Response(status=200)
+
+def invalid_otp(chat_id, text, user):
+    send_message_to_bale(chat_id, "لطفاً کد تأیید ۶ رقمی ارسال‌شده را وارد کنید.")
+    return Response(status=200)
+
+# Command (see router.route) -> handler(chat_id, text, user). The lambdas look
+# the handlers up on every call so they can be patched in tests.
+COMMAND_HANDLERS = {
+    "start": lambda chat_id, text, user: handle_start(chat_id, user),
+    "login": _reply(lambda chat_id, text, user: auth.handle_login_command(chat_id, user)),
+    "phone": _reply(lambda chat_id, text, user: auth.handle_phone_number(chat_id, text, user)),
+    "invalid_phone": lambda chat_id, text, user: invalid_phone(chat_id, text, user),
+    "otp": _reply(lambda chat_id, text, user: auth.handle_otp(chat_id, text, user)),
+    "invalid_otp": lambda chat_id, text, user: invalid_otp(chat_id, text, user),
+    "logout": _reply(lambda chat_id, text, user: auth.handle_logout_command(chat_id, user)),
+    "startchat": lambda chat_id, text, user: start_chat(chat_id, user),
+    "end_chat": lambda chat_id, text, user: end_chat(chat_id, user),
+    "role": lambda chat_id, text, user: handle_role_selection_or_confirmation(chat_id, text, user),
+    "chat": lambda chat_id, text, user: handle_chat_message(chat_id, text, user),
+}
@@ -91,12 +91,60 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'mybotproject.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database: SQLite by default; set DB_ENGINE=postgresql (and DB_NAME, DB_USER, ...)
+# for production. Connections are kept open for DB_CONN_MAX_AGE seconds and
+# checked before reuse.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'docai_balebot'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': (os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'),
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
+    }
+    # psycopg 3 connection pool (Django 5.1+); use instead of CONN_MAX_AGE
+    if os.getenv('DB_POOL', 'False') == 'True':
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+        }
+
+    # Optional read replica for admin pages and reports (auth_bot.db.ReplicaRouter);
+    # the bot itself always reads from the primary
+    if os.getenv('DB_REPLICA_HOST'):
+        DATABASES['replica'] = dict(
+            DATABASES['default'],
+            HOST=os.getenv('DB_REPLICA_HOST'),
+            PORT=os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+            OPTIONS=dict(DATABASES['default']['OPTIONS']),
+            TEST={'MIRROR': 'default'},
+        )
+        DATABASE_ROUTERS = ['auth_bot.db.ReplicaRouter']
+        MIDDLEWARE.append('auth_bot.db.ReplicaReadsMiddleware')
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        }
     }
-}
+
+# SQLite only (see auth_bot/db.py): journal mode and how long (ms) a writer
+# waits for the lock before failing with "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'wal')
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '20000'))
 
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
@@ -118,3 +166,223 @@ REST_FRAMEWORK = {
 TALKBOT_API_KEY = os.getenv('TALKBOT_API_KEY', '')
 KAVEH_NEGAR_API_KEY = os.getenv('KAVEH_NEGAR_API_KEY', '')
 BALE_BOT_TOKEN = os.getenv('BALE_BOT_TOKEN', '')
+
+# Upstream endpoints (overridable so benchmarks can point at local stub servers)
+TALKBOT_API_URL = os.getenv('TALKBOT_API_URL', 'https://api.talkbot.ir/v1/chat/completions')
+BALE_API_BASE_URL = os.getenv('BALE_API_BASE_URL', 'https://tapi.bale.ai')
+KAVENEGAR_API_BASE_URL = os.getenv('KAVENEGAR_API_BASE_URL', 'https://api.kavenegar.com')
+
+# Outbound HTTP (TalkBot, Bale, Kavenegar): per-host keep-alive pools,
+# timeouts in seconds and jittered retries for failures that are safe to replay.
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20'))
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv('HTTP_ASYNC_MAX_CONNECTIONS', '500'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+TALKBOT_READ_TIMEOUT = float(os.getenv('TALKBOT_READ_TIMEOUT', '60'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.2'))
+
+# Number of web worker processes (gunicorn reads the same variable); the
+# auth_bot system checks warn about per-process state when it is above 1
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# BaleUser lookups by chat_id go through a read-through cache. "local" is a
+# per-process LRU; "shared" uses the USER_CACHE_ALIAS entry of CACHES
+# (e.g. Redis) so all workers see the same invalidations.
+# Running more than one worker process? "local" lets a worker serve a stale
+# dialog_state / is_authenticated for up to USER_CACHE_TTL seconds after
+# another worker changed it: use "shared" on a cache all workers share.
+# manage.py check warns about this when WEB_CONCURRENCY > 1.
+USER_CACHE_ENABLED = (os.getenv('USER_CACHE_ENABLED', 'True') == 'True')
+USER_CACHE_BACKEND = os.getenv('USER_CACHE_BACKEND', 'local')
+USER_CACHE_ALIAS = os.getenv('USER_CACHE_ALIAS', 'default')
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '300'))
+
+# Number of previous turns of the active chat considered as memory, and the
+# input-token budget (system prompt + history + new message) they are packed into
+CHAT_HISTORY_TURNS = int(os.getenv('CHAT_HISTORY_TURNS', '5'))
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv('CHAT_CONTEXT_TOKEN_BUDGET', '1500'))
+
+# Rolling summary: every CHAT_SUMMARY_EVERY turns, older turns (all but the newest
+# CHAT_SUMMARY_KEEP_TURNS) are folded into ChatSession.summary by a background worker
+CHAT_SUMMARY_ENABLED = (os.getenv('CHAT_SUMMARY_ENABLED', 'True') == 'True')
+CHAT_SUMMARY_EVERY = int(os.getenv('CHAT_SUMMARY_EVERY', '8'))
+CHAT_SUMMARY_KEEP_TURNS = int(os.getenv('CHAT_SUMMARY_KEEP_TURNS', '4'))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', '300'))
+CHAT_SUMMARY_WORKERS = int(os.getenv('CHAT_SUMMARY_WORKERS', '2'))
+
+# Cache of TalkBot answers to first messages, per assistant/system role.
+# RESPONSE_CACHE_SIMILARITY (0-1, 0 = off, the default) also serves near-duplicate
+# questions, never across different numbers or negations;
+# RESPONSE_CACHE_BYPASS_ROLES is a comma-separated list of roles never cached.
+RESPONSE_CACHE_ENABLED = (os.getenv('RESPONSE_CACHE_ENABLED', 'True') == 'True')
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'local')
+RESPONSE_CACHE_ALIAS = os.getenv('RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2000'))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0'))
+RESPONSE_CACHE_INDEX_SIZE = int(os.getenv('RESPONSE_CACHE_INDEX_SIZE', '500'))
+RESPONSE_CACHE_BYPASS_ROLES = [
+    role for role in os.getenv('RESPONSE_CACHE_BYPASS_ROLES', '').split(',') if role
+]
+
+# Stream TalkBot answers into Bale: send the first chunk, then edit the
+# message at most once per BALE_EDIT_INTERVAL seconds as tokens arrive.
+TALKBOT_STREAMING = (os.getenv('TALKBOT_STREAMING', 'False') == 'True')
+BALE_EDIT_INTERVAL = float(os.getenv('BALE_EDIT_INTERVAL', '1.0'))
+
+# Webhook processing mode: "sync" runs the handlers inside the HTTP request,
+# "queue" acknowledges the update immediately and lets background workers run them.
+BALE_WEBHOOK_MODE = os.getenv('BALE_WEBHOOK_MODE', 'sync')
+BALE_DISPATCH_WORKERS = int(os.getenv('BALE_DISPATCH_WORKERS', '8'))
+BALE_DISPATCH_QUEUE_SIZE = int(os.getenv('BALE_DISPATCH_QUEUE_SIZE', '1000'))
+BALE_DISPATCH_PUT_TIMEOUT = float(os.getenv('BALE_DISPATCH_PUT_TIMEOUT', '0.05'))
+# "chat" hashes each chat onto one worker lane so its updates run in order;
+# "none" uses a single shared queue
+BALE_DISPATCH_ORDERING = os.getenv('BALE_DISPATCH_ORDERING', 'chat')
+# Cross-node per-chat lock in the CHAT_LEASE_ALIAS cache (must be shared, e.g. Redis);
+# renewed every CHAT_LEASE_TTL / 3 seconds while held, so the TTL only bounds a dead holder
+CHAT_LEASE_ENABLED = (os.getenv('CHAT_LEASE_ENABLED', 'False') == 'True')
+CHAT_LEASE_ALIAS = os.getenv('CHAT_LEASE_ALIAS', 'default')
+CHAT_LEASE_TTL = int(os.getenv('CHAT_LEASE_TTL', '60'))
+CHAT_LEASE_WAIT = float(os.getenv('CHAT_LEASE_WAIT', '30'))
+
+# Drop redelivered Bale updates by update_id. 'shared' also claims ids in the
+# UPDATE_DEDUP_ALIAS cache so several worker processes agree.
+UPDATE_DEDUP_BACKEND = os.getenv('UPDATE_DEDUP_BACKEND', 'local')
+UPDATE_DEDUP_ALIAS = os.getenv('UPDATE_DEDUP_ALIAS', 'default')
+UPDATE_DEDUP_SIZE = int(os.getenv('UPDATE_DEDUP_SIZE', '10000'))
+UPDATE_DEDUP_TTL = int(os.getenv('UPDATE_DEDUP_TTL', '3600'))
+UPDATE_DEDUP_WAIT = float(os.getenv('UPDATE_DEDUP_WAIT', '30'))
+
+# Long-polling ingestion (manage.py poll_updates), an alternative to the webhook
+POLL_WORKERS = int(os.getenv('POLL_WORKERS', '8'))
+POLL_LIMIT = int(os.getenv('POLL_LIMIT', '100'))
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '30'))
+
+# Outbound Bale calls (sendMessage / editMessageText): global and per-chat token
+# buckets, how long a caller may wait for its turn, and the bounded retry queue
+# used for longer waits and 429 retry_after replies
+BALE_SEND_RATE = float(os.getenv('BALE_SEND_RATE', '25'))
+BALE_SEND_BURST = int(os.getenv('BALE_SEND_BURST', '30'))
+BALE_CHAT_SEND_RATE = float(os.getenv('BALE_CHAT_SEND_RATE', '1'))
+BALE_CHAT_SEND_BURST = int(os.getenv('BALE_CHAT_SEND_BURST', '3'))
+BALE_SEND_MAX_WAIT = float(os.getenv('BALE_SEND_MAX_WAIT', '5'))
+BALE_SEND_QUEUE_SIZE = int(os.getenv('BALE_SEND_QUEUE_SIZE', '1000'))
+BALE_SEND_MAX_ATTEMPTS = int(os.getenv('BALE_SEND_MAX_ATTEMPTS', '5'))
+BALE_SEND_MIN_RETRY_DELAY = float(os.getenv('BALE_SEND_MIN_RETRY_DELAY', '0.5'))
+
+# One-time login codes live hashed in the OTP_CACHE_ALIAS cache for OTP_TTL
+# seconds (the default cache is per process: with several worker processes
+# point it at a shared backend such as Redis, or codes and limits split) and
+# allow OTP_MAX_ATTEMPTS guesses. Token buckets (burst, refills per hour) limit
+# codes sent per phone number and per chat, and guesses per chat.
+OTP_CACHE_ALIAS = os.getenv('OTP_CACHE_ALIAS', 'default')
+OTP_TTL = int(os.getenv('OTP_TTL', '300'))
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', '5'))
+OTP_PHONE_BURST = int(os.getenv('OTP_PHONE_BURST', '3'))
+OTP_PHONE_PER_HOUR = float(os.getenv('OTP_PHONE_PER_HOUR', '5'))
+OTP_CHAT_BURST = int(os.getenv('OTP_CHAT_BURST', '5'))
+OTP_CHAT_PER_HOUR = float(os.getenv('OTP_CHAT_PER_HOUR', '10'))
+OTP_VERIFY_BURST = int(os.getenv('OTP_VERIFY_BURST', '10'))
+OTP_VERIFY_PER_HOUR = float(os.getenv('OTP_VERIFY_PER_HOUR', '30'))
+
+# OTP SMS delivery. "queue" hands the Kavenegar call to OTP_SMS_WORKERS background
+# threads and answers the user at once; "sync" sends inside the request. Each SMS
+# gets up to OTP_SMS_MAX_ATTEMPTS tries, and after OTP_SMS_BREAKER_FAILURES
+# consecutive failures codes fail fast for OTP_SMS_BREAKER_RESET seconds.
+OTP_SMS_MODE = os.getenv('OTP_SMS_MODE', 'queue')
+OTP_SMS_WORKERS = int(os.getenv('OTP_SMS_WORKERS', '4'))
+OTP_SMS_QUEUE_SIZE = int(os.getenv('OTP_SMS_QUEUE_SIZE', '500'))
+OTP_SMS_MAX_ATTEMPTS = int(os.getenv('OTP_SMS_MAX_ATTEMPTS', '3'))
+OTP_SMS_RETRY_BACKOFF = float(os.getenv('OTP_SMS_RETRY_BACKOFF', '0.5'))
+OTP_SMS_BREAKER_FAILURES = int(os.getenv('OTP_SMS_BREAKER_FAILURES', '5'))
+OTP_SMS_BREAKER_RESET = float(os.getenv('OTP_SMS_BREAKER_RESET', '30'))
+KAVENEGAR_READ_TIMEOUT = float(os.getenv('KAVENEGAR_READ_TIMEOUT', '5'))
+
+# TalkBot resilience. Each endpoint gets an AIMD in-flight limit between
+# TALKBOT_MIN_CONCURRENCY and TALKBOT_MAX_CONCURRENCY (keep the maximum below the
+# worker count so commands like /start never wait behind the LLM), lowered on
+# 429/5xx/timeouts or calls slower than TALKBOT_LATENCY_TARGET seconds. Callers
+# wait at most TALKBOT_QUEUE_TIMEOUT seconds for a slot. Each model has a circuit
+# breaker; TALKBOT_FALLBACKS is a comma-separated list of "model" or
+# "model@url" entries tried in order when the primary is unavailable.
+# These limits are for the sync (WSGI / dispatcher thread) path. The asyncio
+# path (/auth/bale-webhook-async/) has no worker pool to protect, so it gets its
+# own limiter per endpoint: TALKBOT_ASYNC_CONCURRENCY to start with, up to
+# TALKBOT_ASYNC_MAX_CONCURRENCY in flight per process (keep it below
+# HTTP_ASYNC_MAX_CONNECTIONS), waiting at most TALKBOT_ASYNC_QUEUE_TIMEOUT.
+TALKBOT_CONCURRENCY = int(os.getenv('TALKBOT_CONCURRENCY', '4'))
+TALKBOT_MIN_CONCURRENCY = int(os.getenv('TALKBOT_MIN_CONCURRENCY', '1'))
+TALKBOT_MAX_CONCURRENCY = int(os.getenv('TALKBOT_MAX_CONCURRENCY', '6'))
+TALKBOT_LATENCY_TARGET = float(os.getenv('TALKBOT_LATENCY_TARGET', '20'))
+TALKBOT_QUEUE_TIMEOUT = float(os.getenv('TALKBOT_QUEUE_TIMEOUT', '2'))
+TALKBOT_ASYNC_CONCURRENCY = int(os.getenv('TALKBOT_ASYNC_CONCURRENCY', '50'))
+TALKBOT_ASYNC_MAX_CONCURRENCY = int(os.getenv('TALKBOT_ASYNC_MAX_CONCURRENCY', '200'))
+TALKBOT_ASYNC_QUEUE_TIMEOUT = float(os.getenv('TALKBOT_ASYNC_QUEUE_TIMEOUT', '10'))
+TALKBOT_BREAKER_FAILURES = int(os.getenv('TALKBOT_BREAKER_FAILURES', '5'))
+TALKBOT_BREAKER_RESET = float(os.getenv('TALKBOT_BREAKER_RESET', '30'))
+TALKBOT_FALLBACKS = [
+    entry.strip() for entry in os.getenv('TALKBOT_FALLBACKS', '').split(',') if entry.strip()
+]
+
+# Hedged TalkBot calls: when a call is still unanswered after the
+# TALKBOT_HEDGE_PERCENTILE of recent latencies (TALKBOT_HEDGE_DELAY seconds until
+# TALKBOT_HEDGE_MIN_SAMPLES calls are known), send a second one (to
+# TALKBOT_HEDGE_MODEL, "model" or "model@url", if set) and use whichever answers
+# first. TALKBOT_HEDGE_BUDGET caps the extra calls as a fraction of all calls.
+TALKBOT_HEDGE_ENABLED = (os.getenv('TALKBOT_HEDGE_ENABLED', 'False') == 'True')
+TALKBOT_HEDGE_MODEL = os.getenv('TALKBOT_HEDGE_MODEL', '')
+TALKBOT_HEDGE_PERCENTILE = float(os.getenv('TALKBOT_HEDGE_PERCENTILE', '95'))
+TALKBOT_HEDGE_DELAY = float(os.getenv('TALKBOT_HEDGE_DELAY', '10'))
+TALKBOT_HEDGE_MIN_DELAY = float(os.getenv('TALKBOT_HEDGE_MIN_DELAY', '0.5'))
+TALKBOT_HEDGE_MIN_SAMPLES = int(os.getenv('TALKBOT_HEDGE_MIN_SAMPLES', '20'))
+TALKBOT_HEDGE_BUDGET = float(os.getenv('TALKBOT_HEDGE_BUDGET', '0.05'))
+# Threads for hedges only (primaries never wait for them); no free thread, no hedge
+TALKBOT_HEDGE_WORKERS = int(os.getenv('TALKBOT_HEDGE_WORKERS', '16'))
+
+# Metrics: GET /auth/metrics/ serves per-stage latency histograms
+# (parse, user_load, route, history, llm, persist, send) and component stats
+# in the Prometheus text format to scrapers that send METRICS_TOKEN as a bearer
+# token; the endpoint answers 404 until METRICS_TOKEN is set.
+# Updates slower than TRACE_SLOW_SECONDS (0 = off), plus a TRACE_SAMPLE_RATE
+# fraction of all updates, are logged with their stage timings to the
+# "auth_bot.trace" logger.
+METRICS_ENABLED = (os.getenv('METRICS_ENABLED', 'True') == 'True')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', '0'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+
+# Traffic recording: with TRAFFIC_RECORD_PATH set (e.g. "traffic-{pid}.jsonl.gz"),
+# the webhook views append every update, scrubbed of names, phone numbers, OTPs
+# and message text, with the timings of the outbound calls it made, to a gzip
+# JSON-lines log for `manage.py replay_traffic`. Whole chats are sampled at
+# TRAFFIC_RECORD_SAMPLE_RATE; records are written every TRAFFIC_RECORD_FLUSH_EVERY updates.
+TRAFFIC_RECORD_PATH = os.getenv('TRAFFIC_RECORD_PATH', '')
+TRAFFIC_RECORD_SAMPLE_RATE = float(os.getenv('TRAFFIC_RECORD_SAMPLE_RATE', '1'))
+TRAFFIC_RECORD_FLUSH_EVERY = int(os.getenv('TRAFFIC_RECORD_FLUSH_EVERY', '50'))
+
+# Lean webhook: auth_bot.fastpath.WebhookFastPathMiddleware answers POSTs to
+# BALE_FAST_WEBHOOK_PATH ahead of every other middleware and without DRF/JWT,
+# parsing with orjson when it is installed. With BALE_WEBHOOK_SECRET set, every
+# webhook route (bale-webhook/, bale-webhook-async/, bale-webhook-fast/) answers
+# 403 unless the secret is the last path segment ("/auth/bale-webhook-fast/<secret>/")
+# or the X-Telegram-Bot-Api-Secret-Token header. An empty path turns it off.
+BALE_WEBHOOK_SECRET = os.getenv('BALE_WEBHOOK_SECRET', '')
+BALE_FAST_WEBHOOK_PATH = os.getenv('BALE_FAST_WEBHOOK_PATH', '/auth/bale-webhook-fast/')
+if BALE_FAST_WEBHOOK_PATH:
+    MIDDLEWARE.insert(0, 'auth_bot.fastpath.WebhookFastPathMiddleware')
+
+# Write-behind chat history: with CHAT_WRITE_BEHIND, chat turns are appended to a
+# local journal (CHAT_JOURNAL_PATH, one "{slot}" file per worker process) instead of
+# being inserted before the reply, and stored with bulk_create every
+# CHAT_JOURNAL_FLUSH_INTERVAL seconds or once CHAT_JOURNAL_FLUSH_SIZE are waiting.
+# Turns left in a journal by a crash are stored when the slot is opened again.
+# CHAT_JOURNAL_FSYNC also makes each append survive a power loss.
+CHAT_WRITE_BEHIND = (os.getenv('CHAT_WRITE_BEHIND', 'False') == 'True')
+CHAT_JOURNAL_PATH = os.getenv('CHAT_JOURNAL_PATH', str(BASE_DIR / 'chat-journal-{slot}.jsonl'))
+CHAT_JOURNAL_FLUSH_SIZE = int(os.getenv('CHAT_JOURNAL_FLUSH_SIZE', '100'))
+CHAT_JOURNAL_FLUSH_INTERVAL = float(os.getenv('CHAT_JOURNAL_FLUSH_INTERVAL', '1.0'))
+CHAT_JOURNAL_FSYNC = (os.getenv('CHAT_JOURNAL_FSYNC', 'False') == 'True')